@@ -1,22 +1,28 @@
 # base_agent.py
 import time
 import asyncio
+from collections import deque, namedtuple
+from itertools import islice
 from typing import Dict, List, Any, Optional, Callable
 
+# 訊息記錄槽：比逐條建立字典更省記憶體與分配開銷
+Message = namedtuple("Message", ["content", "sender", "timestamp"])
+
 class Agent:
     """基礎智能體類，所有專業代理繼承自此類"""
     
-    def __init__(self, name: str, skills: Optional[List[str]] = None):
+    def __init__(self, name: str, skills: Optional[List[str]] = None, max_history: int = 1000):
         """
         初始化代理
         
         Args:
             name: 代理名稱
             skills: 代理擁有的技能列表
+            max_history: 訊息歷史的最大保留條數
         """
         self.name = name
         self.skills = skills or []
-        self.messages = []  # 訊息歷史
+        self.messages = deque(maxlen=max_history)  # 訊息歷史（有界，超出自動淘汰最舊）
         self.kernel = None  # Semantic Kernel 實例
         self.context = {}  # 上下文字典，用於存儲持久信息
     
@@ -31,22 +37,14 @@ class Agent:
         Returns:
             回應訊息
         """
-        # 記錄訊息
-        self.messages.append({
-            "content": message, 
-            "sender": sender, 
-            "timestamp": time.time()
-        })
+        # 記錄訊息（monotonic_ns 為整數時鐘，比 time.time() 更快且不受校時影響）
+        self.messages.append(Message(message, sender, time.monotonic_ns()))
         
         # 處理訊息
         response = await self.process_message(message, sender)
         
         # 記錄回應
-        self.messages.append({
-            "content": response, 
-            "sender": self.name, 
-            "timestamp": time.time()
-        })
+        self.messages.append(Message(response, self.name, time.monotonic_ns()))
         
         return response
     
@@ -87,7 +85,7 @@ class Agent:
         """
         self.kernel = kernel
     
-    def get_recent_messages(self, count: int = 5) -> List[Dict[str, Any]]:
+    def get_recent_messages(self, count: int = 5) -> List[Message]:
         """
         獲取最近的訊息
         
@@ -97,11 +95,12 @@ class Agent:
         Returns:
             最近的訊息列表
         """
-        return self.messages[-count:] if len(self.messages) >= count else self.messages
+        start = max(0, len(self.messages) - count)
+        return list(islice(self.messages, start, len(self.messages)))
     
     def clear_messages(self):
         """清除所有訊息歷史"""
-        self.messages = []
+        self.messages.clear()
 
     def update_context(self, key: str, value: Any):
         """更新代理上下文"""
@@ -1,16 +1,28 @@
 import os
 import sys
+import ast
 import asyncio
+import hashlib
 import traceback
-import subprocess
 import importlib
+import importlib.util
+import multiprocessing
+import concurrent.futures
 import re
 import io
+import math
+from difflib import unified_diff
 from typing import Dict, List, Any, Optional, Tuple
+from collections import OrderedDict, deque
+from contextlib import redirect_stdout, redirect_stderr
 from io import StringIO
 import pandas as pd
 from pathlib import Path
-import re
+
+try:
+    import resource  # 僅在 Unix 系統可用
+except ImportError:
+    resource = None
 
 from semantic_kernel.functions import KernelArguments
 from semantic_kernel import Kernel
@@ -18,25 +30,298 @@ from semantic_kernel.prompt_template import PromptTemplateConfig
 from semantic_kernel.prompt_template.input_variable import InputVariable
 from semantic_kernel.connectors.ai.open_ai import AzureChatPromptExecutionSettings
 from utils.environment_checker import EnvironmentChecker
+from utils.response_cache import ResponseCache
+from utils.persistent_cache import PersistentCache
+from utils.inference_worker import InferenceWorker
 from .base_agent import Agent
 
+# 模組級預編譯正則，避免在熱路徑上重複編譯
+_END_TASK_RE = re.compile(r"===\s*END TASK\s*\d+\s*===")
+_MISSING_MODULE_RE = re.compile(r"No module named '([^']+)'")
+
+# 執行結果中檔案路徑的提示短語，生成提示已要求按這些格式輸出
+_PATH_RE = re.compile(
+    r"(?:檔案已成功生成並保存到|保存到|保存在|文件路徑|已生成)[:：]\s*"
+    r"(['\"]?)([^\n'\"]+?\.[A-Za-z0-9]{1,6})\1"
+)
+
+# 訊息中的文件類型關鍵詞（不用 \b 邊界：中文字符也屬於 \w，
+# 會讓「生成pdf檔」這類混排文本匹配失敗）
+_FILE_TYPE_RE = re.compile(
+    r"(?<![a-z])(pdf|xlsx?|excel|docx?|word|csv|txt|pptx?|json|html)(?![a-z])",
+    re.IGNORECASE,
+)
+_FILE_TYPE_ALIASES = {"doc": "docx", "xls": "xlsx"}
+
+# 修復提示中錯誤訊息的字符預算：traceback 的關鍵信息在結尾，
+# 超長時只保留尾部，避免撐大提示詞
+_ERROR_CHAR_BUDGET = 2000
+
+# 代碼清理的字符映射表：不間斷空格轉空格、殘留 \r 轉換行、Tab 轉 4 空格
+_CODE_CLEAN_TABLE = str.maketrans({'\xa0': ' ', '\r': '\n', '\t': '    '})
+
+# 文件大小單位，依 1024 的冪次索引
+_SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB')
+
+# 各語言的輸入函數模式，合併為單一交替式正則，模組載入時編譯一次
+_INPUT_PATTERNS = {
+    language: re.compile("|".join(patterns))
+    for language, patterns in {
+        "python": [r"input\s*\(", r"sys\.stdin", r"fileinput"],
+        "javascript": [r"prompt\s*\(", r"readline", r"process\.stdin"],
+        "java": [r"Scanner", r"System\.in", r"BufferedReader"],
+        "c++": [r"cin\s*>>", r"getline", r"scanf"],
+        "c#": [r"Console\.Read", r"Console\.ReadLine"],
+    }.items()
+}
+
+# 代碼任務前綴詞（出現在訊息中時，取其後內容作為任務描述）
+_TASK_PREFIXES = ("請幫我寫代碼", "生成代碼", "寫一段程式", "代碼生成", "幫我寫", "實現", "開發")
+_TASK_PREFIX_RE = re.compile("|".join(map(re.escape, _TASK_PREFIXES)))
+_IMPORT_STMT_RE = re.compile(r'^\s*import\s+([a-zA-Z0-9_.,\s]+)', re.MULTILINE)
+_FROM_IMPORT_RE = re.compile(r'^\s*from\s+([a-zA-Z0-9_.]+)\s+import', re.MULTILINE)
+
+# 工作子進程內的已編譯代碼緩存（子進程是長駐的，跨任務保留）
+_WORKER_CODE_CACHE: Dict[str, Any] = {}
+
+# 工作子進程內的模組緩存：啟動時預熱常用模組，執行時只做字典查找
+_WORKER_MODULE_CACHE: Dict[str, Any] = {}
+
+# 工作子進程內的輸出緩衝池，重用 StringIO 對象減少分配
+_WORKER_BUF_POOL: deque = deque(maxlen=16)
+
+
+def _get_buf() -> StringIO:
+    """從池中取出（或新建）一個已清空的輸出緩衝"""
+    if _WORKER_BUF_POOL:
+        buf = _WORKER_BUF_POOL.pop()
+        buf.truncate(0)
+        buf.seek(0)
+        return buf
+    return StringIO()
+
+
+def _put_buf(buf: StringIO):
+    """將緩衝放回池中供下次重用"""
+    _WORKER_BUF_POOL.append(buf)
+
+# 啟動時預熱的常用模組（首次導入 pandas 等可能需要數百毫秒）
+_WORKER_PRELOAD_MODULES = (
+    "json", "csv", "math", "datetime", "pathlib", "collections",
+    "pandas", "numpy",
+)
+
+
+# 每個工作進程的單次任務 CPU 預算（秒），由初始化函數寫入
+_WORKER_CPU_SECONDS = 0
+
+
+def _arm_cpu_limit(cpu_seconds: int):
+    """
+    以當前累計用量為基準設置本次任務的 CPU 軟限制
+
+    RLIMIT_CPU 計的是進程的累計 CPU 時間：長駐工作進程若只在
+    初始化時設一次，額度會被歷次任務共同消耗，遲早在無辜任務
+    中途觸發 SIGXCPU。每次任務把軟限制設為「當前用量 + 預算」，
+    硬限制保持不設限，預算才是逐任務生效的。
+
+    Args:
+        cpu_seconds: 本次任務的 CPU 時間預算（秒）
+    """
+    if resource is None:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime) + cpu_seconds + 1
+    try:
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, resource.RLIM_INFINITY))
+    except (ValueError, OSError):
+        # 某些環境不允許調整限制，降級為不設限
+        pass
+
+
+def _init_exec_worker(cpu_seconds: int, memory_bytes: int):
+    """
+    工作子進程初始化：設置記憶體上限並記錄每任務 CPU 預算
+
+    Args:
+        cpu_seconds: 單次任務的 CPU 時間預算（秒）
+        memory_bytes: 虛擬記憶體上限（位元組）
+    """
+    global _WORKER_CPU_SECONDS
+    _WORKER_CPU_SECONDS = cpu_seconds
+
+    if resource is not None:
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+        except (ValueError, OSError):
+            # 某些環境不允許調整限制，降級為不設限
+            pass
+
+    # 預熱常用模組，讓後續執行的導入變成字典查找
+    for module_name in _WORKER_PRELOAD_MODULES:
+        try:
+            _WORKER_MODULE_CACHE[module_name] = importlib.import_module(module_name)
+        except ImportError:
+            pass
+
+
+def _run_user_code(code: str, pre_imports: List[str]) -> Dict[str, Any]:
+    """
+    在工作子進程中編譯並執行用戶代碼，捕獲輸出
+
+    Args:
+        code: 已清理的 Python 代碼
+        pre_imports: 需要預先導入到執行環境的模組名稱列表
+
+    Returns:
+        包含 stdout/stderr/result_repr/error 的字典
+    """
+    _arm_cpu_limit(_WORKER_CPU_SECONDS)
+    redirected_output = _get_buf()
+    redirected_error = _get_buf()
+
+    exec_globals: Dict[str, Any] = {
+        "os": os,
+        "sys": sys,
+        "Path": Path,
+        "result": None,
+    }
+
+    # 預先導入代碼中提到的模組（優先走緩存與 sys.modules，避免重複導入開銷）
+    for module_name in pre_imports:
+        module = _WORKER_MODULE_CACHE.get(module_name) or sys.modules.get(module_name)
+        if module is None:
+            try:
+                module = importlib.import_module(module_name)
+                _WORKER_MODULE_CACHE[module_name] = module
+            except ImportError:
+                # 如果模組無法導入，在執行時可能會引發錯誤
+                continue
+        exec_globals[module_name] = module
+
+    try:
+        # 查找或編譯代碼對象（按源碼哈希緩存）
+        code_hash = hashlib.blake2b(code.encode(), digest_size=16).hexdigest()
+        code_obj = _WORKER_CODE_CACHE.get(code_hash)
+        if code_obj is None:
+            code_obj = compile(code, "<agent>", "exec")
+            _WORKER_CODE_CACHE[code_hash] = code_obj
+
+        # 異常安全的輸出重定向，不需要手動換回 sys.stdout
+        with redirect_stdout(redirected_output), redirect_stderr(redirected_error):
+            exec(code_obj, exec_globals)
+
+        result_value = exec_globals.get("result")
+        return {
+            "stdout": redirected_output.getvalue(),
+            "stderr": redirected_error.getvalue(),
+            "result_repr": None if result_value is None else str(result_value),
+            "error": None,
+        }
+    except SyntaxError as e:
+        # 特別處理語法錯誤，附上代碼上下文
+        line_number = e.lineno if hasattr(e, 'lineno') else 0
+
+        code_lines = code.splitlines()
+        start_line = max(0, line_number - 3)
+        end_line = min(len(code_lines), line_number + 2)
+
+        context = "\n代碼上下文:\n"
+        for i in range(start_line, end_line):
+            if i < len(code_lines):
+                prefix = ">> " if i == line_number - 1 else "   "
+                context += f"{prefix}第 {i+1} 行: {code_lines[i]}\n"
+
+        return {
+            "stdout": redirected_output.getvalue(),
+            "stderr": redirected_error.getvalue(),
+            "result_repr": None,
+            "error": f"執行代碼出錯: SyntaxError 在第 {line_number} 行: {str(e)}\n{context}",
+        }
+    except Exception as e:
+        error_class = e.__class__.__name__
+        detail = str(e)
+        cl, exc, tb = sys.exc_info()
+
+        try:
+            tb_info = traceback.extract_tb(tb)
+            _, line_number, _, _ = tb_info[-1]
+        except:
+            line_number = "未知"
+
+        return {
+            "stdout": redirected_output.getvalue(),
+            "stderr": redirected_error.getvalue(),
+            "result_repr": None,
+            "error": f"執行代碼出錯: {error_class} 在第 {line_number} 行: {detail}",
+        }
+    finally:
+        _put_buf(redirected_output)
+        _put_buf(redirected_error)
+
+
 class CodeAgent(Agent):
     """處理代碼生成和執行的智能代理，支持多種程式語言和依賴管理，帶有自動錯誤修復和測試數據生成功能"""
+
+    # 提示模板配置為類級共享：所有實例只構建一次，註冊時按實例綁定到 Kernel
+    _code_gen_config: Optional[PromptTemplateConfig] = None
+    _batch_gen_config: Optional[PromptTemplateConfig] = None
+    _code_fix_config: Optional[PromptTemplateConfig] = None
+    _test_data_gen_config: Optional[PromptTemplateConfig] = None
+    _file_type_config: Optional[PromptTemplateConfig] = None
+    _file_path_config: Optional[PromptTemplateConfig] = None
     
-    def __init__(self, name: str = "CodeAgent"):
+    def __init__(self, name: str = "CodeAgent", code_cache_size: int = 128):
         """
         初始化代碼代理
-        
+
         Args:
             name: 代理名稱
+            code_cache_size: 代碼生成結果緩存的最大條目數
         """
         super().__init__(name, skills=["代碼生成", "代碼執行", "代碼解釋", "代碼除錯", "多語言支持", "依賴管理", "自動錯誤修復", "測試數據生成"])
         self.code_gen_function = None
         self.code_fix_function = None
         self.test_data_gen_function = None  # 新增：測試數據生成功能
+        self.file_type_function = None
+        self.file_path_function = None
         self.supported_languages = ["python", "javascript", "java", "c++", "c#", "go", "ruby", "php", "rust", "typescript", "bash", "r", "sql"]
         self.allow_installs = True  # 是否允許安裝新的依賴
         self.max_fix_attempts = 3   # 最大修復嘗試次數
+        # 批次處理設置：短時間內到達的多個代碼生成請求會合併為一次 LLM 調用
+        self.max_batch = 4          # 單次批量處理的最大請求數
+        self.max_wait_ms = 25       # 等待湊批的最長時間（毫秒）
+        self.batch_gen_function = None
+        self._gen_queue: Optional[asyncio.Queue] = None
+        self._batch_task: Optional[asyncio.Task] = None
+        # LLM 回應緩存：相同（正規化後）的提示直接命中，省去一次 LLM 調用
+        # 命名空間對應各功能（代碼生成、測試數據、文件類型檢測等）
+        self.code_cache_size = code_cache_size
+        self.response_cache = ResponseCache(max_items=code_cache_size)
+
+        # 文件類型判斷與路徑提取結果的持久化緩存（跨進程重啟重用，容量可經環境變數調整）
+        file_meta_cache_size = int(os.getenv("CODE_AGENT_FILE_CACHE_SIZE", "256"))
+        self.file_meta_cache = PersistentCache(
+            os.path.join("cache", "file_meta.json"), max_items=file_meta_cache_size
+        )
+        # 用戶代碼執行子進程池設置
+        self.exec_pool_size = 2       # 工作子進程數量
+        self.exec_timeout = 20        # 單次執行的掛鐘超時（秒）
+        self.exec_cpu_limit = 60      # 子進程 CPU 時間上限（秒）
+        self.exec_memory_limit = 2 * 1024 ** 3  # 子進程記憶體上限（位元組）
+        self._exec_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        # 代碼導入分析結果緩存（按源碼哈希）
+        self._imports_cache: Dict[str, List[str]] = {}
+        # 本次會話中已安裝過的套件，避免重複執行 pip
+        self._installed_packages: set = set()
+        # 已確認可用的模組：整個標準庫加常見預裝庫，檢查過的模組也會加入
+        self._available_modules: set = set(sys.stdlib_module_names) | {
+            "pandas", "numpy", "matplotlib",
+        }
+        # 環境檢查器單例，檢查結果帶 TTL 緩存
+        self.env_checker = EnvironmentChecker()
+        # LLM 調用微批次工作器：輔助功能的調用經由它統一派發
+        self.inference_worker = InferenceWorker()
     
     def setup_kernel(self, kernel: Kernel):
         """
@@ -47,8 +332,11 @@ class CodeAgent(Agent):
         """
         super().setup_kernel(kernel)
         self._register_code_gen_function()
+        self._register_batch_gen_function()
         self._register_code_fix_function()
         self._register_test_data_gen_function()  # 註冊測試數據生成功能
+        self._register_file_type_function()
+        self._register_file_path_function()
     
     def _register_code_gen_function(self):
         """註冊代碼生成功能"""
@@ -102,19 +390,22 @@ class CodeAgent(Agent):
         """
         
         # 代碼生成配置
-        code_gen_config = PromptTemplateConfig(
-            template=code_gen_prompt,
-            name="generateSmartCode",
-            template_format="semantic-kernel",
-            input_variables=[
-                InputVariable(name="task", description="需要通過代碼實現的任務", is_required=True),
-            ],
-            execution_settings=AzureChatPromptExecutionSettings(
-                service_id="default",
-                max_tokens=3000,
-                temperature=0.2,
+        code_gen_config = CodeAgent._code_gen_config
+        if code_gen_config is None:
+            code_gen_config = PromptTemplateConfig(
+                template=code_gen_prompt,
+                name="generateSmartCode",
+                template_format="semantic-kernel",
+                input_variables=[
+                    InputVariable(name="task", description="需要通過代碼實現的任務", is_required=True),
+                ],
+                execution_settings=AzureChatPromptExecutionSettings(
+                    service_id="default",
+                    max_tokens=3000,
+                    temperature=0.2,
+                )
             )
-        )
+            CodeAgent._code_gen_config = code_gen_config
         
         # 添加代碼生成功能到 Kernel
         self.code_gen_function = self.kernel.add_function(
@@ -123,6 +414,68 @@ class CodeAgent(Agent):
             prompt_template_config=code_gen_config,
         )
     
+    def _register_batch_gen_function(self):
+        """註冊批量代碼生成功能，一次調用處理多個任務"""
+
+        # 批量代碼生成提示模板
+        batch_gen_prompt = """
+        請根據以下 {{$batch_size}} 個任務分別生成可執行的程式碼。
+
+        任務列表:
+        {{$tasks}}
+
+        對每一個任務，按照以下格式回覆（與單任務格式相同），
+        並在每個任務的回覆結尾加上獨立一行的結束標記 "=== END TASK n ==="（n 為任務編號）:
+
+        LANGUAGE: [程式語言名稱]
+
+        DEPENDENCIES:
+        [依賴1]
+        [依賴2]
+        ...
+
+        CODE:
+        [完整代碼]
+
+        EXPLANATION:
+        [代碼説明和使用方法]
+
+        === END TASK n ===
+
+        確保每段代碼:
+        - 完整且可立即執行
+        - 包含必要的錯誤處理
+        - 如果是 Python，將最終結果存儲在 'result' 變數中
+
+        必須輸出 {{$batch_size}} 個任務的回覆，只返回上述格式，不要有其他多餘的解釋或 markdown 標記。
+        """
+
+        # 批量代碼生成配置
+        batch_gen_config = CodeAgent._batch_gen_config
+        if batch_gen_config is None:
+            batch_gen_config = PromptTemplateConfig(
+                template=batch_gen_prompt,
+                name="generateBatchCode",
+                template_format="semantic-kernel",
+                input_variables=[
+                    InputVariable(name="tasks", description="編號的任務列表", is_required=True),
+                    InputVariable(name="batch_size", description="任務數量", is_required=True),
+                ],
+                execution_settings=AzureChatPromptExecutionSettings(
+                    service_id="default",
+                    max_tokens=3000,
+                    temperature=0.2,
+                )
+            )
+            CodeAgent._batch_gen_config = batch_gen_config
+
+        # 添加批量代碼生成功能到 Kernel
+        self.batch_gen_function = self.kernel.add_function(
+            function_name="generateBatchCode",
+            plugin_name="codePlugin",
+            prompt_template_config=batch_gen_config,
+        )
+
     def _register_code_fix_function(self):
         """註冊代碼修復功能"""
         
@@ -173,22 +526,25 @@ class CodeAgent(Agent):
         """
         
         # 代碼修復配置
-        code_fix_config = PromptTemplateConfig(
-            template=code_fix_prompt,
-            name="fixBrokenCode",
-            template_format="semantic-kernel",
-            input_variables=[
-                InputVariable(name="original_task", description="原始任務描述", is_required=True),
-                InputVariable(name="language", description="程式語言", is_required=True),
-                InputVariable(name="code", description="需要修復的代碼", is_required=True),
-                InputVariable(name="error_message", description="錯誤訊息", is_required=True),
-            ],
-            execution_settings=AzureChatPromptExecutionSettings(
-                service_id="default",
-                max_tokens=3000,
-                temperature=0.2,
+        code_fix_config = CodeAgent._code_fix_config
+        if code_fix_config is None:
+            code_fix_config = PromptTemplateConfig(
+                template=code_fix_prompt,
+                name="fixBrokenCode",
+                template_format="semantic-kernel",
+                input_variables=[
+                    InputVariable(name="original_task", description="原始任務描述", is_required=True),
+                    InputVariable(name="language", description="程式語言", is_required=True),
+                    InputVariable(name="code", description="需要修復的代碼", is_required=True),
+                    InputVariable(name="error_message", description="錯誤訊息", is_required=True),
+                ],
+                execution_settings=AzureChatPromptExecutionSettings(
+                    service_id="default",
+                    max_tokens=3000,
+                    temperature=0.2,
+                )
             )
-        )
+            CodeAgent._code_fix_config = code_fix_config
         
         # 添加代碼修復功能到 Kernel
         self.code_fix_function = self.kernel.add_function(
@@ -236,20 +592,23 @@ class CodeAgent(Agent):
         """
         
         # 測試數據生成配置
-        test_data_gen_config = PromptTemplateConfig(
-            template=test_data_gen_prompt,
-            name="generateTestData",
-            template_format="semantic-kernel",
-            input_variables=[
-                InputVariable(name="language", description="程式語言", is_required=True),
-                InputVariable(name="code", description="需要測試的代碼", is_required=True),
-            ],
-            execution_settings=AzureChatPromptExecutionSettings(
-                service_id="default",
-                max_tokens=3000,
-                temperature=0.2,
+        test_data_gen_config = CodeAgent._test_data_gen_config
+        if test_data_gen_config is None:
+            test_data_gen_config = PromptTemplateConfig(
+                template=test_data_gen_prompt,
+                name="generateTestData",
+                template_format="semantic-kernel",
+                input_variables=[
+                    InputVariable(name="language", description="程式語言", is_required=True),
+                    InputVariable(name="code", description="需要測試的代碼", is_required=True),
+                ],
+                execution_settings=AzureChatPromptExecutionSettings(
+                    service_id="default",
+                    max_tokens=3000,
+                    temperature=0.2,
+                )
             )
-        )
+            CodeAgent._test_data_gen_config = test_data_gen_config
         
         # 添加測試數據生成功能到 Kernel
         self.test_data_gen_function = self.kernel.add_function(
@@ -269,12 +628,6 @@ class CodeAgent(Agent):
         Returns:
             回應訊息
         """
-        # 確保代碼生成功能已註冊
-        if self.code_gen_function is None and self.kernel is not None:
-            self._register_code_gen_function()
-            self._register_code_fix_function()
-            self._register_test_data_gen_function()
-
         # 檢測是否是檔案生成模式
         is_file_generation_mode = False
         clean_message = message
@@ -309,29 +662,31 @@ class CodeAgent(Agent):
             # 提取檔案路徑
             file_path = await self._extract_file_path_with_ai(execution_result)
             
-            # 格式化響應，不包含代碼
+            # 格式化響應，不包含代碼（收集片段最後一次性合併，避免重複串接）
             if file_path:
-                response = f"✅ 已經為您生成檔案，保存在：`{file_path}`\n\n"
-                # 檢查檔案是否存在
-                if os.path.exists(file_path):
-                    file_size = os.path.getsize(file_path)
-                    response += f"檔案大小: {self._format_file_size(file_size)}\n"
-                    response += f"檔案類型: {os.path.splitext(file_path)[1]}\n\n"
-                    response += "您可以從上述路徑獲取該檔案。"
+                parts = [f"✅ 已經為您生成檔案，保存在：`{file_path}`\n\n"]
+                # 檢查檔案是否存在：單次 stat 同時取得存在性與大小，
+                # 放到線程池避免阻塞事件循環
+                try:
+                    file_stat = await asyncio.to_thread(os.stat, file_path)
+                except OSError:
+                    file_stat = None
+                if file_stat is not None:
+                    parts.append(f"檔案大小: {self._format_file_size(file_stat.st_size)}\n")
+                    parts.append(f"檔案類型: {os.path.splitext(file_path)[1]}\n\n")
+                    parts.append("您可以從上述路徑獲取該檔案。")
                 else:
-                    response += "⚠️ 警告：檔案可能已生成，但無法在指定路徑找到。"
-            else:
-                # 如果沒有檔案路徑，顯示執行結果
-                response = f"執行結果:\n\n{execution_result}"
-            
-            return response
+                    parts.append("⚠️ 警告：檔案可能已生成，但無法在指定路徑找到。")
+                return "".join(parts)
+
+            # 如果沒有檔案路徑，顯示執行結果
+            return f"執行結果:\n\n{execution_result}"
         
-        # 提取代碼任務 (移除前綴詞)
+        # 提取代碼任務 (移除前綴詞)：單次掃描取第一個命中的前綴
         task = message
-        for prefix in ["請幫我寫代碼", "生成代碼", "寫一段程式", "代碼生成", "幫我寫", "實現", "開發"]:
-            if prefix in message:
-                task = message.split(prefix, 1)[1].strip()
-                break
+        prefix_match = _TASK_PREFIX_RE.search(message)
+        if prefix_match:
+            task = message[prefix_match.end():].strip()
         
         try:
             # 生成智能代碼（包含語言、依賴和代碼）
@@ -341,23 +696,35 @@ class CodeAgent(Agent):
             code = code_result.get("code", "")
             explanation = code_result.get("explanation", "")
             
-            # 檢查環境
-            env_checker = EnvironmentChecker()
-            env_ready, env_message = await env_checker.check_environment(language)
-            
+            # 輸入需求分析只依賴生成的代碼，提前啟動讓它與環境檢查、
+            # 依賴安裝等步驟重疊
+            input_task = asyncio.create_task(
+                self.analyze_input_requirements(code, language)
+            )
+
+            # 並行執行獨立的準備步驟：環境檢查與依賴檢查互不依賴
+            # （依賴檢查可能已在流式生成期間提前完成）
+            missing_deps = code_result.get("missing_dependencies")
+            if missing_deps is None and language == "python" and dependencies:
+                (env_ready, env_message), missing_deps = await asyncio.gather(
+                    self.env_checker.check_environment(language),
+                    self.check_dependencies(dependencies),
+                )
+            else:
+                env_ready, env_message = await self.env_checker.check_environment(language)
+                missing_deps = missing_deps or []
+
             # 根據語言和環境狀態決定執行方式
             if env_ready:
                 # 環境已準備好，可以嘗試執行
-                
-                # 檢查並安裝依賴（如果是Python）
+
+                # 安裝缺失的依賴（如果是Python）
                 install_logs = ""
-                if language == "python" and dependencies:
-                    missing_deps = await self.check_dependencies(dependencies)
-                    if missing_deps and self.allow_installs:
-                        install_logs = await self.install_dependencies(missing_deps)
+                if missing_deps and self.allow_installs:
+                    install_logs = await self.install_dependencies(missing_deps)
                 
                 # 檢查代碼是否需要輸入數據，如果需要則生成測試數據
-                needs_input, test_data_result = await self.analyze_input_requirements(code, language)
+                needs_input, test_data_result = await input_task
                 
                 if needs_input:
                     # 代碼需要輸入，使用生成的測試數據
@@ -374,134 +741,116 @@ class CodeAgent(Agent):
                 if fixed_code:
                     code = fixed_code
                 
-                # 構建響應
-                response = f"# {language.capitalize()} 代碼\n\n"
+                # 構建響應：收集片段最後一次性合併，避免長回應的重複串接
+                parts = [f"# {language.capitalize()} 代碼\n\n"]
                 
                 if dependencies:
-                    response += f"## 依賴項\n\n"
-                    response += "\n".join(dependencies) + "\n\n"
+                    parts.append(f"## 依賴項\n\n")
+                    parts.append("\n".join(dependencies) + "\n\n")
                     
                     if install_logs:
-                        response += f"## 安裝日誌\n\n```\n{install_logs}\n```\n\n"
+                        parts.append(f"## 安裝日誌\n\n```\n{install_logs}\n```\n\n")
                 
-                response += f"## 代碼\n\n```{language}\n{code}\n```\n\n"
+                parts.append(f"## 代碼\n\n```{language}\n{code}\n```\n\n")
                 
                 # 添加測試數據分析（如果有）
                 if needs_input:
-                    response += f"## 輸入分析\n\n"
-                    response += f"{test_data_result.get('input_analysis', '代碼需要輸入數據來執行')}\n\n"
+                    parts.append(f"## 輸入分析\n\n")
+                    parts.append(f"{test_data_result.get('input_analysis', '代碼需要輸入數據來執行')}\n\n")
                     
-                    response += f"## 測試數據\n\n"
-                    response += f"{test_data_result.get('test_data', '無法生成有效的測試數據')}\n\n"
+                    parts.append(f"## 測試數據\n\n")
+                    parts.append(f"{test_data_result.get('test_data', '無法生成有效的測試數據')}\n\n")
                     
-                    response += f"## 執行方法\n\n"
-                    response += f"{test_data_result.get('execution_method', '無執行方法建議')}\n\n"
+                    parts.append(f"## 執行方法\n\n")
+                    parts.append(f"{test_data_result.get('execution_method', '無執行方法建議')}\n\n")
                 
                 # 添加詳細的修復過程視覺化
                 if fix_attempts > 0:
-                    response += f"## 自動修復過程 ({fix_attempts}次嘗試)\n\n"
-                    response += f"最終執行狀態: {'✅ 成功' if is_successful else '❌ 仍有錯誤'}\n\n"
+                    parts.append(f"## 自動修復過程 ({fix_attempts}次嘗試)\n\n")
+                    parts.append(f"最終執行狀態: {'✅ 成功' if is_successful else '❌ 仍有錯誤'}\n\n")
                     
                     # 顯示每次嘗試的詳細信息
                     for i, record in enumerate(fix_history):
                         if "attempt" in record:
                             if "has_error" in record:  # 這是執行記錄
                                 attempt_num = record["attempt"]
-                                response += f"### 嘗試 {attempt_num + 1} - 執行代碼\n\n"
+                                parts.append(f"### 嘗試 {attempt_num + 1} - 執行代碼\n\n")
                                 
-                                # 顯示代碼片段 (為了簡潔，只顯示前幾行)
-                                code_preview = "\n".join(record["code"].split("\n")[:10])
-                                if len(record["code"].split("\n")) > 10:
+                                # 顯示代碼片段 (為了簡潔，只顯示前幾行)；
+                                # 最多切出前 10 行，用 count 判斷總行數避免整列 split
+                                code_preview = "\n".join(record["code"].split("\n", 10)[:10])
+                                if record["code"].count("\n") + 1 > 10:
                                     code_preview += "\n# ... (省略部分代碼)"
                                     
-                                response += f"```{language}\n{code_preview}\n```\n\n"
+                                parts.append(f"```{language}\n{code_preview}\n```\n\n")
                                 
                                 # 顯示執行結果或錯誤
                                 if record["has_error"]:
-                                    response += f"#### ❌ 執行結果 (有錯誤)\n\n"
+                                    parts.append(f"#### ❌ 執行結果 (有錯誤)\n\n")
                                     error_text = record["execution_result"]
                                     # 提取關鍵錯誤信息
                                     if "執行代碼出錯" in error_text:
                                         error_lines = error_text.split("\n")
                                         for line in error_lines:
                                             if "執行代碼出錯" in line:
-                                                response += f"`{line}`\n\n"
+                                                parts.append(f"`{line}`\n\n")
                                                 break
                                     else:
-                                        response += f"```\n{error_text[:200]}{'...' if len(error_text) > 200 else ''}\n```\n\n"
+                                        parts.append(f"```\n{error_text[:200]}{'...' if len(error_text) > 200 else ''}\n```\n\n")
                                 else:
-                                    response += f"#### ✅ 執行成功\n\n"
-                                    result_preview = record["execution_result"][:200]
-                                    response += f"```\n{result_preview}{'...' if len(record['execution_result']) > 200 else ''}\n```\n\n"
+                                    parts.append(f"#### ✅ 執行成功\n\n")
+                                    result_text = record["execution_result"]
+                                    parts.append(f"```\n{result_text[:200]}{'...' if len(result_text) > 200 else ''}\n```\n\n")
                             
                             elif "error_analysis" in record:  # 這是修復嘗試記錄
-                                response += f"### 修復分析與策略\n\n"
+                                parts.append(f"### 修復分析與策略\n\n")
                                 
                                 # 顯示錯誤分析
-                                response += "#### 錯誤分析\n\n"
-                                response += f"{record['error_analysis']}\n\n"
+                                parts.append("#### 錯誤分析\n\n")
+                                parts.append(f"{record['error_analysis']}\n\n")
                                 
                                 # 顯示修復策略
-                                response += "#### 修復策略\n\n"
-                                response += f"{record['fix_approach']}\n\n"
+                                parts.append("#### 修復策略\n\n")
+                                parts.append(f"{record['fix_approach']}\n\n")
                                 
                                 # 顯示代碼變更 (如果有)
                                 if record.get("status") == "代碼已修改":
-                                    response += "#### 代碼修改\n\n"
-                                    # 使用diff風格顯示變更
-                                    response += "```diff\n"
-                                    
-                                    # 簡化的代碼diff顯示
-                                    original_lines = record["original_code"].split("\n")
-                                    fixed_lines = record["fixed_code"].split("\n")
-                                    
-                                    # 只展示前後有變化的幾行
-                                    changes_found = False
-                                    for i in range(min(len(original_lines), len(fixed_lines))):
-                                        if original_lines[i] != fixed_lines[i]:
-                                            response += f"- {original_lines[i]}\n+ {fixed_lines[i]}\n"
-                                            changes_found = True
-                                    
-                                    # 處理長度不同的情況
-                                    if len(original_lines) < len(fixed_lines):
-                                        for i in range(len(original_lines), len(fixed_lines)):
-                                            response += f"+ {fixed_lines[i]}\n"
-                                            changes_found = True
-                                    elif len(original_lines) > len(fixed_lines):
-                                        for i in range(len(fixed_lines), len(original_lines)):
-                                            response += f"- {original_lines[i]}\n"
-                                            changes_found = True
-                                    
-                                    if not changes_found:
-                                        response += "代碼結構發生變化，但無法顯示簡單的行差異。\n"
-                                    
-                                    response += "```\n\n"
+                                    parts.append("#### 代碼修改\n\n")
+                                    # 使用標準 unified diff 顯示變更（C 實作，單次比對）
+                                    diff = "\n".join(unified_diff(
+                                        record["original_code"].splitlines(),
+                                        record["fixed_code"].splitlines(),
+                                        lineterm="",
+                                        n=2,
+                                    ))
+                                    parts.append(f"```diff\n{diff or '代碼結構發生變化，但無法顯示簡單的行差異。'}\n```\n\n")
                                 else:
-                                    response += f"#### 狀態: {record.get('status', '未知')}\n\n"
+                                    parts.append(f"#### 狀態: {record.get('status', '未知')}\n\n")
                 
-                response += f"## 最終執行結果\n\n{execution_result}\n\n"
+                parts.append(f"## 最終執行結果\n\n{execution_result}\n\n")
                 
                 if explanation:
-                    response += f"## 説明\n\n{explanation}\n"
+                    parts.append(f"## 説明\n\n{explanation}\n")
                 
-                return response
+                return "".join(parts)
             else:
-                # 環境未準備好，只顯示代碼並提供安裝指南
-                response = f"# {language.capitalize()} 代碼\n\n"
+                # 環境未準備好，取消輸入分析，只顯示代碼並提供安裝指南
+                input_task.cancel()
+                parts = [f"# {language.capitalize()} 代碼\n\n"]
                 
                 if dependencies:
-                    response += f"## 依賴項\n\n"
-                    response += "\n".join(dependencies) + "\n\n"
+                    parts.append(f"## 依賴項\n\n")
+                    parts.append("\n".join(dependencies) + "\n\n")
                 
-                response += f"## 代碼\n\n```{language}\n{code}\n```\n\n"
+                parts.append(f"## 代碼\n\n```{language}\n{code}\n```\n\n")
                 
                 if explanation:
-                    response += f"## 説明\n\n{explanation}\n"
+                    parts.append(f"## 説明\n\n{explanation}\n")
                 
-                response += f"## 環境配置\n\n{env_message}\n\n"
-                response += "請安裝所需環境後再執行此代碼。\n"
+                parts.append(f"## 環境配置\n\n{env_message}\n\n")
+                parts.append("請安裝所需環境後再執行此代碼。\n")
                 
-                return response
+                return "".join(parts)
             
         except Exception as e:
             import traceback
@@ -519,25 +868,13 @@ class CodeAgent(Agent):
         Returns:
             (是否需要輸入, 測試數據結果)
         """
-        # 檢查是否包含輸入函數
-        needs_input = False
-        
-        input_patterns = {
-            "python": [r"input\s*\(", r"sys\.stdin", r"fileinput"],
-            "javascript": [r"prompt\s*\(", r"readline", r"process\.stdin"],
-            "java": [r"Scanner", r"System\.in", r"BufferedReader"],
-            "c++": [r"cin\s*>>", r"getline", r"scanf"],
-            "c#": [r"Console\.Read", r"Console\.ReadLine"]
-        }
-        
-        # 獲取對應語言的輸入模式
-        patterns = input_patterns.get(language.lower(), [])
-        
-        # 檢查代碼是否匹配任何輸入模式
-        for pattern in patterns:
-            if re.search(pattern, code):
-                needs_input = True
-                break
+        # 檢查是否包含輸入函數：Python 用 AST 靜態判斷（避免 input_data
+        # 之類識別符的誤判），其他語言掃描預編譯的交替式正則
+        if language.lower() == "python":
+            needs_input = self._py_needs_input(code)
+        else:
+            pattern = _INPUT_PATTERNS.get(language.lower())
+            needs_input = bool(pattern and pattern.search(code))
         
         # 如果需要輸入，生成測試數據
         if needs_input:
@@ -553,6 +890,41 @@ class CodeAgent(Agent):
         else:
             return False, {}
     
+    def _py_needs_input(self, code: str) -> bool:
+        """
+        用 AST 靜態判斷 Python 代碼是否需要輸入數據
+
+        Args:
+            code: Python 代碼
+
+        Returns:
+            代碼包含 input() 調用、sys.stdin 訪問或 fileinput 導入時為 True；
+            無法解析時為 False
+        """
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            return False
+
+        for node in ast.walk(tree):
+            if (isinstance(node, ast.Call)
+                    and isinstance(node.func, ast.Name)
+                    and node.func.id == "input"):
+                return True
+            if (isinstance(node, ast.Attribute)
+                    and node.attr == "stdin"
+                    and isinstance(node.value, ast.Name)
+                    and node.value.id == "sys"):
+                return True
+            if isinstance(node, ast.Import):
+                if any(alias.name.split(".")[0] == "fileinput" for alias in node.names):
+                    return True
+            elif isinstance(node, ast.ImportFrom):
+                if (node.module or "").split(".")[0] == "fileinput":
+                    return True
+
+        return False
+
     async def generate_test_data(self, code: str, language: str) -> Dict[str, Any]:
         """
         為代碼生成測試數據
@@ -564,9 +936,16 @@ class CodeAgent(Agent):
         Returns:
             測試數據結果
         """
+        # 同一段代碼的測試數據可以直接重用
+        cache_key = f"{language}\n{code}"
+        cached = self.response_cache.get("generateTestData", cache_key)
+        if cached is not None:
+            return dict(cached)
+
         try:
-            # 調用測試數據生成功能
-            result = await self.kernel.invoke(
+            # 調用測試數據生成功能（經微批次工作器派發）
+            result = await self.inference_worker.run(
+                self.kernel,
                 self.test_data_gen_function,
                 KernelArguments(
                     language=language,
@@ -577,6 +956,7 @@ class CodeAgent(Agent):
             # 解析生成的結果
             response = str(result).strip()
             parsed_result = self._parse_test_data_response(response)
+            self.response_cache.put("generateTestData", cache_key, dict(parsed_result))
             return parsed_result
             
         except Exception as e:
@@ -598,71 +978,50 @@ class CodeAgent(Agent):
             "execution_method": "",
             "modified_code": ""
         }
-        
-        # 解析輸入分析
-        if "INPUT_ANALYSIS:" in response:
-            analysis_part = response.split("INPUT_ANALYSIS:", 1)[1]
-            if "TEST_DATA:" in analysis_part:
-                analysis_part = analysis_part.split("TEST_DATA:", 1)[0]
-            result["input_analysis"] = analysis_part.strip()
-        
-        # 解析測試數據
-        if "TEST_DATA:" in response:
-            test_data_part = response.split("TEST_DATA:", 1)[1]
-            if "EXECUTION_METHOD:" in test_data_part:
-                test_data_part = test_data_part.split("EXECUTION_METHOD:", 1)[0]
-            result["test_data"] = test_data_part.strip()
-        
-        # 解析執行方法
-        if "EXECUTION_METHOD:" in response:
-            method_part = response.split("EXECUTION_METHOD:", 1)[1]
-            if "MODIFIED_CODE:" in method_part:
-                method_part = method_part.split("MODIFIED_CODE:", 1)[0]
-            result["execution_method"] = method_part.strip()
-        
-        # 解析修改後的代碼
-        if "MODIFIED_CODE:" in response:
-            code_part = response.split("MODIFIED_CODE:", 1)[1].strip()
-            
-            # 移除 markdown 格式標記
-            code_text = code_part.strip()
-            # 移除開頭的 ```語言名稱
-            if code_text.startswith("```"):
-                first_line_end = code_text.find("\n")
-                if first_line_end != -1:
-                    code_text = code_text[first_line_end+1:]
-            
-            # 移除結尾的 ```
-            if code_text.endswith("```"):
-                code_text = code_text[:-3].strip()
-            
-            result["modified_code"] = code_text
-        
+
+        # 單次線性掃描切分各部分，避免對整個回應重複 split 複製
+        sections = self._split_sections(
+            response,
+            ("INPUT_ANALYSIS:", "TEST_DATA:", "EXECUTION_METHOD:", "MODIFIED_CODE:")
+        )
+
+        if "INPUT_ANALYSIS:" in sections:
+            result["input_analysis"] = sections["INPUT_ANALYSIS:"].strip()
+
+        if "TEST_DATA:" in sections:
+            result["test_data"] = sections["TEST_DATA:"].strip()
+
+        if "EXECUTION_METHOD:" in sections:
+            result["execution_method"] = sections["EXECUTION_METHOD:"].strip()
+
+        if "MODIFIED_CODE:" in sections:
+            result["modified_code"] = self._remove_markdown_format(
+                sections["MODIFIED_CODE:"].strip()
+            )
+
         return result
     
-    async def _detect_file_type_with_ai(self, message: str) -> str:
-        """使用 AI 從用戶消息中檢測所需的文件類型"""
-        # 註冊文件類型判斷函數（如果尚未註冊）
-        if not hasattr(self, "file_type_function"):
-            from semantic_kernel.prompt_template import PromptTemplateConfig
-            from semantic_kernel.prompt_template.input_variable import InputVariable
-            from semantic_kernel.connectors.ai.open_ai import AzureChatPromptExecutionSettings
-            
-            prompt = """
-            請從用戶的消息中確定他們想要生成的文件類型。
+    def _register_file_type_function(self):
+        """註冊文件類型判斷功能"""
 
-            文件類型可能包括：pdf, excel, xlsx, word, docx, csv, txt, ppt, pptx, json, html, 等。
+        prompt = """
+        請從用戶的消息中確定他們想要生成的文件類型。
 
-            即使用戶沒有明確指定文件格式，也請根據他們的描述或需求推斷最合適的文件類型。
-            如果消息中提到"表格"或數據分析，可能需要 excel 或 csv；
-            如果是文本內容，可能需要 txt, word 或 pdf；
-            如果是圖表或演示，可能需要 ppt。
+        文件類型可能包括：pdf, excel, xlsx, word, docx, csv, txt, ppt, pptx, json, html, 等。
 
-            只返回判斷的文件類型，無需其他解釋。如果無法確定，請返回 "pdf"（作為默認選項）。
+        即使用戶沒有明確指定文件格式，也請根據他們的描述或需求推斷最合適的文件類型。
+        如果消息中提到"表格"或數據分析，可能需要 excel 或 csv；
+        如果是文本內容，可能需要 txt, word 或 pdf；
+        如果是圖表或演示，可能需要 ppt。
 
-            用戶消息: {{$message}}
-            """
-            
+        只返回判斷的文件類型，無需其他解釋。如果無法確定，請返回 "pdf"（作為默認選項）。
+
+        用戶消息: {{$message}}
+        """
+
+        # 文件類型判斷配置（跨實例共用，模板只構建一次）
+        config = CodeAgent._file_type_config
+        if config is None:
             config = PromptTemplateConfig(
                 template=prompt,
                 name="detectFileType",
@@ -676,17 +1035,38 @@ class CodeAgent(Agent):
                     temperature=0.0,  # 確定性輸出
                 )
             )
-            
-            self.file_type_function = self.kernel.add_function(
-                function_name="detectFileType",
-                plugin_name="codePlugin",
-                prompt_template_config=config,
-            )
-        
+            CodeAgent._file_type_config = config
+
+        self.file_type_function = self.kernel.add_function(
+            function_name="detectFileType",
+            plugin_name="codePlugin",
+            prompt_template_config=config,
+        )
+
+    async def _detect_file_type_with_ai(self, message: str) -> str:
+        """使用 AI 從用戶消息中檢測所需的文件類型"""
+        # 訊息中已明確出現文件類型關鍵詞時直接採用，省去 LLM 往返
+        match = _FILE_TYPE_RE.search(message)
+        if match:
+            file_type = match.group(1).lower()
+            return _FILE_TYPE_ALIASES.get(file_type, file_type)
+
+        # 相同訊息的判斷結果直接重用
+        cache_key = ResponseCache.normalize(message)
+        cached = self.response_cache.get("detectFileType", cache_key)
+        if cached is not None:
+            return cached
+
+        persisted = self.file_meta_cache.get("detectFileType", cache_key)
+        if persisted is not None:
+            self.response_cache.put("detectFileType", cache_key, persisted)
+            return persisted
+
         try:
-            # 調用 AI 判斷
+            # 調用 AI 判斷（經微批次工作器派發）
             from semantic_kernel.functions import KernelArguments
-            result = await self.kernel.invoke(
+            result = await self.inference_worker.run(
+                self.kernel,
                 self.file_type_function,
                 KernelArguments(message=message)
             )
@@ -695,51 +1075,51 @@ class CodeAgent(Agent):
             
             # 確保返回的文件類型是有效的
             valid_types = ["pdf", "excel", "xlsx", "word", "docx", "csv", "txt", "ppt", "pptx", "json", "html"]
-            if file_type in valid_types:
-                return file_type
-            
-            # 處理一些常見的替代表達
-            if file_type in ["excel表格", "表格", "電子表格"]:
-                return "excel"
-            elif file_type in ["文本", "純文本"]:
-                return "txt"
-            elif file_type in ["演示文稿", "簡報", "投影片"]:
-                return "ppt"
-            
-            # 默認類型
-            return "pdf"
+            if file_type not in valid_types:
+                # 處理一些常見的替代表達
+                if file_type in ["excel表格", "表格", "電子表格"]:
+                    file_type = "excel"
+                elif file_type in ["文本", "純文本"]:
+                    file_type = "txt"
+                elif file_type in ["演示文稿", "簡報", "投影片"]:
+                    file_type = "ppt"
+                else:
+                    # 默認類型
+                    file_type = "pdf"
+
+            self.response_cache.put("detectFileType", cache_key, file_type)
+            self.file_meta_cache.put("detectFileType", cache_key, file_type)
+            return file_type
         except Exception as e:
             print(f"AI文件類型檢測失敗: {str(e)}")
             # 失敗時使用默認類型
             return "pdf"
 
-    async def _extract_file_path_with_ai(self, result_text: str) -> Optional[str]:
-        """使用 AI 從執行結果中提取文件路徑"""
-        # 註冊文件路徑提取函數（如果尚未註冊）
-        if not hasattr(self, "file_path_function"):
-            from semantic_kernel.prompt_template import PromptTemplateConfig
-            from semantic_kernel.prompt_template.input_variable import InputVariable
-            from semantic_kernel.connectors.ai.open_ai import AzureChatPromptExecutionSettings
-            
-            prompt = """
-            請從以下執行結果中提取生成檔案的完整路徑。
+    def _register_file_path_function(self):
+        """註冊文件路徑提取功能"""
 
-            執行結果內容:
-            {{$result_text}}
+        prompt = """
+        請從以下執行結果中提取生成檔案的完整路徑。
 
-            檔案路徑通常出現在類似這樣的短語之後：
-            - "檔案已成功生成並保存到:"
-            - "保存在:"
-            - "文件路徑:"
-            - "已生成:"
+        執行結果內容:
+        {{$result_text}}
 
-            路徑可能是Windows格式(如 C:\\Users\\name\\downloads\\file.pdf)或
-            Unix格式(如 /home/user/downloads/file.pdf)。
+        檔案路徑通常出現在類似這樣的短語之後：
+        - "檔案已成功生成並保存到:"
+        - "保存在:"
+        - "文件路徑:"
+        - "已生成:"
 
-            請只返回完整的檔案路徑，不要包含任何其他文字或解釋。
-            如果找不到路徑，請回答 "未找到檔案路徑"。
-            """
-            
+        路徑可能是Windows格式(如 C:\\Users\\name\\downloads\\file.pdf)或
+        Unix格式(如 /home/user/downloads/file.pdf)。
+
+        請只返回完整的檔案路徑，不要包含任何其他文字或解釋。
+        如果找不到路徑，請回答 "未找到檔案路徑"。
+        """
+
+        # 文件路徑提取配置（跨實例共用，模板只構建一次）
+        config = CodeAgent._file_path_config
+        if config is None:
             config = PromptTemplateConfig(
                 template=prompt,
                 name="extractFilePath",
@@ -753,17 +1133,35 @@ class CodeAgent(Agent):
                     temperature=0.0,  # 確定性輸出
                 )
             )
-            
-            self.file_path_function = self.kernel.add_function(
-                function_name="extractFilePath",
-                plugin_name="codePlugin",
-                prompt_template_config=config,
-            )
-        
+            CodeAgent._file_path_config = config
+
+        self.file_path_function = self.kernel.add_function(
+            function_name="extractFilePath",
+            plugin_name="codePlugin",
+            prompt_template_config=config,
+        )
+
+    async def _extract_file_path_with_ai(self, result_text: str) -> Optional[str]:
+        """使用 AI 從執行結果中提取文件路徑"""
+        # 生成代碼被要求以固定短語輸出路徑，先用正則直接提取，
+        # 匹配不到再退回 LLM
+        match = _PATH_RE.search(result_text)
+        if match:
+            return match.group(2).strip()
+
+        # 相同執行結果文本的提取結果直接重用（以雜湊為鍵，空字串表示「未找到」）
+        cache_key = hashlib.blake2b(
+            result_text.encode("utf-8"), digest_size=16
+        ).hexdigest()
+        persisted = self.file_meta_cache.get("extractFilePath", cache_key)
+        if persisted is not None:
+            return persisted or None
+
         try:
-            # 調用 AI 提取路徑
+            # 調用 AI 提取路徑（經微批次工作器派發）
             from semantic_kernel.functions import KernelArguments
-            result = await self.kernel.invoke(
+            result = await self.inference_worker.run(
+                self.kernel,
                 self.file_path_function,
                 KernelArguments(result_text=result_text)
             )
@@ -772,25 +1170,24 @@ class CodeAgent(Agent):
             
             # 檢查結果是否是有效路徑
             if path == "未找到檔案路徑":
-                return None
-                
+                path = None
             # 簡單驗證是否看起來像路徑
-            if ('\\' in path or '/' in path) and '.' in path:
-                return path
-                
-            return None
+            elif not (('\\' in path or '/' in path) and '.' in path):
+                path = None
+
+            self.file_meta_cache.put("extractFilePath", cache_key, path or "")
+            return path
         except Exception as e:
             print(f"AI路徑提取失敗: {str(e)}")
             # 失敗時返回None
             return None
     
     def _format_file_size(self, size_bytes: int) -> str:
-        """格式化文件大小"""
-        for unit in ['B', 'KB', 'MB', 'GB']:
-            if size_bytes < 1024.0:
-                return f"{size_bytes:.2f} {unit}"
-            size_bytes /= 1024.0
-        return f"{size_bytes:.2f} TB"
+        """格式化文件大小（用對數直接定位單位，免去逐級除法）"""
+        if size_bytes <= 0:
+            return "0.00 B"
+        i = min(int(math.log(size_bytes, 1024)), len(_SIZE_UNITS) - 1)
+        return f"{size_bytes / 1024 ** i:.2f} {_SIZE_UNITS[i]}"
 
     async def generate_file_creation_code(self, task: str, file_type: str) -> Dict[str, Any]:
         """生成創建文件的代碼"""
@@ -855,116 +1252,246 @@ class CodeAgent(Agent):
             # 執行當前版本的代碼
             execution_result = await self._execute_python(current_code)
             
-            # 記錄此次執行結果
+            # 記錄此次執行結果；由 finally 統一追加，
+            # 各分支不再各自 append，避免重複記錄
             execution_record = {
                 "attempt": attempt,
                 "code": current_code,
                 "execution_result": execution_result,
                 "has_error": "執行代碼出錯" in execution_result or "Error" in execution_result
             }
+            fix_record = None
 
-            # 如果發現模組缺失錯誤，嘗試安裝
-            if "ModuleNotFoundError: No module named" in execution_result:
-                import re
-                module_match = re.search(r"No module named '([^']+)'", execution_result)
-                if module_match:
-                    module_name = module_match.group(1)
+            try:
+                # 如果發現模組缺失錯誤，嘗試安裝
+                if "ModuleNotFoundError: No module named" in execution_result:
+                    module_match = _MISSING_MODULE_RE.search(execution_result)
+                    if module_match:
+                        module_name = module_match.group(1)
+                        
+                        # 記錄安裝嘗試
+                        install_record = {
+                            "type": "module_not_found",
+                            "module": module_name,
+                            "attempt": attempt
+                        }
+                        
+                        # 嘗試安裝缺失的模組
+                        install_result = await self.install_dependencies([module_name])
+                        install_record["install_result"] = install_result
+                        fix_history.append(install_record)
+                        
+                        # 重新執行代碼
+                        execution_result = await self._execute_python(current_code)
+                        execution_record["execution_result"] = execution_result
+                        execution_record["has_error"] = "執行代碼出錯" in execution_result or "Error" in execution_result
+                
+                # 檢查是否有錯誤
+                if not execution_record["has_error"]:
+                    # 代碼執行成功
+                    is_successful = True
+                    break
                     
-                    # 記錄安裝嘗試
-                    install_record = {
-                        "type": "module_not_found",
-                        "module": module_name,
-                        "attempt": attempt
+                # 到達最大嘗試次數
+                if fix_attempts >= self.max_fix_attempts:
+                    break
+                
+                # 嘗試修復代碼
+                try:
+                    # 記錄修復嘗試
+                    fix_record = {
+                        "attempt": attempt,
+                        "error_message": execution_result
                     }
                     
-                    # 嘗試安裝缺失的模組
-                    install_result = await self.install_dependencies([module_name])
-                    install_record["install_result"] = install_result
-                    fix_history.append(install_record)
+                    # 獲取修復方案
+                    fixed_code_result = await self.fix_code(current_code, language, original_task, execution_result)
+                    new_code = fixed_code_result.get("fixed_code")
                     
-                    # 重新執行代碼
-                    execution_result = await self._execute_python(current_code)
-                    execution_record["execution_result"] = execution_result
-                    execution_record["has_error"] = "執行代碼出錯" in execution_result or "Error" in execution_result
-            
-            # 檢查是否有錯誤
-            if not execution_record["has_error"]:
-                # 代碼執行成功
-                is_successful = True
-                fix_history.append(execution_record)
-                break
-                
-            # 到達最大嘗試次數
-            if fix_attempts >= self.max_fix_attempts:
-                fix_history.append(execution_record)
-                break
-            
-            # 嘗試修復代碼
-            try:
-                # 記錄修復嘗試
-                fix_record = {
-                    "attempt": attempt,
-                    "error_message": execution_result
-                }
-                
-                # 獲取修復方案
-                fixed_code_result = await self.fix_code(current_code, language, original_task, execution_result)
-                new_code = fixed_code_result.get("fixed_code")
-                
-                # 更新修復記錄
-                fix_record.update({
-                    "error_analysis": fixed_code_result.get("error_analysis", ""),
-                    "fix_approach": fixed_code_result.get("fix_approach", ""),
-                    "original_code": current_code,
-                    "fixed_code": new_code if new_code else current_code
-                })
-                
-                # 檢查修復的代碼是否與當前代碼相同
-                if new_code and new_code != current_code:
-                    current_code = new_code
-                    fix_attempts += 1
-                    fix_record["status"] = "代碼已修改"
-                else:
-                    # 代碼沒有變化，停止嘗試
-                    fix_record["status"] = "無法修復"
-                    fix_history.append(execution_record)
-                    fix_history.append(fix_record)
+                    # 更新修復記錄
+                    fix_record.update({
+                        "error_analysis": fixed_code_result.get("error_analysis", ""),
+                        "fix_approach": fixed_code_result.get("fix_approach", ""),
+                        "original_code": current_code,
+                        "fixed_code": new_code if new_code else current_code
+                    })
+                    
+                    # 檢查修復的代碼是否與當前代碼相同
+                    if new_code and new_code != current_code:
+                        current_code = new_code
+                        fix_attempts += 1
+                        fix_record["status"] = "代碼已修改"
+                    else:
+                        # 代碼沒有變化，停止嘗試
+                        fix_record["status"] = "無法修復"
+                        break
+                    
+                except Exception as e:
+                    # 修復過程出錯，停止嘗試
+                    execution_result += f"\n\n自動修復過程中出錯: {str(e)}"
+                    execution_record["fix_error"] = str(e)
+                    fix_record = None
                     break
-                
-                # 保存修復記錄
+            finally:
                 fix_history.append(execution_record)
-                fix_history.append(fix_record)
-                
-            except Exception as e:
-                # 修復過程出錯，停止嘗試
-                execution_result += f"\n\n自動修復過程中出錯: {str(e)}"
-                execution_record["fix_error"] = str(e)
-                fix_history.append(execution_record)
-                break
+                if fix_record is not None:
+                    fix_history.append(fix_record)
         
         return execution_result, current_code if fix_attempts > 0 else None, fix_attempts, is_successful, fix_history
     
     async def generate_smart_code(self, task: str) -> Dict[str, Any]:
         """
         生成智能代碼，包含程式語言、依賴和代碼
-        
+
+        短時間內的併發請求會被合併成一次批量 LLM 調用，
+        以分攤每次調用的 RPC 與提示詞開銷。
+
         Args:
             task: 任務描述
-            
+
         Returns:
             包含語言、依賴和代碼的字典
         """
+        # 先查緩存：等價任務直接返回先前生成的結果
+        cache_key = ResponseCache.normalize(task)
+        cached = self.response_cache.get("generateSmartCode", cache_key)
+        if cached is not None:
+            return dict(cached)
+
+        self._ensure_batch_loop()
+
+        # 將任務與 Future 一起入列，由批次循環統一處理
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        await self._gen_queue.put((task, future))
+        result = await future
+
+        self.response_cache.put("generateSmartCode", cache_key, dict(result))
+        return result
+
+    def clear_code_cache(self):
+        """清除代碼生成結果緩存"""
+        self.response_cache.clear("generateSmartCode")
+
+    def _ensure_batch_loop(self):
+        """確保批次處理循環已啟動（惰性初始化，需在事件循環內調用）"""
+        if self._gen_queue is None:
+            self._gen_queue = asyncio.Queue()
+        if self._batch_task is None or self._batch_task.done():
+            self._batch_task = asyncio.create_task(self._batch_loop())
+
+    async def _batch_loop(self):
+        """批次處理循環：收集短窗口內的生成請求並合併為一次 LLM 調用"""
+        while True:
+            # 等待第一個請求
+            task, future = await self._gen_queue.get()
+            batch = [(task, future)]
+
+            # 在小窗口內繼續收集請求，最多湊滿 max_batch 個
+            # （asyncio.timeout 直接等待單個 future，比 wait_for 少一層包裝）
+            deadline = asyncio.get_running_loop().time() + self.max_wait_ms / 1000.0
+            try:
+                async with asyncio.timeout_at(deadline):
+                    while len(batch) < self.max_batch:
+                        batch.append(await self._gen_queue.get())
+            except asyncio.TimeoutError:
+                pass
+
+            await self._process_gen_batch(batch)
+
+    async def _process_gen_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        """
+        處理一批代碼生成請求
+
+        Args:
+            batch: (任務描述, Future) 的列表
+        """
+        # 單個請求走原本的單任務路徑
+        if len(batch) == 1:
+            task, future = batch[0]
+            try:
+                result = await self._invoke_code_gen(task)
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # 多個請求合併為一次批量調用
         try:
+            tasks_text = "\n".join(
+                f"TASK {i}: {task}" for i, (task, _) in enumerate(batch, 1)
+            )
             result = await self.kernel.invoke(
-                self.code_gen_function,
-                KernelArguments(task=task)
+                self.batch_gen_function,
+                KernelArguments(tasks=tasks_text, batch_size=str(len(batch)))
             )
-            
-            # 解析生成的結果
+
+            # 按結束標記拆分各任務的回覆
             response = str(result).strip()
+            sections = _END_TASK_RE.split(response)
+
+            for i, (task, future) in enumerate(batch):
+                if future.done():
+                    continue
+                if i < len(sections) and sections[i].strip():
+                    future.set_result(self._parse_code_response(sections[i].strip()))
+                else:
+                    # 批量回覆缺少對應段落時，退回單任務生成
+                    try:
+                        future.set_result(await self._invoke_code_gen(task))
+                    except Exception as e:
+                        future.set_exception(e)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def _invoke_code_gen(self, task: str) -> Dict[str, Any]:
+        """
+        調用單任務代碼生成功能並解析結果
+
+        以流式方式接收回覆：CODE 標記一到達，依賴段就已完整，
+        可以提前開始依賴檢查，與剩餘代碼的生成重疊。
+
+        Args:
+            task: 任務描述
+
+        Returns:
+            包含語言、依賴和代碼的字典；若依賴檢查已提前完成，
+            額外帶有 missing_dependencies 鍵
+        """
+        try:
+            buffer = ""
+            deps_task = None
+            try:
+                async for chunk in self.kernel.invoke_stream(
+                    self.code_gen_function,
+                    KernelArguments(task=task)
+                ):
+                    buffer += str(chunk)
+                    # DEPENDENCIES 段在 CODE 標記出現時即完整，提前檢查依賴
+                    if deps_task is None and "CODE:" in buffer:
+                        partial = self._parse_code_response(buffer)
+                        if partial["dependencies"] and partial["language"].lower() == "python":
+                            deps_task = asyncio.create_task(
+                                self.check_dependencies(partial["dependencies"])
+                            )
+                response = buffer.strip()
+            except AttributeError:
+                # Kernel 不支持流式接口時退回一次性調用
+                result = await self.kernel.invoke(
+                    self.code_gen_function,
+                    KernelArguments(task=task)
+                )
+                response = str(result).strip()
+
+            # 解析生成的結果
             parsed_result = self._parse_code_response(response)
+            if deps_task is not None:
+                parsed_result["missing_dependencies"] = await deps_task
             return parsed_result
-            
+
         except Exception as e:
             raise Exception(f"代碼生成失敗: {str(e)}")
     
@@ -984,46 +1511,52 @@ class CodeAgent(Agent):
             "code": "",
             "explanation": ""
         }
-        
-        # 解析程式語言
-        if "LANGUAGE:" in response:
-            language_part = response.split("LANGUAGE:", 1)[1].split("\n", 1)[0].strip()
-            result["language"] = language_part
-        
-        # 解析依賴項
-        if "DEPENDENCIES:" in response:
-            deps_part = response.split("DEPENDENCIES:", 1)[1]
-            if "CODE:" in deps_part:
-                deps_part = deps_part.split("CODE:", 1)[0]
-            deps_list = [d.strip() for d in deps_part.strip().split("\n") if d.strip()]
-            result["dependencies"] = deps_list
-        
-        # 解析代碼
-        if "CODE:" in response:
-            code_part = response.split("CODE:", 1)[1]
-            if "EXPLANATION:" in code_part:
-                code_part = code_part.split("EXPLANATION:", 1)[0]
-            
-            # 移除 markdown 格式標記
-            code_text = code_part.strip()
-            # 移除開頭的 ```語言名稱
-            if code_text.startswith("```"):
-                first_line_end = code_text.find("\n")
-                if first_line_end != -1:
-                    code_text = code_text[first_line_end+1:]
-            
-            # 移除結尾的 ```
-            if code_text.endswith("```"):
-                code_text = code_text[:-3].strip()
-            
-            result["code"] = code_text
-        
-        # 解析説明
-        if "EXPLANATION:" in response:
-            explanation_part = response.split("EXPLANATION:", 1)[1].strip()
-            result["explanation"] = explanation_part
-        
+
+        # 單次線性掃描切分各部分，每段只切片一次，不重複複製整個回應
+        sections = self._split_sections(
+            response, ("LANGUAGE:", "DEPENDENCIES:", "CODE:", "EXPLANATION:")
+        )
+
+        if "LANGUAGE:" in sections:
+            result["language"] = sections["LANGUAGE:"].split("\n", 1)[0].strip()
+
+        if "DEPENDENCIES:" in sections:
+            result["dependencies"] = [
+                d.strip() for d in sections["DEPENDENCIES:"].strip().split("\n") if d.strip()
+            ]
+
+        if "CODE:" in sections:
+            result["code"] = self._remove_markdown_format(sections["CODE:"])
+
+        if "EXPLANATION:" in sections:
+            result["explanation"] = sections["EXPLANATION:"].strip()
+
         return result
+
+    def _split_sections(self, response: str, markers: Tuple[str, ...]) -> Dict[str, str]:
+        """
+        用單次線性掃描按標記切分回應
+
+        Args:
+            response: AI 生成的響應
+            markers: 各部分的標記字符串
+
+        Returns:
+            {標記: 該部分內容} 字典，缺失的標記不出現在結果中
+        """
+        positions = []
+        for marker in markers:
+            pos = response.find(marker)
+            if pos != -1:
+                positions.append((pos, marker))
+        positions.sort()
+
+        sections = {}
+        for i, (pos, marker) in enumerate(positions):
+            start = pos + len(marker)
+            end = positions[i + 1][0] if i + 1 < len(positions) else len(response)
+            sections[marker] = response[start:end]
+        return sections
     
     async def fix_code(self, code: str, language: str, original_task: str, error_message: str) -> Dict[str, Any]:
         """
@@ -1038,23 +1571,50 @@ class CodeAgent(Agent):
         Returns:
             包含修復分析和修復後代碼的字典
         """
+        # 超長錯誤訊息只保留尾部：traceback 最後幾行才是實際錯誤
+        if len(error_message) > _ERROR_CHAR_BUDGET:
+            error_message = "...(前段省略)...\n" + error_message[-_ERROR_CHAR_BUDGET:]
+
+        # 同一段代碼配同一個錯誤的修復結果可以直接重用
+        cache_key = hashlib.blake2b(
+            f"{language}\n{error_message}\n{code}".encode("utf-8"), digest_size=16
+        ).hexdigest()
+        cached = self.response_cache.get("fixCode", cache_key)
+        if cached is not None:
+            return dict(cached)
+
+        arguments = KernelArguments(
+            original_task=original_task,
+            language=language,
+            code=code,
+            error_message=error_message
+        )
+
         try:
-            # 調用代碼修復功能
-            result = await self.kernel.invoke(
-                self.code_fix_function,
-                KernelArguments(
-                    original_task=original_task,
-                    language=language,
-                    code=code,
-                    error_message=error_message
+            # 以流式方式接收回覆：FIXED_CODE 是最後一段，一旦其代碼圍欄
+            # 閉合即可停止接收，省去剩餘 token 的生成等待
+            buffer = ""
+            try:
+                async for chunk in self.kernel.invoke_stream(
+                    self.code_fix_function, arguments
+                ):
+                    buffer += str(chunk)
+                    fixed_pos = buffer.find("FIXED_CODE:")
+                    if fixed_pos != -1 and buffer.count("```", fixed_pos) >= 2:
+                        break
+                response = buffer.strip()
+            except AttributeError:
+                # Kernel 不支持流式接口時退回一次性調用
+                result = await self.inference_worker.run(
+                    self.kernel, self.code_fix_function, arguments
                 )
-            )
-            
+                response = str(result).strip()
+
             # 解析生成的結果
-            response = str(result).strip()
             parsed_result = self._parse_fix_response(response)
+            self.response_cache.put("fixCode", cache_key, dict(parsed_result))
             return parsed_result
-            
+
         except Exception as e:
             raise Exception(f"代碼修復失敗: {str(e)}")
     
@@ -1073,39 +1633,23 @@ class CodeAgent(Agent):
             "fix_approach": "",
             "fixed_code": ""
         }
-        
-        # 解析錯誤分析
-        if "ERROR_ANALYSIS:" in response:
-            analysis_part = response.split("ERROR_ANALYSIS:", 1)[1]
-            if "FIX_APPROACH:" in analysis_part:
-                analysis_part = analysis_part.split("FIX_APPROACH:", 1)[0]
-            result["error_analysis"] = analysis_part.strip()
-        
-        # 解析修復方案
-        if "FIX_APPROACH:" in response:
-            approach_part = response.split("FIX_APPROACH:", 1)[1]
-            if "FIXED_CODE:" in approach_part:
-                approach_part = approach_part.split("FIXED_CODE:", 1)[0]
-            result["fix_approach"] = approach_part.strip()
-        
-        # 解析修復後的代碼
-        if "FIXED_CODE:" in response:
-            code_part = response.split("FIXED_CODE:", 1)[1].strip()
-            
-            # 移除 markdown 格式標記
-            code_text = code_part.strip()
-            # 移除開頭的 ```語言名稱
-            if code_text.startswith("```"):
-                first_line_end = code_text.find("\n")
-                if first_line_end != -1:
-                    code_text = code_text[first_line_end+1:]
-            
-            # 移除結尾的 ```
-            if code_text.endswith("```"):
-                code_text = code_text[:-3].strip()
-            
-            result["fixed_code"] = code_text
-        
+
+        # 單次線性掃描切分各部分，避免對整個回應重複 split 複製
+        sections = self._split_sections(
+            response, ("ERROR_ANALYSIS:", "FIX_APPROACH:", "FIXED_CODE:")
+        )
+
+        if "ERROR_ANALYSIS:" in sections:
+            result["error_analysis"] = sections["ERROR_ANALYSIS:"].strip()
+
+        if "FIX_APPROACH:" in sections:
+            result["fix_approach"] = sections["FIX_APPROACH:"].strip()
+
+        if "FIXED_CODE:" in sections:
+            result["fixed_code"] = self._remove_markdown_format(
+                sections["FIXED_CODE:"].strip()
+            )
+
         return result
     
     async def check_dependencies(self, dependencies: List[str]) -> List[str]:
@@ -1126,10 +1670,19 @@ class CodeAgent(Agent):
             
             if not clean_dep:
                 continue
-                
+
+            # 先查已確認可用的集合（含全部標準庫），再查 sys.modules；
+            # 都未命中才用 find_spec 探測（無需真的導入）
+            root = clean_dep.split('.')[0]
+            if root in self._available_modules or root in sys.modules:
+                continue
+
             try:
-                importlib.import_module(clean_dep)
-            except ImportError:
+                if importlib.util.find_spec(clean_dep) is None:
+                    missing_deps.append(dep)
+                else:
+                    self._available_modules.add(clean_dep)
+            except (ImportError, ValueError):
                 missing_deps.append(dep)
         
         return missing_deps
@@ -1144,35 +1697,54 @@ class CodeAgent(Agent):
         Returns:
             安裝日誌
         """
+        # 跳過本次會話已安裝過的套件
+        dependencies = [d for d in dependencies if d not in self._installed_packages]
         if not dependencies:
             return "沒有需要安裝的依賴項。"
-            
+
+        # 已可導入的套件不必再走 pip：find_spec 探測為純文件系統操作，
+        # 多數調用可在這裡直接變成空操作
+        dependencies = await self.check_dependencies(dependencies)
+        if not dependencies:
+            return "沒有需要安裝的依賴項。"
+
         try:
-            # 使用 pip 安裝依賴
-            install_command = [sys.executable, "-m", "pip", "install"]
-            
+            # 使用 pip 安裝依賴（以異步子進程執行，安裝期間不阻塞事件循環）
+            # --prefer-binary 優先取 wheel，配合 pip 自帶的持久緩存，
+            # 重複安裝接近文件系統速度
+            install_command = [
+                sys.executable, "-m", "pip", "install",
+                "--quiet", "--disable-pip-version-check", "--prefer-binary",
+            ]
+
             # 添加 --user 選項，避免權限問題
             # 注意：在某些環境中可能不需要此選項
             # install_command.append("--user")
-            
+
             install_command.extend(dependencies)
-            
+
             print(f"執行安裝命令: {' '.join(install_command)}")
-            
-            process = subprocess.Popen(
-                install_command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
+
+            process = await asyncio.create_subprocess_exec(
+                *install_command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
             )
-            
-            stdout, stderr = process.communicate()
-            
+
+            stdout_bytes, stderr_bytes = await process.communicate()
+            stdout = stdout_bytes.decode()
+            stderr = stderr_bytes.decode()
+
             if process.returncode != 0:
                 error_msg = f"安裝依賴項時出錯:\n{stderr}"
                 print(error_msg)
                 return error_msg
-            
+
+            self._installed_packages.update(dependencies)
+            self._available_modules.update(
+                dep.split('==')[0].split('>=')[0].split('<=')[0].strip()
+                for dep in dependencies
+            )
             success_msg = f"成功安裝依賴項:\n{dependencies}\n輸出:\n{stdout}"
             print(success_msg)
             
@@ -1195,6 +1767,12 @@ class CodeAgent(Agent):
             return error_msg
     def _remove_markdown_format(self, code: str) -> str:
         """移除 markdown 格式"""
+        code = code.strip()
+
+        # 快速路徑：沒有 markdown 標記時不做任何複製
+        if not (code.startswith("```") or code.endswith("```")):
+            return code
+
         # 移除開頭的 ```語言名稱
         if code.startswith("```"):
             first_line_end = code.find("\n")
@@ -1207,114 +1785,83 @@ class CodeAgent(Agent):
         
         return code.strip()
 
+    def _get_exec_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        """
+        獲取（必要時創建）用戶代碼執行子進程池
+
+        Returns:
+            長駐的 ProcessPoolExecutor 實例
+        """
+        if self._exec_pool is None:
+            try:
+                mp_context = multiprocessing.get_context("forkserver")
+            except ValueError:
+                # 平台不支持 forkserver 時使用默認啟動方式
+                mp_context = multiprocessing.get_context()
+
+            self._exec_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.exec_pool_size,
+                mp_context=mp_context,
+                initializer=_init_exec_worker,
+                initargs=(self.exec_cpu_limit, self.exec_memory_limit),
+            )
+        return self._exec_pool
+
     async def _execute_python(self, code: str) -> str:
         """
         執行 Python 代碼
-        
+
+        代碼在長駐的工作子進程中執行：多個請求可以真正並行，
+        錯誤與資源濫用被隔離在子進程內，不會影響代理本身。
+
         Args:
             code: 要執行的代碼
-            
+
         Returns:
             執行結果
         """
-        
-        # 創建捕獲輸出的緩衝區
-        old_stdout = sys.stdout
-        old_stderr = sys.stderr
-        
-        redirected_output = StringIO()
-        redirected_error = StringIO()
-        
-        sys.stdout = redirected_output
-        sys.stderr = redirected_error
-        
         # 對代碼進行預處理，修復常見格式問題
         code = self._clean_code(code)
-        
-        # 創建初始化的執行環境
-        exec_globals = {
-            "os": os,
-            "sys": sys,
-            "Path": Path,
-            "result": None
-        }
-        
-        # 動態導入代碼中提到的模組
+
+        # 提取代碼中提到的模組，由子進程預先導入
         imported_modules = self._extract_imports(code)
-        for module_name in imported_modules:
-            try:
-                # 只導入代碼中明確 import 的模組
-                module = importlib.import_module(module_name)
-                exec_globals[module_name] = module
-            except ImportError:
-                # 如果模組無法導入，在執行時可能會引發錯誤
-                pass
-        
-        # 清除可能存在的 __file__ 變數以避免意外存取
-        if "__file__" in exec_globals:
-            del exec_globals["__file__"]
-        
+
         try:
-            # 執行代碼
-            exec(code, exec_globals)
-            
-            # 收集輸出
-            stdout_output = redirected_output.getvalue()
-            stderr_output = redirected_error.getvalue()
-            
-            # 檢查結果變數
-            result_output = ""
-            if "result" in exec_globals and exec_globals["result"] is not None:
-                result_output = f"結果變數:\n{exec_globals['result']}\n\n"
-            
-            # 合併輸出
-            output = result_output
-            
-            if stdout_output:
-                output += f"標準輸出:\n{stdout_output}\n"
-            
-            if stderr_output:
-                output += f"錯誤輸出:\n{stderr_output}\n"
-            
-            # 如果沒有任何輸出，提供一個默認訊息
-            if not output.strip():
-                output = "代碼執行成功，但沒有產生輸出。"
-            
-            return output
-        except SyntaxError as e:
-            # 特別處理語法錯誤
-            line_number = e.lineno if hasattr(e, 'lineno') else 0
-            offset = e.offset if hasattr(e, 'offset') else 0
-            error_text = e.text if hasattr(e, 'text') else ""
-            
-            # 提供更詳細的錯誤信息和上下文
-            code_lines = code.splitlines()
-            start_line = max(0, line_number - 3)
-            end_line = min(len(code_lines), line_number + 2)
-            
-            context = "\n代碼上下文:\n"
-            for i in range(start_line, end_line):
-                if i < len(code_lines):
-                    prefix = ">> " if i == line_number - 1 else "   "
-                    context += f"{prefix}第 {i+1} 行: {code_lines[i]}\n"
-            
-            return f"執行代碼出錯: SyntaxError 在第 {line_number} 行: {str(e)}\n{context}"
-        except Exception as e:
-            error_class = e.__class__.__name__
-            detail = str(e)
-            cl, exc, tb = sys.exc_info()
-            
-            try:
-                tb_info = traceback.extract_tb(tb)
-                _, line_number, _, _ = tb_info[-1]
-            except:
-                line_number = "未知"
-            
-            return f"執行代碼出錯: {error_class} 在第 {line_number} 行: {detail}"
-        finally:
-            # 恢復標準輸出
-            sys.stdout = old_stdout
-            sys.stderr = old_stderr
+            pool = self._get_exec_pool()
+            loop = asyncio.get_running_loop()
+            async with asyncio.timeout(self.exec_timeout):
+                run_result = await loop.run_in_executor(
+                    pool, _run_user_code, code, imported_modules
+                )
+        except asyncio.TimeoutError:
+            return f"執行代碼出錯: 執行超過 {self.exec_timeout} 秒，已中止。"
+        except concurrent.futures.process.BrokenProcessPool:
+            # 子進程崩潰（例如超出資源限制被終止），重建池
+            self._exec_pool = None
+            return "執行代碼出錯: 執行進程異常終止（可能超出資源限制）。"
+
+        if run_result["error"]:
+            return run_result["error"]
+
+        # 檢查結果變數
+        result_output = ""
+        if run_result["result_repr"] is not None:
+            result_output = f"結果變數:\n{run_result['result_repr']}\n\n"
+
+        # 合併輸出
+        output = result_output
+
+        if run_result["stdout"]:
+            output += f"標準輸出:\n{run_result['stdout']}\n"
+
+        if run_result["stderr"]:
+            output += f"錯誤輸出:\n{run_result['stderr']}\n"
+
+        # 如果沒有任何輸出，提供一個默認訊息
+        if not output.strip():
+            output = "代碼執行成功，但沒有產生輸出。"
+
+        return output
     
     def _clean_code(self, code: str) -> str:
         """
@@ -1326,73 +1873,49 @@ class CodeAgent(Agent):
         Returns:
             清理後的代碼
         """
-        # 去除代碼中的特殊字符
-        code = code.replace('\xa0', ' ')  # 替換不間斷空格
-        
-        # 確保行結束為標準換行符
-        code = code.replace('\r\n', '\n').replace('\r', '\n')
-        
-        # 修正可能的縮進問題
-        lines = code.split('\n')
-        result_lines = []
-        for line in lines:
-            # 替換 Tab 為 4 個空格
-            line = line.replace('\t', '    ')
-            result_lines.append(line)
-        
-        return '\n'.join(result_lines)
+        # 快速路徑：代碼不含需要清理的字符時直接返回，避免整串複製
+        if not any(ch in code for ch in ('\xa0', '\r', '\t')):
+            return code
+
+        # 先把 \r\n 合併成 \n，剩餘替換交給單次 translate 掃描完成
+        return code.replace('\r\n', '\n').translate(_CODE_CLEAN_TABLE)
     
     def _extract_imports(self, code: str) -> List[str]:
         """
         從 Python 代碼中提取導入的模組名稱
-        
+
+        使用 ast 解析一次即可收集所有 import/from-import 的頂層模組，
+        避免逐行正則匹配，也不會誤判註釋或字符串中的內容。
+        結果按源碼哈希緩存，與編譯緩存共用同一個鍵。
+
         Args:
             code: Python 代碼
-            
+
         Returns:
             導入的模組名稱列表
         """
-        import re
-        
-        # 找出所有 import 語句
-        import_pattern = r'^\s*import\s+(\w+)(?:\s*,\s*(\w+))*'
-        from_import_pattern = r'^\s*from\s+(\w+)(?:\.\w+)*\s+import'
-        
+        code_hash = hashlib.blake2b(code.encode(), digest_size=16).hexdigest()
+        cached = self._imports_cache.get(code_hash)
+        if cached is not None:
+            return cached
+
         modules = set()
-        
-        # 處理 import 語句
-        for line in code.split('\n'):
-            import_match = re.match(import_pattern, line)
-            if import_match:
-                # 處理 "import x, y, z" 形式
-                for group in import_match.groups():
-                    if group:
-                        modules.add(group)
-            
-            # 處理 from x import y 形式
-            from_match = re.match(from_import_pattern, line)
-            if from_match:
-                base_module = from_match.group(1)
-                if base_module:
-                    modules.add(base_module)
-        
-        # 添加常見的基礎庫別名
-        aliases = {
-            'pd': 'pandas',
-            'np': 'numpy',
-            'plt': 'matplotlib.pyplot',
-            'sns': 'seaborn',
-            'tf': 'tensorflow',
-            'torch': 'torch'
-        }
-        
-        # 檢查別名使用
-        for alias, module in aliases.items():
-            if alias in code and alias not in modules:
-                base_module = module.split('.')[0]
-                modules.add(base_module)
-        
-        return list(modules)
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            # 無法解析的代碼在執行時會報語法錯誤，這裡不做導入分析
+            self._imports_cache[code_hash] = []
+            return []
+
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules.update(alias.name.split('.')[0] for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module:
+                modules.add(node.module.split('.')[0])
+
+        result = list(modules)
+        self._imports_cache[code_hash] = result
+        return result
     
     async def _scan_imports_and_install(self, code: str) -> List[str]:
         """
@@ -1452,18 +1975,11 @@ class CodeAgent(Agent):
             'textblob': 'textblob',
         }
         
-        # 抽取所有 import 語句
-        import re
-        # 匹配 import xxx 格式
-        import_pattern = re.compile(r'^\s*import\s+([a-zA-Z0-9_.,\s]+)', re.MULTILINE)
-        # 匹配 from xxx import yyy 格式
-        from_pattern = re.compile(r'^\s*from\s+([a-zA-Z0-9_.]+)\s+import', re.MULTILINE)
-        
-        # 抽取所有匹配的模組名稱
+        # 抽取所有 import 語句（使用模組級預編譯正則）
         potential_modules = []
-        
+
         # 處理 import xxx 格式
-        for match in import_pattern.finditer(code):
+        for match in _IMPORT_STMT_RE.finditer(code):
             modules = match.group(1).split(',')
             for module in modules:
                 # 分割出主模組名稱，去掉可能的子模組和空格
@@ -1471,7 +1987,7 @@ class CodeAgent(Agent):
                 potential_modules.append(main_module)
         
         # 處理 from xxx import yyy 格式
-        for match in from_pattern.finditer(code):
+        for match in _FROM_IMPORT_RE.finditer(code):
             module = match.group(1).strip()
             # 分割出主模組名稱，去掉可能的子模組
             main_module = module.split('.')[0]
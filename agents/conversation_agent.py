@@ -1,6 +1,8 @@
 # conversation_agent.py
 import os
 import asyncio
+from collections import deque
+from itertools import islice
 from typing import Dict, List, Any, Optional
 
 from semantic_kernel.functions import KernelArguments
@@ -10,6 +12,11 @@ from semantic_kernel.prompt_template.input_variable import InputVariable
 from semantic_kernel.connectors.ai.open_ai import AzureChatPromptExecutionSettings
 
 from .base_agent import Agent
+from utils.response_cache import ResponseCache
+
+# 歷史文本的字符預算：約對應 1500 個 token（中英混排下 1 token 約 1.5-3 字符），
+# 控制提示詞長度避免佔滿上下文窗口
+_HISTORY_CHAR_BUDGET = 4000
 
 class ConversationAgent(Agent):
     """處理一般對話的代理"""
@@ -22,8 +29,13 @@ class ConversationAgent(Agent):
             name: 代理名稱
         """
         super().__init__(name, skills=["一般對話", "問候", "閒聊", "信息提供"])
-        self.chat_history = []
+        # 存放已渲染的回合字串（「用戶: ...」／「助手: ...」），
+        # deque 自動丟棄最舊回合，無需每回合手動切片
+        self.chat_history = deque(maxlen=20)
         self.chat_function = None
+
+        # 回應緩存：相同對話上下文（含最新輸入）直接重用先前回答
+        self.response_cache = ResponseCache(max_items=64)
     
     def setup_kernel(self, kernel: Kernel):
         """
@@ -81,50 +93,91 @@ class ConversationAgent(Agent):
         Returns:
             回應訊息
         """
+        # 匯集流式片段成完整回應（上游需要字串接口時使用）
+        parts = []
+        async for chunk in self.process_message_stream(message, sender):
+            parts.append(chunk)
+        return "".join(parts)
+
+    async def process_message_stream(self, message: str, sender: Optional[str] = None):
+        """
+        以流式方式處理一般對話，逐塊產出回應
+
+        首個 token 一到達就交給上游顯示，降低感知延遲；
+        完整回應仍會寫入聊天歷史與緩存。
+
+        Args:
+            message: 用戶訊息
+            sender: 訊息發送者
+
+        Yields:
+            回應文本片段
+        """
         # 確保聊天功能已註冊
         if self.chat_function is None and self.kernel is not None:
             self._register_chat_function()
-        
+
         # 更新聊天歷史
-        self.chat_history.append({"role": "user", "content": message})
-        
-        # 格式化歷史
+        self.chat_history.append(f"用戶: {message}\n")
+
+        # 格式化歷史（已包含最新的用戶輸入）
         history = self._format_chat_history()
-        
+
+        # 相同上下文的回應直接重用，省去一次 LLM 往返
+        cache_key = ResponseCache.normalize(history)
+        cached = self.response_cache.get("chat", cache_key)
+        if cached is not None:
+            self.chat_history.append(f"助手: {cached}\n")
+            yield cached
+            return
+
         # 生成回應
         try:
-            answer = await self.kernel.invoke(
-                self.chat_function,
-                KernelArguments(user_input=message, history=history)
-            )
-            
-            # 更新聊天歷史
-            self.chat_history.append({"role": "assistant", "content": str(answer)})
-            
-            # 如果歷史太長，保留最近的部分
-            if len(self.chat_history) > 20:
-                self.chat_history = self.chat_history[-20:]
-            
-            return str(answer)
+            buffer = ""
+            try:
+                async for chunk in self.kernel.invoke_stream(
+                    self.chat_function,
+                    KernelArguments(user_input=message, history=history)
+                ):
+                    text = str(chunk)
+                    buffer += text
+                    yield text
+            except AttributeError:
+                # Kernel 不支持流式接口時退回一次性調用
+                answer = await self.kernel.invoke(
+                    self.chat_function,
+                    KernelArguments(user_input=message, history=history)
+                )
+                buffer = str(answer)
+                yield buffer
+
+            # 更新聊天歷史（deque 已限制長度，無需手動裁剪）
+            self.chat_history.append(f"助手: {buffer}\n")
+            self.response_cache.put("chat", cache_key, buffer)
         except Exception as e:
-            return "我現在無法處理您的請求。請稍後再試。"
+            yield "我現在無法處理您的請求。請稍後再試。"
     
     def _format_chat_history(self) -> str:
         """
         格式化聊天歷史
-        
+
+        回合在寫入時已帶角色前綴；取最近 10 條並限制在字符預算內，
+        預算不足時優先丟棄較舊的回合。
+
         Returns:
             格式化後的聊天歷史文本
         """
-        history = ""
-        for i in range(max(0, len(self.chat_history) - 10), len(self.chat_history)):
-            msg = self.chat_history[i]
-            if msg["role"] == "user":
-                history += f"用戶: {msg['content']}\n"
-            elif msg["role"] == "assistant":
-                history += f"助手: {msg['content']}\n"
-        return history
+        # 從最新回合往回收集，超出字符預算就停止，再按時間順序拼接
+        kept = []
+        acc = 0
+        start = max(0, len(self.chat_history) - 10)
+        for turn in reversed(list(islice(self.chat_history, start, len(self.chat_history)))):
+            acc += len(turn)
+            if kept and acc > _HISTORY_CHAR_BUDGET:
+                break
+            kept.append(turn)
+        return "".join(reversed(kept))
     
     def clear_chat_history(self):
         """清除聊天歷史"""
-        self.chat_history = []
\ No newline at end of file
+        self.chat_history.clear()
\ No newline at end of file
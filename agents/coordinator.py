@@ -3,7 +3,9 @@ import os
 import time
 import asyncio
 import json
-from typing import Dict, List, Any, Optional
+import re
+import string
+from typing import Dict, List, Any, Optional, Tuple
 
 from semantic_kernel.functions import KernelArguments
 from semantic_kernel import Kernel
@@ -12,9 +14,155 @@ from semantic_kernel.prompt_template.input_variable import InputVariable
 from semantic_kernel.connectors.ai.open_ai import AzureChatPromptExecutionSettings
 
 from .base_agent import Agent
+from utils.response_cache import ResponseCache
+
+# orjson 為 C 實現的 JSON 解析器，小物件上比標準庫快數倍；
+# 未安裝時退回標準庫，解析入口統一走 _json_loads
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# 備用決策的關鍵詞表：各類別合併為單一交替式正則，模組載入時編譯一次，
+# 每次決策只需每類別掃描一遍訊息（C 層實現），而非逐個關鍵詞子串搜索
+_SEARCH_KEYWORDS = (
+    "搜索", "查詢", "查找", "找找", "搜尋", "網絡", "最新", "新聞",
+    "今天", "昨天", "最近", "search", "find", "lookup", "web",
+    "internet", "news", "recent", "latest"
+)
+_CODE_KEYWORDS = (
+    "代碼", "程式", "編程", "函數", "方法", "變數", "循環", "條件",
+    "算法", "code", "program", "function", "method", "variable",
+    "loop", "algorithm", "python", "javascript", "java", "c++", "generate",
+    "create", "file", "save", "download", "整理成檔案", "生成檔案", "檔案",
+    "文件生成", "下載", "儲存", "生成"
+)
+_DOCUMENT_KEYWORDS = (
+    "文檔", "文件分析", "摘要", "總結", "上傳的", "已上傳",
+    "document", "uploaded", "summarize", "summary", "extract"
+)
+# 檔案生成請求的啟發式關鍵詞（動詞、名詞、完整短語）
+_FILE_VERBS = (
+    "生成", "產生", "創建", "建立", "做一個", "做個", "做成", "製作",
+    "存為", "儲存", "保存", "下載", "輸出", "轉成", "轉換", "轉為",
+    "整理成", "整理為", "彙整", "匯出", "寫入", "寫成",
+    "create", "generate", "make", "build", "produce", "download",
+    "save", "store", "export", "output", "convert", "transform",
+    "organize", "compile", "write"
+)
+_FILE_NOUNS = (
+    "檔案", "文件", "文檔", "表格", "報表", "報告",
+    "pdf", "excel", "xlsx", "word", "docx", "csv", "txt", "文本",
+    "試算表", "簡報", "投影片", "ppt", "pptx", "json", "xml", "yaml",
+    "file", "document", "spreadsheet", "report", "presentation", "text"
+)
+_COMMON_PHRASES = (
+    "存成檔案", "另存為", "輸出檔案", "製作報表", "生成報告",
+    "整理資料", "匯出數據", "save as", "output file"
+)
+
+_SEARCH_RE = re.compile("|".join(map(re.escape, _SEARCH_KEYWORDS)))
+_CODE_RE = re.compile("|".join(map(re.escape, _CODE_KEYWORDS)))
+_DOCUMENT_RE = re.compile("|".join(map(re.escape, _DOCUMENT_KEYWORDS)))
+
+# 備用決策的合併正則：三個類別併成一個帶命名分組的交替式，
+# 單次 C 層掃描即可得知命中的類別；各分組按長度降序排列，
+# 確保交替式取最長匹配（如先匹配 "文件生成" 而非 "文件"）
+def _group_pattern(name, keywords):
+    ordered = sorted(keywords, key=len, reverse=True)
+    return "(?P<%s>%s)" % (name, "|".join(map(re.escape, ordered)))
+
+_FALLBACK_RE = re.compile("|".join((
+    _group_pattern("search", _SEARCH_KEYWORDS),
+    _group_pattern("code", _CODE_KEYWORDS),
+    _group_pattern("document", _DOCUMENT_KEYWORDS),
+)))
+_GROUP_TO_AGENT = {
+    "search": "search_agent",
+    "code": "code_agent",
+    "document": "document_agent",
+}
+
+# 決策 JSON 的欄位抽取正則：整串與括號配對解析都失敗時，
+# 直接從殘缺回應中撈出需要的欄位，避免落到關鍵詞備用邏輯
+_AGENT_RE = re.compile(r'"agent"\s*:\s*"([^"]+)"')
+_TASK_RE = re.compile(r'"task"\s*:\s*"((?:[^"\\]|\\.)*)"')
+_FILE_GEN_FLAG_RE = re.compile(r'"is_file_generation"\s*:\s*(true|false)', re.IGNORECASE)
+# 明確的檔案副檔名（高精度信號，可直接路由）與否定前綴（避免
+# 「不要生成檔案」這類訊息被誤判）
+_FILE_EXT_RE = re.compile(
+    r"\.(pdf|xlsx?|docx?|csv|txt|pptx?|json|xml|yaml|html)(?![a-z])",
+    re.IGNORECASE,
+)
+_NEGATION_RE = re.compile("|".join(map(re.escape, ("不要", "不用", "不必", "無需", "不需", "別"))))
+
+# 僅折疊 ASCII 大寫的轉換表：str.lower() 會對每個 CJK 碼點查
+# Unicode 資料庫做大小寫折疊（對中文是無效功），translate 走 C 層
+# 查表，中文內容直接原樣通過
+_LOWER_TRANS = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def _decision_response_format() -> Optional[Dict[str, Any]]:
+    """
+    依配置的 Azure API 版本選擇路由決策可用的結構化輸出格式
+
+    json_schema 需要 2024-08-01-preview 之後的 API 版本，json_object
+    需要 2023-12-01-preview 之後；在更舊的版本上傳 response_format
+    會讓每次路由調用都收到 400。版本日期（YYYY-MM-DD）可直接按
+    字典序比較。
+
+    Returns:
+        response_format 字典；版本過舊不支持時為 None
+    """
+    api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2024-10-21")
+    version_date = api_version.split("-preview")[0]
+    if version_date >= "2024-08-01":
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "routeDecision",
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "agent": {
+                            "type": "string",
+                            "enum": [
+                                "conversation_agent",
+                                "code_agent",
+                                "document_agent",
+                                "search_agent",
+                            ],
+                        },
+                        "is_file_generation": {"type": "boolean"},
+                        "task": {"type": "string"},
+                    },
+                    "required": ["agent", "is_file_generation", "task"],
+                    "additionalProperties": False,
+                },
+            },
+        }
+    if version_date >= "2023-12-01":
+        # 舊版只支持 JSON 模式：仍保證合法 JSON，但沒有 schema 約束
+        return {"type": "json_object"}
+    return None
+
+_FILE_VERB_RE = re.compile("|".join(map(re.escape, _FILE_VERBS)))
+_FILE_NOUN_RE = re.compile("|".join(map(re.escape, _FILE_NOUNS)))
+_COMMON_PHRASE_RE = re.compile("|".join(map(re.escape, _COMMON_PHRASES)))
 
 class CoordinatorAgent(Agent):
     """協調器代理，負責分配任務和整合結果"""
+
+    # 協作路由碰撞時各來源代理的首選替補：比「任取另一個代理」
+    # 更合理（例如代碼代理的任務退給對話代理而非搜索代理）
+    _SOURCE_FALLBACK = {
+        "code_agent": "conversation_agent",
+        "document_agent": "conversation_agent",
+        "search_agent": "conversation_agent",
+        "conversation_agent": "document_agent",
+    }
     
     def __init__(self, name: str = "Coordinator"):
         """
@@ -25,7 +173,15 @@ class CoordinatorAgent(Agent):
         """
         super().__init__(name)
         self.agents = {}  # 註冊的代理
+        self._dispatch = {}  # 預先綁定的 receive_message 方法，路由時免去屬性鏈查找
+        self._alt_for = {}  # 每個代理對應的替代代理，協作路由碰撞時 O(1) 取用
         self.decision_function = None  # 任務分配決策函數
+        # 由系統注入的受限流保護 invoke（見 MultiAgentSystem._invoke_llm）；
+        # 未注入時退回裸 kernel.invoke
+        self.llm_invoker = None
+
+        # 路由決策緩存：相同輸入的決策直接重用
+        self.response_cache = ResponseCache(max_items=128)
     
     def register_agent(self, agent_name: str, agent: Agent):
         """
@@ -36,7 +192,24 @@ class CoordinatorAgent(Agent):
             agent: 代理實例
         """
         self.agents[agent_name] = agent
+        self._dispatch[agent_name] = agent.receive_message
+
+        # 重建替代代理映射：註冊頻率極低，路由頻率高，預算划算
+        names = tuple(self.agents)
+        self._alt_for = {
+            n: next((m for m in names if m != n), None) for n in names
+        }
     
+    def setup_kernel(self, kernel: Kernel):
+        """
+        設置 Kernel 並預先註冊決策功能
+
+        Args:
+            kernel: Semantic Kernel 實例
+        """
+        super().setup_kernel(kernel)
+        self._register_decision_function()
+
     def _register_decision_function(self):
         """註冊決策功能，用於將任務分配到合適的代理"""
         
@@ -67,16 +240,33 @@ class CoordinatorAgent(Agent):
         
         用戶輸入: {{$input}}
         
+        另外請一併判斷用戶是否要求生成或創建任何類型的文件或檔案，包括：
+        直接請求建立文件（如「做一個PDF」、「生成報表」）、間接要求輸出到
+        檔案、將信息轉換為檔案格式、要求下載或保存內容。即使用詞不精確，
+        只要意圖是生成檔案，就判斷為 true。
+
         請以 JSON 格式回復，格式如下:
         {
         "agent": "選定的代理名稱",
-        "reason": "選擇該代理的詳細原因，說明你如何理解用戶的真實意圖",
+        "is_file_generation": true 或 false,
         "task": "給代理的具體任務描述"
         }
         
         只返回 JSON，不要有其他多餘的解釋。
         """
         
+        # 結構化輸出：模型保證返回合規 JSON，首次解析即成功，
+        # 不再走 JSON 解析失敗後的關鍵詞回退重試；格式依 API
+        # 版本能力選定，過舊版本不傳以免每次路由調用都 400
+        settings_kwargs: Dict[str, Any] = {
+            "service_id": "default",
+            "max_tokens": 150,  # 路由 JSON 很小且無需解釋欄位，縮短解碼時間
+            "temperature": 0.0,  # 確定性輸出
+        }
+        response_format = _decision_response_format()
+        if response_format is not None:
+            settings_kwargs["response_format"] = response_format
+
         # 決策功能配置
         decision_config = PromptTemplateConfig(
             template=decision_prompt,
@@ -85,11 +275,7 @@ class CoordinatorAgent(Agent):
             input_variables=[
                 InputVariable(name="input", description="用戶輸入", is_required=True),
             ],
-            execution_settings=AzureChatPromptExecutionSettings(
-                service_id="default",
-                max_tokens=800,  # 增加 token 數以允許更詳細的分析
-                temperature=0.0,  # 確定性輸出
-            )
+            execution_settings=AzureChatPromptExecutionSettings(**settings_kwargs)
         )
         
         # 添加決策功能到 Kernel
@@ -111,92 +297,104 @@ class CoordinatorAgent(Agent):
             處理結果
         """
         try:
-            # 確保決策功能已註冊
-            if self.decision_function is None and self.kernel is not None:
-                self._register_decision_function()
+            # 提取最新訊息進行所有決策（rpartition 單趟掃描取最後一段）
+            _, sep, tail = message.rpartition("[新問題]")
+            latest_message = tail.strip() if sep else message
             
-            # 提取最新訊息進行所有決策
-            latest_message = message
-            if "[新問題]" in message:
-                parts = message.split("[新問題]")
-                if len(parts) > 1:
-                    latest_message = parts[1].strip()
+            # 1. 先用關鍵字檢測檔案生成請求（純 CPU，命中即可完全跳過 LLM）：
+            # 動詞、名詞、短語各掃描一次預編譯的交替式正則
+            latest_message_lower = latest_message.translate(_LOWER_TRANS)
+            has_file_verb = _FILE_VERB_RE.search(latest_message_lower) is not None
+            has_file_noun = _FILE_NOUN_RE.search(latest_message_lower) is not None
+            has_common_phrase = _COMMON_PHRASE_RE.search(latest_message_lower) is not None
+            has_file_ext = _FILE_EXT_RE.search(latest_message_lower) is not None
             
-            # 1. 優先使用 AI 判斷是否為檔案生成請求
-            if self.kernel is not None:
-                is_file_gen_by_ai = await self._is_file_generation_request(latest_message)
-                if is_file_gen_by_ai and "code_agent" in self.agents:
-                    print(f"File generation detected by AI, routing to code_agent: '{latest_message[:50]}...'") #debug
-                    task_with_marker = f"[FILE_GENERATION_MODE=True]\n{message}"
-                    return await self.agents["code_agent"].receive_message(task_with_marker, self.name)
-            
-            # 2. 備用方案：使用關鍵字檢測
-            latest_message_lower = latest_message.lower()
-            
-            # 檔案生成相關動詞
-            file_verbs = [
-                "生成", "產生", "創建", "建立", "做一個", "做個", "做成", "製作", 
-                "存為", "儲存", "保存", "下載", "輸出", "轉成", "轉換", "轉為", 
-                "整理成", "整理為", "彙整", "匯出", "輸出", "寫入", "寫成",
-                "create", "generate", "make", "build", "produce", "download",
-                "save", "store", "export", "output", "convert", "transform", 
-                "organize", "compile", "write"
-            ]
-            
-            # 檔案相關名詞
-            file_nouns = [
-                "檔案", "文件", "文檔", "表格", "報表", "報告", 
-                "pdf", "excel", "xlsx", "word", "docx", "csv", "txt", "文本", 
-                "試算表", "簡報", "投影片", "ppt", "pptx", "json", "xml", "yaml",
-                "file", "document", "spreadsheet", "report", "presentation", "text"
-            ]
-            
-            # 檢查是否同時包含動詞和名詞
-            has_file_verb = any(verb in latest_message_lower for verb in file_verbs)
-            has_file_noun = any(noun in latest_message_lower for noun in file_nouns)
-             
-            # 檢查一些常見的完整短語
-            common_phrases = [
-                "存成檔案", "另存為", "輸出檔案", "製作報表", "生成報告", 
-                "整理資料", "匯出數據", "save as", "output file"
-            ]
-            has_common_phrase = any(phrase in latest_message_lower for phrase in common_phrases)
-            
-            # 如果同時包含動詞和名詞，或者有檔案擴展名，或者有常見短語，判定為檔案生成請求
-            is_file_gen_request = (has_file_verb and has_file_noun) or has_common_phrase
+            # 如果同時包含動詞和名詞，或有明確副檔名，或有常見短語，
+            # 判定為檔案生成請求；含否定詞的訊息交給統一決策判斷
+            is_file_gen_request = (
+                ((has_file_verb and has_file_noun) or has_file_ext or has_common_phrase)
+                and _NEGATION_RE.search(latest_message) is None
+            )
             
-            # 如果關鍵字檢測判定為檔案生成請求，路由到code_agent
             if is_file_gen_request and "code_agent" in self.agents:
                 print(f"File generation detected by keywords, routing to code_agent: '{latest_message[:50]}...'") #debug
                 task_with_marker = f"[FILE_GENERATION_MODE=True]\n{message}"
-                return await self.agents["code_agent"].receive_message(task_with_marker, self.name)
+                return await self._dispatch["code_agent"](task_with_marker, self.name)
             
-            # 3. 常規 AI 決策流程
-            decision_result = await self.kernel.invoke(
-                self.decision_function,
-                KernelArguments(input=latest_message)
-            )
-            
-            # 解析決策結果
-            try:
-                decision = json.loads(str(decision_result))
-                selected_agent = decision.get("agent")
-                task = decision.get("task", message)
-            except (json.JSONDecodeError, AttributeError):
-                # 如果決策結果無法解析，使用備用邏輯
-                selected_agent = self._fallback_decision(latest_message)
-                task = message
+            # 2. 關鍵詞信心足夠高時直接路由，省去決策 LLM 調用
+            fallback_agent, fallback_score = self._fallback_decision_scored(latest_message)
+            if fallback_score >= 2 and fallback_agent in self.agents:
+                print(f"Confident keyword routing for message: '{latest_message[:50]}...' -> {fallback_agent}") #debug
+                return await self._dispatch[fallback_agent](message, self.name)
+
+            # 3. 統一決策：單次 LLM 調用同時返回路由與檔案生成判斷
+            # （相同輸入的決策直接取緩存）
+            decision_key = ResponseCache.normalize(latest_message)
+            cached_decision = self.response_cache.get("routeDecision", decision_key)
+            speculative_task = None
+            if cached_decision is not None:
+                selected_agent, cached_task, is_file_gen = cached_decision
+                task = cached_task or message
+            else:
+                # 多數請求最終路由到對話代理：等待決策的同時投機啟動
+                # 對話回應，決策選中就直接取用，否則取消
+                if "conversation_agent" in self.agents:
+                    speculative_task = asyncio.create_task(
+                        self._dispatch["conversation_agent"](message, self.name)
+                    )
+
+                # 經系統的限流/重試包裝調用：每回合都會走到這裡，
+                # 撞上 429 時重試而不是把整個回合浪費在錯誤字符串上
+                invoke = self.llm_invoker or self.kernel.invoke
+                decision_result = await invoke(
+                    self.decision_function,
+                    KernelArguments(input=latest_message)
+                )
+
+                # 解析決策結果（容忍前言或 markdown 圍欄包裹的 JSON）
+                decision = self._parse_decision_json(str(decision_result))
+                if decision is not None:
+                    selected_agent = decision.get("agent")
+                    # 正則恢復分支可能只撈到 agent（task 為 None），
+                    # 用 or 而非 get 默認值才能把 None 換成原訊息
+                    task = decision.get("task") or message
+                    is_file_gen = bool(decision.get("is_file_generation"))
+                    self.response_cache.put(
+                        "routeDecision", decision_key,
+                        (selected_agent, decision.get("task"), is_file_gen)
+                    )
+                else:
+                    # 如果決策結果無法解析，使用備用邏輯
+                    selected_agent = self._fallback_decision(latest_message)
+                    task = message
+                    is_file_gen = False
+
+            # 4. 檔案生成請求優先路由到 code_agent
+            if is_file_gen and "code_agent" in self.agents:
+                if speculative_task is not None:
+                    speculative_task.cancel()
+                print(f"File generation detected by AI, routing to code_agent: '{latest_message[:50]}...'") #debug
+                task_with_marker = f"[FILE_GENERATION_MODE=True]\n{message}"
+                return await self._dispatch["code_agent"](task_with_marker, self.name)
             
             # 檢查選定的代理是否註冊
             if selected_agent in self.agents:
-                # 委派任務給選定的代理
-                response = await self.agents[selected_agent].receive_message(task, self.name)
+                # 委派任務給選定的代理；投機啟動的對話回應若被選中
+                # 直接等待結果，否則取消
+                if selected_agent == "conversation_agent" and speculative_task is not None:
+                    response = await speculative_task
+                else:
+                    if speculative_task is not None:
+                        speculative_task.cancel()
+                    response = await self._dispatch[selected_agent](task, self.name)
                 print(f"Routing decision for message: '{latest_message[:50]}...' -> {selected_agent}") #debug
                 return response
             else:
                 # 如果選定的代理未註冊，使用對話代理
+                if speculative_task is not None:
+                    return await speculative_task
                 if "conversation_agent" in self.agents:
-                    return await self.agents["conversation_agent"].receive_message(message, self.name)
+                    return await self._dispatch["conversation_agent"](message, self.name)
                 return f"無法處理您的請求。未找到合適的代理。"
                 
         except Exception as e:
@@ -205,58 +403,162 @@ class CoordinatorAgent(Agent):
             print(f"處理請求時出錯: {str(e)}\n{traceback.format_exc()}")
             return f"處理您的請求時出現了問題。請稍後再試。"
         
-    async def _is_file_generation_request(self, message: str) -> bool:
-        """使用 AI 判斷是否為檔案生成請求"""
-        # 註冊判斷函數（如果尚未註冊）
-        if not hasattr(self, "file_gen_function"):
-            from semantic_kernel.prompt_template import PromptTemplateConfig
-            from semantic_kernel.prompt_template.input_variable import InputVariable
-            from semantic_kernel.connectors.ai.open_ai import AzureChatPromptExecutionSettings
-            
-            prompt = """
-            請判斷用戶的消息是否要求生成或創建任何類型的文件或檔案。這包括：
-            1. 直接請求建立文件（如「做一個PDF」、「生成報表」）
-            2. 間接要求輸出到檔案（如「將資料整理好」並暗示需要檔案形式）
-            3. 任何提到將信息或數據轉換為檔案格式的請求
-            4. 要求下載或保存內容的請求
-            
-            即使用戶用詞不精確或不完整，只要意圖是生成檔案，也請判斷為「是」。
-            
-            用戶消息: {{$message}}
-            
-            請僅回答「是」或「否」。
-            """
-            
-            config = PromptTemplateConfig(
-                template=prompt,
-                name="isFileGenerationRequest",
-                template_format="semantic-kernel",
-                input_variables=[
-                    InputVariable(name="message", description="用戶消息", is_required=True),
-                ],
-                execution_settings=AzureChatPromptExecutionSettings(
-                    service_id="default",
-                    max_tokens=100,
-                    temperature=0.0,  # 確定性輸出
-                )
+    async def process_message_stream(self, message: str, sender: Optional[str] = None):
+        """
+        流式處理用戶請求，逐塊產出回應
+
+        只有在廉價信號（關鍵詞、路由緩存）判定為純對話時才透傳
+        對話代理的流式輸出，感知延遲降為首 token 延遲；其餘情況
+        退回標準路徑整段產出一次，保證路由行為與 process_message
+        一致。
+
+        Args:
+            message: 用戶訊息內容
+            sender: 訊息發送者 (通常是 "user")
+
+        Yields:
+            回應片段
+        """
+        conversation_agent = self.agents.get("conversation_agent")
+        stream_fn = getattr(conversation_agent, "process_message_stream", None)
+        if stream_fn is not None:
+            _, sep, tail = message.rpartition("[新問題]")
+            latest_message = tail.strip() if sep else message
+            latest_message_lower = latest_message.translate(_LOWER_TRANS)
+
+            # 任何檔案生成跡象或專業代理關鍵詞命中都走標準路徑
+            has_file_signal = (
+                _FILE_VERB_RE.search(latest_message_lower) is not None
+                or _FILE_EXT_RE.search(latest_message_lower) is not None
+                or _COMMON_PHRASE_RE.search(latest_message_lower) is not None
             )
-            
-            self.file_gen_function = self.kernel.add_function(
-                function_name="isFileGenerationRequest",
-                plugin_name="coordinatorPlugin",
-                prompt_template_config=config,
+            _, fallback_score = self._fallback_decision_scored(latest_message)
+            plain_chat = not has_file_signal and fallback_score == 0
+
+            # 路由緩存命中時以緩存決策為準（比關鍵詞信號更可靠）
+            cached_decision = self.response_cache.get(
+                "routeDecision", ResponseCache.normalize(latest_message)
             )
-        
-        # 調用 AI 判斷
-        from semantic_kernel.functions import KernelArguments
-        result = await self.kernel.invoke(
-            self.file_gen_function,
-            KernelArguments(message=message)
-        )
-        
-        result_str = str(result).strip().lower()
-        return "是" in result_str or "yes" in result_str
-    
+            if cached_decision is not None:
+                cached_agent, _, cached_file_gen = cached_decision
+                plain_chat = cached_agent == "conversation_agent" and not cached_file_gen
+
+            if plain_chat:
+                async for chunk in stream_fn(message, self.name):
+                    yield chunk
+                return
+
+        yield await self.process_message(message, sender)
+
+    async def process_messages(self, messages: List[str]) -> List[str]:
+        """
+        批次處理多個用戶請求（離線評測、資料集重放等場景）
+
+        所有請求以 asyncio.gather 併發路由與派發，後端可同時服務
+        多個小請求，總耗時從逐條累加變為受併發上限約束的單輪往返。
+
+        Args:
+            messages: 用戶訊息列表
+
+        Returns:
+            與輸入同順序的處理結果列表
+        """
+        semaphore = asyncio.Semaphore(16)  # 限制扇出，避免壓垮後端
+
+        async def _bounded(msg: str) -> str:
+            async with semaphore:
+                return await self.process_message(msg, "user")
+
+        return list(await asyncio.gather(*(_bounded(m) for m in messages)))
+
+    def _parse_decision_json(self, text: str) -> Optional[Dict[str, Any]]:
+        """
+        從決策回應中解析 JSON
+
+        模型偶爾會在 JSON 外帶上前言或 markdown 圍欄，直接 json.loads
+        會失敗而落入關鍵詞備用邏輯。先嘗試整串解析，失敗時用括號
+        配對找出第一個平衡的 {...} 片段再解析。
+
+        Args:
+            text: 決策功能的原始回應
+
+        Returns:
+            解析出的決策字典，無法解析時為 None
+        """
+        text = text.strip()
+        try:
+            return _json_loads(text)
+        except ValueError:
+            pass
+
+        start = text.find("{")
+        while start != -1:
+            depth = 0
+            in_string = False
+            escaped = False
+            for i in range(start, len(text)):
+                ch = text[i]
+                if in_string:
+                    if escaped:
+                        escaped = False
+                    elif ch == "\\":
+                        escaped = True
+                    elif ch == '"':
+                        in_string = False
+                elif ch == '"':
+                    in_string = True
+                elif ch == "{":
+                    depth += 1
+                elif ch == "}":
+                    depth -= 1
+                    if depth == 0:
+                        try:
+                            return _json_loads(text[start:i + 1])
+                        except ValueError:
+                            break
+            start = text.find("{", start + 1)
+
+        # 最後手段：逐欄位正則抽取（模型偶爾輸出殘缺或夾敘夾議的
+        # JSON，agent 欄位往往仍然完整，撈得到就不必退回關鍵詞邏輯）
+        agent_match = _AGENT_RE.search(text)
+        if agent_match is not None:
+            task_match = _TASK_RE.search(text)
+            flag_match = _FILE_GEN_FLAG_RE.search(text)
+            return {
+                "agent": agent_match.group(1),
+                "task": task_match.group(1) if task_match else None,
+                "is_file_generation": (
+                    flag_match is not None and flag_match.group(1).lower() == "true"
+                ),
+            }
+        return None
+
+    def _fallback_decision_scored(self, message: str) -> Tuple[str, int]:
+        """
+        帶信心分數的關鍵詞決策
+
+        統計各類別的關鍵詞命中數，以最高分類別為候選，
+        分數取其與次高類別的差距；差距夠大代表分類明確，
+        可以不經 LLM 直接路由。
+
+        Args:
+            message: 用戶訊息
+
+        Returns:
+            (候選代理名稱, 信心分數)；無任何命中時為 ("conversation_agent", 0)
+        """
+        message = message.translate(_LOWER_TRANS)
+        scores = {
+            "search_agent": len(_SEARCH_RE.findall(message)),
+            "code_agent": len(_CODE_RE.findall(message)),
+            "document_agent": len(_DOCUMENT_RE.findall(message)),
+        }
+        best = max(scores, key=scores.get)
+        if scores[best] == 0:
+            return "conversation_agent", 0
+        ranked = sorted(scores.values(), reverse=True)
+        return best, ranked[0] - ranked[1]
+
     def _fallback_decision(self, message: str) -> str:
         """
         備用決策邏輯，當 AI 決策失敗時使用
@@ -267,38 +569,20 @@ class CoordinatorAgent(Agent):
         Returns:
             選定的代理名稱
         """
-        message = message.lower()
-        
-        # 搜索相關關鍵詞
-        search_keywords = [
-            "搜索", "查詢", "查找", "找找", "搜尋", "網絡", "最新", "新聞", 
-            "今天", "昨天", "最近", "search", "find", "lookup", "web", 
-            "internet", "news", "recent", "latest"
-        ]
-        
-        # 代碼相關關鍵詞
-        code_keywords = [
-            "代碼", "程式", "編程", "函數", "方法", "變數", "循環", "條件", 
-            "算法", "code", "program", "function", "method", "variable", 
-            "loop", "algorithm", "python", "javascript", "java", "c++", "generate",
-            "create", "file", "save", "download", "整理成檔案", "生成檔案","檔案", "文件生成", "下載", "儲存", "生成"
-        ]
-        
-        # 文檔相關關鍵詞
-        document_keywords = [
-            "文檔", "文件分析", "摘要", "總結", "上傳的", "已上傳", 
-            "document", "uploaded", "summarize", "summary", "extract"
-        ]
-        
-        # 檢查關鍵詞匹配
-        if any(keyword in message for keyword in search_keywords):
-            return "search_agent"
-        elif any(keyword in message for keyword in code_keywords):
+        message = message.translate(_LOWER_TRANS)
+
+        # 單次掃描合併正則；search 為最高優先級可立即返回，
+        # 其餘類別記下命中後按原有優先順序裁決
+        seen = set()
+        for match in _FALLBACK_RE.finditer(message):
+            if match.lastgroup == "search":
+                return "search_agent"
+            seen.add(match.lastgroup)
+        if "code" in seen:
             return "code_agent"
-        elif any(keyword in message for keyword in document_keywords):
+        if "document" in seen:
             return "document_agent"
-        else:
-            return "conversation_agent"  # 默認使用對話代理
+        return "conversation_agent"  # 默認使用對話代理
     
     async def route_task(self, task: str, source_agent: str) -> str:
         """
@@ -314,17 +598,18 @@ class CoordinatorAgent(Agent):
         # 使用決策邏輯選擇合適的代理
         selected_agent = self._fallback_decision(task)
         
-        # 確保不會路由回發起請求的代理
-        if selected_agent == source_agent and len(self.agents) > 1:
-            # 選擇另一個代理
-            for agent_name in self.agents:
-                if agent_name != source_agent:
-                    selected_agent = agent_name
-                    break
+        # 確保不會路由回發起請求的代理：優先查語義上合理的替補表，
+        # 替補未註冊時退回預先算好的替代映射
+        if selected_agent == source_agent:
+            preferred = self._SOURCE_FALLBACK.get(source_agent)
+            if preferred in self.agents:
+                selected_agent = preferred
+            else:
+                selected_agent = self._alt_for.get(source_agent) or selected_agent
         
         # 委派任務
         if selected_agent in self.agents:
-            return await self.agents[selected_agent].receive_message(
+            return await self._dispatch[selected_agent](
                 f"[Task from {source_agent}]: {task}", 
                 self.name
             )
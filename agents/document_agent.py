@@ -1,10 +1,10 @@
 import os
+import re
+import heapq
 import asyncio
+import hashlib
 from typing import Dict, List, Any, Optional
 from pathlib import Path
-import PyPDF2
-import docx
-import pandas as pd
 
 from semantic_kernel.functions import KernelArguments
 from semantic_kernel import Kernel
@@ -14,6 +14,29 @@ from semantic_kernel.connectors.ai.open_ai import AzureChatPromptExecutionSettin
 
 from .base_agent import Agent
 from utils.document_processor import DocumentProcessor
+from utils.response_cache import ResponseCache
+
+# 長文檔分塊參數：單塊字符上限與相鄰塊的重疊量（保留跨塊上下文）
+_CHUNK_MAX_CHARS = 8000
+_CHUNK_OVERLAP = 200
+# 句子邊界：中英文句末標點後的空白，或空行
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?。！？])\s+|\n{2,}")
+# 檢索用詞元：連續的英數字串，或單個 CJK 字符
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[\u4e00-\u9fff]")
+# 問答檢索返回的塊數
+_QA_TOP_K = 5
+
+# 請求類型觸發詞：合併為單一帶命名分組的交替式正則，一趟 C 層
+# 掃描取代逐關鍵詞的 in 子串搜索；各分組按長度降序確保取最長匹配
+_ACTION_KEYWORDS = (
+    ("load", ("載入", "加載", "讀取", "load")),
+    ("list", ("列出文檔", "list documents")),
+    ("summarize", ("摘要", "總結", "summarize")),
+)
+_ACTION_RE = re.compile("|".join(
+    "(?P<%s>%s)" % (name, "|".join(map(re.escape, sorted(kws, key=len, reverse=True))))
+    for name, kws in _ACTION_KEYWORDS
+))
 
 class DocumentAgent(Agent):
     """處理文檔分析和問答的代理"""
@@ -26,10 +49,15 @@ class DocumentAgent(Agent):
             name: 代理名稱
         """
         super().__init__(name, skills=["文檔載入", "文檔分析", "文檔摘要", "文檔問答"])
-        self.documents = {}  # 儲存已載入的文檔
+        self.documents = {}  # 已載入的文檔：名稱 -> 載入時預計算的記錄
+        self._name_re = None  # 所有文檔名的交替式正則，add_document 時重建
         self.document_processor = DocumentProcessor()  # 文檔處理器
         self.summarize_function = None
         self.qa_function = None
+
+        # 回應緩存：摘要按文檔內容哈希、問答按 (文檔哈希, 正規化問題)
+        # 精確匹配，重複請求免去整輪 LLM 調用
+        self.response_cache = ResponseCache(max_items=64)
     
     def setup_kernel(self, kernel: Kernel):
         """
@@ -127,22 +155,25 @@ class DocumentAgent(Agent):
             self._register_document_functions()
         
         try:
-            # 檢查請求類型
+            # 檢查請求類型：單趟掃描收集命中的觸發詞分組
             message_lower = message.lower()
+            actions = {
+                match.lastgroup for match in _ACTION_RE.finditer(message_lower)
+            }
             
             # 載入文檔請求
-            if "載入" in message_lower or "加載" in message_lower or "讀取" in message_lower or "load" in message_lower:
+            if "load" in actions:
                 # 注意：實際實現中，文件載入需要與 Streamlit 上傳機制整合
                 # 這裡是 API 示例，實際應用會有所不同
                 return "請使用上傳功能來載入文檔。"
             
             # 列出文檔請求
-            elif "列出文檔" in message_lower or "list documents" in message_lower:
+            elif "list" in actions:
                 return self._list_documents()
             
             # 文檔摘要請求
-            elif "摘要" in message_lower or "總結" in message_lower or "summarize" in message_lower:
-                doc_name = self._extract_document_name(message)
+            elif "summarize" in actions:
+                doc_name = self._extract_document_name(message, message_lower)
                 if doc_name:
                     return await self.summarize_document(doc_name)
                 else:
@@ -151,7 +182,7 @@ class DocumentAgent(Agent):
             # 假設其他是文檔問答請求
             else:
                 # 嘗試找出相關文檔
-                doc_name = self._extract_document_name(message)
+                doc_name = self._extract_document_name(message, message_lower)
                 
                 if doc_name and doc_name in self.documents:
                     # 從特定文檔回答問題
@@ -191,12 +222,44 @@ class DocumentAgent(Agent):
             if document_name is None:
                 document_name = os.path.basename(file_path)
             
-            self.documents[document_name] = text
-            
-            return f"文檔 '{document_name}' 已成功加載。({len(text)} 字符)"
+            return self.add_document(document_name, text)
         except Exception as e:
             return f"載入文檔時出錯: {str(e)}"
     
+    def add_document(self, document_name: str, text: str) -> str:
+        """
+        以已提取好的文本註冊文檔（批次上傳時文本提取在進程池完成）
+        
+        Args:
+            document_name: 文檔名稱
+            text: 文檔文本內容
+            
+        Returns:
+            載入結果訊息
+        """
+        # 載入時一次性預計算熱路徑要用的衍生數據：小寫名稱
+        # （名稱提取）、內容摘要鍵（緩存）、分塊列表（長文摘要）
+        self.documents[document_name] = {
+            "text": text,
+            "lower_name": document_name.lower(),
+            "digest": hashlib.blake2b(
+                text.encode("utf-8"), digest_size=16
+            ).hexdigest(),
+            "chunks": self._chunk_text(text),
+        }
+
+        # 重建文檔名稱的交替式正則：點名檢測對訊息只掃一趟，
+        # 長名稱在前保證偏好最長匹配
+        names = sorted(
+            (record["lower_name"] for record in self.documents.values()),
+            key=len, reverse=True,
+        )
+        self._name_re = re.compile(
+            "|".join(map(re.escape, names)), re.IGNORECASE
+        )
+
+        return f"文檔 '{document_name}' 已成功加載。({len(text)} 字符)"
+    
     def get_document_names(self) -> List[str]:
         """
         獲取所有已加載文檔的名稱
@@ -216,8 +279,57 @@ class DocumentAgent(Agent):
         Returns:
             文檔內容，如果不存在則返回 None
         """
-        return self.documents.get(document_name)
-    
+        record = self.documents.get(document_name)
+        return record["text"] if record is not None else None
+
+    def find_mentioned_document(self, message: str) -> Optional[str]:
+        """
+        找出訊息中明確點名的文檔
+
+        單趟掃描所有文檔名組成的交替式正則，取代逐名稱的子串搜索。
+
+        Args:
+            message: 用戶訊息
+
+        Returns:
+            被點名的文檔名稱，沒有則返回 None
+        """
+        if self._name_re is None:
+            return None
+        match = self._name_re.search(message)
+        if match is None:
+            return None
+        matched_lower = match.group(0).lower()
+        for name, record in self.documents.items():
+            if record["lower_name"] == matched_lower:
+                return name
+        return None
+
+    def get_relevant_chunks(self, document_name: str, query: str,
+                            top_k: int = _QA_TOP_K) -> Optional[str]:
+        """
+        取文檔中與查詢最相關的內容窗口
+
+        短文檔直接返回全文；長文檔按詞元重疊度挑出 top_k 塊拼接，
+        供調用方放進提示而不必附上整篇文檔。
+
+        Args:
+            document_name: 文檔名稱
+            query: 用戶查詢
+            top_k: 返回的塊數
+
+        Returns:
+            相關內容文本，如果文檔不存在則返回 None
+        """
+        record = self.documents.get(document_name)
+        if record is None:
+            return None
+        if len(record["text"]) <= _CHUNK_MAX_CHARS:
+            return record["text"]
+        return "\n---\n".join(
+            self._retrieve_chunks(record["chunks"], query, top_k)
+        )
+
     async def summarize_document(self, document_name_or_text: str) -> str:
         """
         生成文檔摘要
@@ -228,20 +340,111 @@ class DocumentAgent(Agent):
         Returns:
             文檔摘要
         """
-        # 檢查輸入是否為文檔名稱
-        if document_name_or_text in self.documents:
-            document_text = self.documents[document_name_or_text]
+        # 檢查輸入是否為文檔名稱；已載入文檔直接取預計算的記錄
+        record = self.documents.get(document_name_or_text)
+        if record is not None:
+            document_text = record["text"]
+            doc_key = record["digest"]
         else:
             document_text = document_name_or_text
+            doc_key = hashlib.blake2b(
+                document_text.encode("utf-8"), digest_size=16
+            ).hexdigest()
         
+        # 相同內容的摘要直接取緩存（用戶常重複請求同一文檔的摘要）
+        cached = self.response_cache.get("summarize", doc_key)
+        if cached is not None:
+            return cached
+
         try:
-            summary = await self.kernel.invoke(
-                self.summarize_function,
-                KernelArguments(input=document_text)
-            )
-            return str(summary)
+            # 長文檔走 map-reduce：分塊併發摘要後再總結各塊摘要，
+            # 單次調用的 token 數有上界，延遲隨長度次線性增長
+            if len(document_text) > _CHUNK_MAX_CHARS:
+                chunks = record["chunks"] if record is not None else None
+                summary_text = await self._map_reduce_summarize(
+                    document_text, chunks=chunks
+                )
+            else:
+                summary = await self.kernel.invoke(
+                    self.summarize_function,
+                    KernelArguments(input=document_text)
+                )
+                summary_text = str(summary)
+            self.response_cache.put("summarize", doc_key, summary_text)
+            return summary_text
         except Exception as e:
             return f"生成摘要時出錯: {str(e)}"
+
+    async def _map_reduce_summarize(self, document_text: str,
+                                    chunks: Optional[List[str]] = None) -> str:
+        """
+        對長文檔做 map-reduce 摘要
+
+        Args:
+            document_text: 文檔全文
+            chunks: 預先算好的分塊（已載入文檔），為 None 時現切
+
+        Returns:
+            整合後的摘要
+        """
+        if chunks is None:
+            chunks = self._chunk_text(document_text)
+
+        async def _summarize_chunk(chunk: str) -> str:
+            # 各塊摘要按內容哈希緩存，重疊或重複上傳的塊可直接重用
+            chunk_key = hashlib.blake2b(
+                chunk.encode("utf-8"), digest_size=16
+            ).hexdigest()
+            cached = self.response_cache.get("summarizeChunk", chunk_key)
+            if cached is not None:
+                return cached
+            partial = str(await self.kernel.invoke(
+                self.summarize_function,
+                KernelArguments(input=chunk)
+            ))
+            self.response_cache.put("summarizeChunk", chunk_key, partial)
+            return partial
+
+        partials = await asyncio.gather(*(_summarize_chunk(c) for c in chunks))
+
+        final = await self.kernel.invoke(
+            self.summarize_function,
+            KernelArguments(input="\n\n".join(partials))
+        )
+        return str(final)
+
+    def _chunk_text(self, text: str, max_chars: int = _CHUNK_MAX_CHARS,
+                    overlap: int = _CHUNK_OVERLAP) -> List[str]:
+        """
+        按句子邊界將文本切成帶重疊的塊
+
+        Args:
+            text: 要切分的文本
+            max_chars: 單塊字符上限
+            overlap: 相鄰塊的重疊字符數
+
+        Returns:
+            文本塊列表
+        """
+        sentences = _SENTENCE_SPLIT_RE.split(text)
+        chunks = []
+        current = []
+        current_len = 0
+        for sentence in sentences:
+            if not sentence:
+                continue
+            if current and current_len + len(sentence) > max_chars:
+                chunk = "\n".join(current)
+                chunks.append(chunk)
+                # 下一塊以前一塊的尾部開頭，避免句群被硬切斷上下文
+                tail = chunk[-overlap:]
+                current = [tail]
+                current_len = len(tail)
+            current.append(sentence)
+            current_len += len(sentence) + 1
+        if current:
+            chunks.append("\n".join(current))
+        return chunks
     
     async def answer_from_document(self, document_name_or_text: str, question: str) -> str:
         """
@@ -254,34 +457,88 @@ class DocumentAgent(Agent):
         Returns:
             回答
         """
-        # 檢查輸入是否為文檔名稱
-        if document_name_or_text in self.documents:
-            document_text = self.documents[document_name_or_text]
+        # 檢查輸入是否為文檔名稱；已載入文檔直接取預計算的記錄
+        record = self.documents.get(document_name_or_text)
+        if record is not None:
+            document_text = record["text"]
+            doc_key = record["digest"]
         else:
             document_text = document_name_or_text
+            doc_key = hashlib.blake2b(
+                document_text.encode("utf-8"), digest_size=16
+            ).hexdigest()
         
+        # 相同文檔上的相同問題直接取緩存
+        qa_key = f"{doc_key}\n{ResponseCache.normalize(question)}"
+        cached = self.response_cache.get("documentQA", qa_key)
+        if cached is not None:
+            return cached
+
+        # 長文檔只把與問題相關的塊放進提示，輸入 token 從 O(全文)
+        # 降到 O(top_k × 塊長)；短文檔仍然整篇附上
+        if record is not None and len(document_text) > _CHUNK_MAX_CHARS:
+            context_text = "\n---\n".join(
+                self._retrieve_chunks(record["chunks"], question)
+            )
+        else:
+            context_text = document_text
+
         try:
             answer = await self.kernel.invoke(
                 self.qa_function,
-                KernelArguments(document=document_text, question=question)
+                KernelArguments(document=context_text, question=question)
             )
-            return str(answer)
+            answer_text = str(answer)
+            self.response_cache.put("documentQA", qa_key, answer_text)
+            return answer_text
         except Exception as e:
             return f"回答問題時出錯: {str(e)}"
     
-    def _extract_document_name(self, message: str) -> Optional[str]:
+    def _retrieve_chunks(self, chunks: List[str], question: str,
+                         top_k: int = _QA_TOP_K) -> List[str]:
+        """
+        按與問題的詞元重疊度挑出最相關的塊
+
+        Args:
+            chunks: 文檔分塊列表
+            question: 用戶問題
+            top_k: 返回的塊數
+
+        Returns:
+            按原文順序排列的最相關塊
+        """
+        if len(chunks) <= top_k:
+            return chunks
+
+        terms = set(_TOKEN_RE.findall(question.lower()))
+        if not terms:
+            return chunks[:top_k]
+
+        scored = [
+            (len(terms & set(_TOKEN_RE.findall(chunk.lower()))), idx)
+            for idx, chunk in enumerate(chunks)
+        ]
+        top = heapq.nlargest(top_k, scored)
+        # 還原原文順序，維持塊之間的敘事連貫
+        return [chunks[idx] for _, idx in sorted(top, key=lambda pair: pair[1])]
+
+    def _extract_document_name(self, message: str,
+                               message_lower: Optional[str] = None) -> Optional[str]:
         """
         從訊息中提取文檔名稱
         
         Args:
             message: 用戶訊息
+            message_lower: 已轉小寫的訊息（調用方已算過時傳入免重算）
             
         Returns:
             提取的文檔名稱，如果找不到則返回 None
         """
-        # 遍歷所有已載入的文檔名稱
-        for doc_name in self.documents.keys():
-            if doc_name.lower() in message.lower():
+        # 只把訊息轉小寫一次，再和載入時就算好的小寫名稱比對
+        if message_lower is None:
+            message_lower = message.lower()
+        for doc_name, record in self.documents.items():
+            if record["lower_name"] in message_lower:
                 return doc_name
         return None
     
@@ -295,9 +552,9 @@ class DocumentAgent(Agent):
         if not self.documents:
             return "沒有已載入的文檔。"
         
-        result = "已載入的文檔:\n"
-        for idx, (name, content) in enumerate(self.documents.items(), 1):
-            size = len(content)
-            result += f"{idx}. {name} ({size} 字符)\n"
-        
-        return result
\ No newline at end of file
+        parts = ["已載入的文檔:\n"]
+        for idx, (name, record) in enumerate(self.documents.items(), 1):
+            size = len(record["text"])
+            parts.append(f"{idx}. {name} ({size} 字符)\n")
+
+        return "".join(parts)
\ No newline at end of file
@@ -1,8 +1,18 @@
 #search_agent.py
 import os
+import time
 import asyncio
-import requests
+import hashlib
+import aiohttp
 import json
+
+# orjson 為 C 實現的 JSON 解析器；未安裝時退回標準庫，
+# 統一經 _loads_bytes 解析原始回應字節（省去二次 UTF-8 解碼）
+try:
+    import orjson
+    _loads_bytes = orjson.loads
+except ImportError:
+    _loads_bytes = json.loads
 from typing import Dict, List, Any, Optional
 
 from semantic_kernel.functions import KernelArguments
@@ -12,6 +22,8 @@ from semantic_kernel.prompt_template.input_variable import InputVariable
 from semantic_kernel.connectors.ai.open_ai import AzureChatPromptExecutionSettings
 
 from .base_agent import Agent
+from utils.persistent_cache import PersistentCache
+from utils.response_cache import ResponseCache
 
 class SearchAgent(Agent):
     """處理網絡搜索的代理"""
@@ -25,7 +37,17 @@ class SearchAgent(Agent):
         """
         super().__init__(name, skills=["網絡搜索", "實時信息", "信息檢索"])
         self.search_function = None
+        self.extract_query_function = None
         self.bing_api_key = os.getenv("BING_SEARCH_API_KEY", "")
+        self._http: Optional[aiohttp.ClientSession] = None  # 共享連接池，惰性創建
+
+        # 持久化回應緩存：相同查詢在 TTL 內直接返回先前回答，
+        # 免去 Bing 與 LLM 兩輪網絡往返；搜索講求時效，過期即失效
+        self.response_ttl = int(os.getenv("SEARCH_CACHE_TTL", str(24 * 3600)))
+        self.persistent_cache = PersistentCache(
+            os.path.join("cache", "search_responses.json"),
+            max_items=int(os.getenv("SEARCH_CACHE_SIZE", "256")),
+        )
     
     def setup_kernel(self, kernel: Kernel):
         """
@@ -81,21 +103,7 @@ class SearchAgent(Agent):
             prompt_template_config=search_config,
         )
 
-    async def preprocess_search_query(self, message: str) -> str:
-        """
-        預處理搜索查詢，從增強的消息中提取核心搜索內容
-        
-        Args:
-            message: 可能包含歷史記錄的增強消息
-            
-        Returns:
-            優化後的搜索查詢
-        """
-        # 如果消息簡短，直接使用
-        if len(message) < 100 and "[對話歷史]" not in message and "[新問題]" not in message:
-            return message
-            
-        # 配置提取查詢的提示模板
+        # 查詢提取功能：一次性註冊，免去每次預處理重編譯模板
         extract_query_prompt = """
         你是一個智能搜索助手。請分析以下對話歷史和新問題，然後提取出最適合用於網絡搜索的簡潔查詢。
         
@@ -105,7 +113,6 @@ class SearchAgent(Agent):
         請僅返回一個簡短的搜索查詢（不超過10個詞），無需其他解釋。這個查詢應該捕捉用戶真正想要搜索的核心內容。
         """
         
-        # 創建臨時函數來提取搜索查詢
         extract_config = PromptTemplateConfig(
             template=extract_query_prompt,
             template_format="semantic-kernel",
@@ -119,17 +126,30 @@ class SearchAgent(Agent):
             )
         )
         
-        # 添加提取函數到 Kernel
-        extract_function = self.kernel.add_function(
+        self.extract_query_function = self.kernel.add_function(
             function_name="extractSearchQuery",
             plugin_name="searchPlugin",
             prompt_template_config=extract_config,
         )
+
+    async def preprocess_search_query(self, message: str) -> str:
+        """
+        預處理搜索查詢，從增強的消息中提取核心搜索內容
         
+        Args:
+            message: 可能包含歷史記錄的增強消息
+            
+        Returns:
+            優化後的搜索查詢
+        """
+        # 如果消息簡短，直接使用
+        if len(message) < 100 and "[對話歷史]" not in message and "[新問題]" not in message:
+            return message
+            
         # 執行查詢提取
         try:
             optimized_query = await self.kernel.invoke(
-                extract_function,
+                self.extract_query_function,
                 KernelArguments(message=message)
             )
             
@@ -170,12 +190,30 @@ class SearchAgent(Agent):
         if not self.bing_api_key:
             return "搜索功能未配置。請設置 BING_SEARCH_API_KEY 環境變數。"
         
+        # TTL 內的相同問題直接取持久化緩存
+        cache_key = hashlib.blake2b(
+            ResponseCache.normalize(message).encode("utf-8"), digest_size=16
+        ).hexdigest()
+        cached = self.persistent_cache.get("searchResponse", cache_key)
+        if cached is not None and time.time() - cached[0] < self.response_ttl:
+            return cached[1]
+
         try:
-            # 預處理搜索查詢
-            optimized_query = await self.preprocess_search_query(message)
-            
-            # 執行搜索
-            search_results = await self.bing_search(optimized_query)
+            # 併發執行查詢優化與以原始訊息為查詢的投機搜索：
+            # 優化結果與原文相同（短訊息的常見情況）時直接沿用投機
+            # 結果，兩輪串行網絡往返縮成一輪
+            preprocess_task = asyncio.create_task(
+                self.preprocess_search_query(message)
+            )
+            raw_search_task = asyncio.create_task(self.bing_search(message))
+
+            optimized_query = await preprocess_task
+            if optimized_query.strip() == message.strip():
+                search_results = await raw_search_task
+            else:
+                # 優化後查詢不同，投機搜索作廢，改用優化查詢重搜
+                raw_search_task.cancel()
+                search_results = await self.bing_search(optimized_query)
             
             # 記錄搜索信息
             print(f"原始消息: {message[:100]}...")
@@ -192,7 +230,11 @@ class SearchAgent(Agent):
                 )
             )
             
-            return str(response)
+            response_text = str(response)
+            self.persistent_cache.put(
+                "searchResponse", cache_key, [time.time(), response_text]
+            )
+            return response_text
         except Exception as e:
             import traceback
             print(f"搜索處理錯誤: {str(e)}")
@@ -211,20 +253,27 @@ class SearchAgent(Agent):
             格式化的搜索結果
         """
         try:
+            # 惰性創建共享的 aiohttp 會話：keep-alive 連接重用省去
+            # 每次搜索的 TCP+TLS 握手，且不阻塞事件循環
+            if self._http is None or self._http.closed:
+                self._http = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(limit=10, ttl_dns_cache=300),
+                    timeout=aiohttp.ClientTimeout(total=10),
+                )
+
             search_url = "https://api.bing.microsoft.com/v7.0/search"
             headers = {"Ocp-Apim-Subscription-Key": self.bing_api_key}
             params = {
                 "q": query,
                 "count": count,
                 "responseFilter": "Webpages",
-                "textDecorations": True,
+                "textDecorations": "true",
                 "textFormat": "HTML"
             }
             
-            response = requests.get(search_url, headers=headers, params=params, timeout=10)
-            response.raise_for_status()
-            
-            search_results = response.json()
+            async with self._http.get(search_url, headers=headers, params=params) as response:
+                response.raise_for_status()
+                search_results = _loads_bytes(await response.read())
             
             # 檢查是否有搜索結果
             if "webPages" not in search_results:
@@ -232,32 +281,29 @@ class SearchAgent(Agent):
             
             web_pages = search_results["webPages"]["value"]
             
-            # 格式化搜索結果
-            formatted_results = ""
+            # 格式化搜索結果（列表收集一次join，避免逐次拼接複製）
+            parts = []
             for i, page in enumerate(web_pages, 1):
                 name = page.get("name", "無標題")
                 url = page.get("url", "無URL")
                 snippet = page.get("snippet", "無摘要")
                 
-                formatted_results += f"{i}. {name}\n"
-                formatted_results += f"   URL: {url}\n"
-                formatted_results += f"   {snippet}\n\n"
+                parts.append(f"{i}. {name}\n   URL: {url}\n   {snippet}\n\n")
             
-            return formatted_results
+            return "".join(parts)
         
-        except requests.exceptions.RequestException as e:
-            if isinstance(e, requests.exceptions.ConnectionError):
-                return "網絡連接錯誤。請檢查您的網絡連接。"
-            elif isinstance(e, requests.exceptions.Timeout):
-                return "搜索請求超時。請稍後再試。"
-            elif isinstance(e, requests.exceptions.HTTPError):
-                if e.response.status_code == 401:
-                    return "API密鑰無效或未授權。"
-                elif e.response.status_code == 403:
-                    return "API密鑰權限不足。"
-                elif e.response.status_code == 429:
-                    return "超出API使用限制。請稍後再試。"
-                else:
-                    return f"HTTP錯誤: {e.response.status_code}"
+        except asyncio.TimeoutError:
+            return "搜索請求超時。請稍後再試。"
+        except aiohttp.ClientResponseError as e:
+            if e.status == 401:
+                return "API密鑰無效或未授權。"
+            elif e.status == 403:
+                return "API密鑰權限不足。"
+            elif e.status == 429:
+                return "超出API使用限制。請稍後再試。"
             else:
-                return f"搜索請求錯誤: {str(e)}"
\ No newline at end of file
+                return f"HTTP錯誤: {e.status}"
+        except aiohttp.ClientConnectionError:
+            return "網絡連接錯誤。請檢查您的網絡連接。"
+        except aiohttp.ClientError as e:
+            return f"搜索請求錯誤: {str(e)}"
@@ -1,11 +1,22 @@
 import os
 import asyncio
+import threading
+import queue
+import functools
+
+# uvloop 以 C 實現事件循環，降低每次 await 的調度開銷；
+# 未安裝（如 Windows 環境）時沿用默認循環
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
 import streamlit as st
 import tempfile
 import io
 import base64
 import requests
-from PIL import Image
 from dotenv import load_dotenv
 
 from system import MultiAgentSystem
@@ -49,10 +60,53 @@ footer {
 </style>
 """, unsafe_allow_html=True)
 
+# 常駐後台事件循環：asyncio.run 每次調用都新建並銷毀事件循環，
+# 連帶丟棄 aiohttp 連接池、DNS 緩存與各代理的運行時狀態；
+# 改為跨重跑共享的單一後台線程循環（cache_resource 保證只建一次）
+@st.cache_resource
+def _get_background_loop():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+def run_async(coro):
+    """在常駐後台事件循環上執行協程並等待結果"""
+    return asyncio.run_coroutine_threadsafe(coro, _get_background_loop()).result()
+
+def run_async_gen(agen):
+    """把後台事件循環上的異步生成器橋接為同步生成器"""
+    chunk_queue = queue.Queue()
+    sentinel = object()
+
+    async def _pump():
+        try:
+            async for chunk in agen:
+                chunk_queue.put(chunk)
+        finally:
+            chunk_queue.put(sentinel)
+
+    future = asyncio.run_coroutine_threadsafe(_pump(), _get_background_loop())
+    while True:
+        item = chunk_queue.get()
+        if item is sentinel:
+            break
+        yield item
+    future.result()  # 傳播泵協程中的異常
+
 # 初始化會話狀態
 if 'multi_agent_system' not in st.session_state:
     st.session_state.multi_agent_system = MultiAgentSystem()
-    asyncio.run(st.session_state.multi_agent_system.setup())
+    # 後台預熱：設置直接提交到後台事件循環，不阻塞首屏渲染；
+    # 處理第一條消息前再確認完成
+    st.session_state.setup_future = asyncio.run_coroutine_threadsafe(
+        st.session_state.multi_agent_system.setup(), _get_background_loop()
+    )
+
+def ensure_setup_done():
+    """等待後台設置完成（通常在用戶輸入第一條消息前早已結束）"""
+    future = st.session_state.pop('setup_future', None)
+    if future is not None:
+        future.result()
 
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
@@ -60,13 +114,15 @@ if 'chat_history' not in st.session_state:
 if 'uploaded_files' not in st.session_state:
     st.session_state.uploaded_files = []
 
-# 檢查網絡連接
+# 檢查網絡連接（每個會話只實際探測一次，結果緩存於 session_state）
 def is_connected():
-    try:
-        requests.get("https://www.bing.com", timeout=4)
-        return True
-    except requests.exceptions.RequestException:
-        return False
+    if 'is_connected' not in st.session_state:
+        try:
+            requests.get("https://www.bing.com", timeout=4)
+            st.session_state.is_connected = True
+        except requests.exceptions.RequestException:
+            st.session_state.is_connected = False
+    return st.session_state.is_connected
 
 # 處理圖像
 class ImageProcessor:
@@ -74,28 +130,49 @@ class ImageProcessor:
     
     @staticmethod
     def process_image(file_path):
-        """处理图像文件并返回base64编码"""
+        """处理图像文件并返回base64编码（按路徑+修改時間+大小緩存）"""
+        # Streamlit 每次重跑都會重新調用；同一文件的解碼、縮放與
+        # base64 編碼只需做一次，文件變動時鍵自然失效
+        try:
+            stat = os.stat(file_path)
+            return ImageProcessor._process_image_cached(
+                file_path, stat.st_mtime, stat.st_size
+            )
+        except OSError as e:
+            st.error(f"Error processing image: {str(e)}")
+            return None
+
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def _process_image_cached(file_path, mtime, size):
+        from PIL import Image  # 按需導入，未上傳圖片的會話不付導入成本
+
         try:
             with Image.open(file_path) as img:
                 # 调整大小以优化显示
                 max_width = 800
-                if img.width > max_width:
+                needs_resize = img.width > max_width
+                if needs_resize:
                     ratio = max_width / img.width
                     new_height = int(img.height * ratio)
                     img = img.resize((max_width, new_height), Image.LANCZOS)
                 
-                # 转换为bytes
-                img_byte_arr = io.BytesIO()
                 img_format = os.path.splitext(file_path)[1].upper().replace('.', '')
+                mime_type = "image/jpeg" if img_format in ['JPG', 'JPEG'] else "image/png"
                 
-                if img_format.upper() in ['JPG', 'JPEG']:
-                    img.save(img_byte_arr, format='JPEG')
-                    mime_type = "image/jpeg"
+                if not needs_resize and img_format in ['JPG', 'JPEG', 'PNG']:
+                    # 未縮放的 PNG/JPEG 直接取原始字節，跳過整輪重新編碼
+                    with open(file_path, 'rb') as f:
+                        img_byte_arr = f.read()
                 else:
-                    img.save(img_byte_arr, format='PNG')
-                    mime_type = "image/png"
-                
-                img_byte_arr = img_byte_arr.getvalue()
+                    # 转换为bytes
+                    buf = io.BytesIO()
+                    if mime_type == "image/jpeg":
+                        img.save(buf, format='JPEG')
+                    else:
+                        # 低壓縮等級換取編碼速度，縮圖僅供聊天內顯示
+                        img.save(buf, format='PNG', optimize=False, compress_level=1)
+                    img_byte_arr = buf.getvalue()
                 
                 # 转换为base64用于显示
                 encoded = base64.b64encode(img_byte_arr).decode('utf-8')
@@ -111,31 +188,44 @@ with st.sidebar:
     
     # 上傳文件
     with st.sidebar.expander("Upload Documents", expanded=True):
-        uploaded_file = st.file_uploader(
-            "Choose a file", 
+        uploaded_files_sel = st.file_uploader(
+            "Choose files", 
             type=["txt", "pdf", "docx", "csv", "py", "ipynb"], 
-            key="sidebar_uploader"
+            key="sidebar_uploader",
+            accept_multiple_files=True
         )
-        doc_name = st.text_input("Document name (optional)")
+        doc_name = st.text_input("Document name (optional, 僅單檔適用)")
         # 在 app.py 中，確保文檔上傳後正確通知系統
-        if uploaded_file is not None and st.button("Upload"):
+        if uploaded_files_sel and st.button("Upload"):
             # 保存臨時文件
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded_file.name.split('.')[-1]}") as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                tmp_path = tmp_file.name
+            tmp_paths = []
+            names = []
+            for uf in uploaded_files_sel:
+                with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uf.name.split('.')[-1]}") as tmp_file:
+                    tmp_file.write(uf.getvalue())
+                    tmp_paths.append(tmp_file.name)
+                if len(uploaded_files_sel) == 1 and doc_name:
+                    names.append(doc_name)
+                else:
+                    names.append(uf.name)
             
-            # 上傳文件到系統並顯示結果
-            result = st.session_state.multi_agent_system.upload_document(tmp_path, doc_name or uploaded_file.name)
-            st.sidebar.success(result)
+            # 批次上傳：文本提取在進程池併發執行
+            ensure_setup_done()
+            results = run_async(
+                st.session_state.multi_agent_system.upload_documents(tmp_paths, names)
+            )
+            for result in results:
+                st.sidebar.success(result)
             
             # 確保將文檔信息添加到聊天上下文 (這裡是關鍵部分)
-            doc_content = st.session_state.multi_agent_system.document_agent.get_document_content(doc_name or uploaded_file.name)
-            if doc_content:
-                # 將文檔內容添加到系統記憶中
-                st.session_state.multi_agent_system.memory_manager.add_memory(
-                    f"文檔 '{doc_name or uploaded_file.name}' 已上傳，內容如下：\n{doc_content[:500]}...(內容已截斷)",
-                    "system"
-                )
+            for name in names:
+                doc_content = st.session_state.multi_agent_system.document_agent.get_document_content(name)
+                if doc_content:
+                    # 將文檔內容添加到系統記憶中
+                    st.session_state.multi_agent_system.memory_manager.add_memory(
+                        f"文檔 '{name}' 已上傳，內容如下：\n{doc_content[:500]}...(內容已截斷)",
+                        "system"
+                    )
     
     
     
@@ -193,16 +283,24 @@ if user_input:
     st.session_state.chat_history.append({"role": "user", "content": user_input})
     
     # 處理響應
+    ensure_setup_done()
     with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            # 使用多智能體系統處理消息，並包含歷史
-            response = asyncio.run(st.session_state.multi_agent_system.process_message(user_input, include_history=True))
-            # 顯示響應
-            st.markdown(response)
+        # 使用多智能體系統流式處理消息：回應邊生成邊渲染，
+        # 感知延遲縮短為首個片段到達的時間
+        response = st.write_stream(run_async_gen(
+            st.session_state.multi_agent_system.process_message_streaming(
+                user_input, include_history=True
+            )
+        ))
     
     # 添加響應到歷史記錄
     st.session_state.chat_history.append({"role": "assistant", "content": response})
     
+    # 限制 UI 歷史長度：每次重跑都會整段重新渲染 markdown，
+    # 封頂後渲染成本與會話時長解耦
+    if len(st.session_state.chat_history) > 50:
+        del st.session_state.chat_history[:10]
+    
     # 重新加載頁面以清除輸入框並刷新UI
     st.rerun()
 
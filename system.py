@@ -1,11 +1,18 @@
 # system.py
 import os
+import re
+import random
 import asyncio
+import logging
+from collections import deque
 from typing import Dict, List, Any, Optional
 from dotenv import load_dotenv
 import time
 
 from semantic_kernel import Kernel
+from semantic_kernel.exceptions import ServiceResponseException
+import httpx
+from openai import AsyncAzureOpenAI, RateLimitError
 from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
 
 from agents.base_agent import Agent
@@ -14,15 +21,64 @@ from agents.conversation_agent import ConversationAgent
 from agents.document_agent import DocumentAgent
 from agents.code_agent import CodeAgent
 from agents.search_agent import SearchAgent
+from utils.document_processor import DocumentProcessor
 from utils.memory_manager import MemoryManager
+from utils.response_cache import ResponseCache
+
+# 模組級日誌器：debug 級別關閉時惰性格式化不構建字符串
+logger = logging.getLogger(__name__)
+
+# .env 只載入一次：重複構造 MultiAgentSystem（測試、批次）不重讀文件
+_ENV_LOADED = False
+
+
+def _ensure_env():
+    """確保環境變數已載入（模組級單例）"""
+    global _ENV_LOADED
+    if not _ENV_LOADED:
+        load_dotenv()
+        _ENV_LOADED = True
+
+
+# Azure 配置在首次訪問時讀取並緩存
+_AZURE_CONFIG: Optional[Dict[str, str]] = None
+
+
+def _azure_config() -> Dict[str, str]:
+    """
+    取 Azure OpenAI 配置（首次調用讀取環境變數並緩存）
+
+    Returns:
+        配置字典：api_key、endpoint、deployment_name、api_version
+    """
+    global _AZURE_CONFIG
+    if _AZURE_CONFIG is None:
+        _ensure_env()
+        _AZURE_CONFIG = {
+            "api_key": os.getenv("AZURE_OPENAI_API_KEY"),
+            "endpoint": os.getenv("AZURE_OPENAI_ENDPOINT"),
+            "deployment_name": os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"),
+            # 默認取支持結構化輸出（json_schema）的 GA 版本；
+            # 部署較舊時可用 AZURE_OPENAI_API_VERSION 覆蓋
+            "api_version": os.getenv("AZURE_OPENAI_API_VERSION", "2024-10-21"),
+        }
+    return _AZURE_CONFIG
+
+
+# 文檔相關訊息的本地預過濾關鍵詞：命中即可免去 LLM 判斷
+_DOC_KEYWORD_RE = re.compile(
+    r"文檔|文件|檔案|上傳|摘要|總結|裡面|內容|pdf|summary|document|file|uploaded",
+    re.IGNORECASE,
+)
+
 
 class MultiAgentSystem:
     """多智能體系統主類"""
     
     def __init__(self):
         """初始化多智能體系統"""
-        # 載入環境變數
-        load_dotenv()
+        # 載入環境變數（模組級單例，只讀一次 .env）
+        _ensure_env()
         
         # 檢查必要的環境變數
         required_vars = [
@@ -47,34 +103,79 @@ class MultiAgentSystem:
         self.code_agent = CodeAgent()
         self.search_agent = SearchAgent()
         
-        # 記錄系統是否已設置
+        # 記錄系統是否已設置（鎖防止併發調用重複設置）
         self.is_setup = False
+        self._setup_lock = asyncio.Lock()
         # 系統記憶
         self.conversation_history = []
         # 使用記憶管理器
         self.memory_manager = MemoryManager(max_items=100)
         self.recent_document_context = None
+        # 文檔相關性判斷的結果緩存
+        self.response_cache = ResponseCache(max_items=128)
+        # 最近歷史文本的髒位緩存：(記憶版本號, 格式化文本)
+        self._history_cache = (None, "")
+        # LLM 調用速率限制：滑動窗口記錄最近一分鐘的調用時刻，
+        # 貼著 Azure 部署的 RPM 上限走而不是撞上 429 後整輪作廢
+        self._llm_rate_limit = int(os.getenv("AZURE_TPM_RPM", "60"))
+        self._llm_call_times = deque()
+        # 進行中 LLM 請求的單飛表：相同輸入的併發調用共享同一個 Future
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # 代理集合固定不變，視圖字典建一次；狀態視圖按訊息數緩存，
+        # 輪詢面板反覆讀取時不必每次重建
+        self._agents_dict = {
+            "coordinator": self.coordinator,
+            "conversation": self.conversation_agent,
+            "document": self.document_agent,
+            "code": self.code_agent,
+            "search": self.search_agent,
+        }
+        self._status_cache = (None, None)
     
     async def setup(self):
         """設置系統 - 添加 AI 服務並配置代理"""
         if self.is_setup:
             return
         
-        # 設置 Azure OpenAI 服務
-        api_key = os.getenv("AZURE_OPENAI_API_KEY")
-        endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
-        deployment_name = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT_NAME")
-        api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2023-05-15")
+        async with self._setup_lock:
+            if self.is_setup:  # 等鎖期間可能已被其他調用者設置完成
+                return
+            await self._setup_locked()
+
+    async def _setup_locked(self):
+        """實際的設置流程（調用方需持有 _setup_lock）"""
+        # 設置 Azure OpenAI 服務（配置取自模組級緩存）
+        config = _azure_config()
+        api_key = config["api_key"]
+        endpoint = config["endpoint"]
+        deployment_name = config["deployment_name"]
+        api_version = config["api_version"]
         
         try:
+            # 共享的 HTTP 連接池：所有代理的 LLM 調用復用同一組 keep-alive
+            # 連接，併發時不必每次重新進行 TCP/TLS 握手
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=64,
+                    max_keepalive_connections=32,
+                    keepalive_expiry=300,  # 連接保活 5 分鐘，跨輪次重用
+                ),
+                timeout=httpx.Timeout(60.0),
+            )
+            self._http_client = http_client
+            async_client = AsyncAzureOpenAI(
+                api_key=api_key,
+                azure_endpoint=endpoint,
+                api_version=api_version,
+                http_client=http_client,
+            )
+
             # 添加Azure OpenAI Chat Completion服務
             self.kernel.add_service(
                 AzureChatCompletion(
                     service_id="default",
                     deployment_name=deployment_name,
-                    endpoint=endpoint,
-                    api_key=api_key,
-                    api_version=api_version
+                    async_client=async_client,
                 )
             )
             
@@ -84,24 +185,58 @@ class MultiAgentSystem:
                 # 將在未來版本添加 Bing 搜索服務
                 pass
             
-            # 設置各代理的 Kernel
-            self.coordinator.setup_kernel(self.kernel)
-            self.conversation_agent.setup_kernel(self.kernel)
-            self.document_agent.setup_kernel(self.kernel)
-            self.code_agent.setup_kernel(self.kernel)
-            self.search_agent.setup_kernel(self.kernel)
+            # 設置各代理的 Kernel：各自註冊獨立的插件，互不依賴，
+            # 放到線程池併發執行，冷啟動耗時取最慢者而非總和
+            agents = (
+                self.coordinator,
+                self.conversation_agent,
+                self.document_agent,
+                self.code_agent,
+                self.search_agent,
+            )
+            await asyncio.gather(
+                *(asyncio.to_thread(agent.setup_kernel, self.kernel)
+                  for agent in agents)
+            )
             
+            # 路由決策是每回合必經的 LLM 調用，注入限流/重試包裝，
+            # 讓它與文檔相關性判斷共用同一套 429 退避邏輯
+            self.coordinator.llm_invoker = self._invoke_llm
+
             # 向協調器註冊所有代理
             self.coordinator.register_agent("conversation_agent", self.conversation_agent)
             self.coordinator.register_agent("document_agent", self.document_agent)
             self.coordinator.register_agent("code_agent", self.code_agent)
             self.coordinator.register_agent("search_agent", self.search_agent)
+
+            # 提前編譯文檔相關性判斷的提示模板，首條文檔消息不再
+            # 付模板解析與註冊成本
+            self._register_doc_relevance_function()
+
+            # 預熱 HTTPS 連接：向端點發一個輕量請求，提前完成
+            # TCP+TLS 握手，第一條真實消息不再付連接建立延遲
+            asyncio.create_task(self._warm_connection(endpoint))
             
             # 設置完成
             self.is_setup = True
             
         except Exception as e:
             raise Exception(f"設置多智能體系統時出錯: {str(e)}")
+
+    async def _warm_connection(self, endpoint: str):
+        """
+        預熱到 Azure 端點的 HTTPS 連接
+
+        任何回應（包括 401/404）都足以建立並保活連接；
+        預熱失敗無關緊要，真實調用會自行重新連接。
+
+        Args:
+            endpoint: Azure OpenAI 端點 URL
+        """
+        try:
+            await self._http_client.get(endpoint, timeout=5.0)
+        except Exception:
+            pass
         
     async def process_message(self, message: str, include_history: bool = True) -> str:
         """
@@ -120,6 +255,7 @@ class MultiAgentSystem:
         
         try:
             # 檢查消息是否涉及文檔
+            relevance_task = None
             doc_names = self.document_agent.get_document_names()
             if doc_names:
                 # 檢查是否需要包含文檔內容
@@ -129,71 +265,221 @@ class MultiAgentSystem:
                 # 1. 檢查是否有最近上傳的文檔上下文
                 if hasattr(self, 'recent_document_context') and self.recent_document_context:
                     # 如果最近 10 分鐘有上傳文檔，將其包含在下一條消息處理中
-                    time_diff = time.time() - self.recent_document_context["timestamp"]
-                    if time_diff < 600:  # 10分鐘內
+                    # （單調時鐘的預計算到期時刻，不受 NTP 校時影響）
+                    if time.monotonic() < self.recent_document_context["expires_at"]:
                         include_doc = True
                         doc_to_include = self.recent_document_context["name"]
                         # 使用後清除上下文，避免重複包含
                         self.recent_document_context = None
                 
-                # 2. 使用 AI 判斷消息是否與已有文檔相關
+                # 2. 判斷消息是否與已有文檔相關：先走零成本的本地
+                # 預過濾（點名文檔或含文檔關鍵詞即判相關）；未命中時
+                # 不再串行等待 LLM 判斷，而是讓它與協調器路由併發跑
                 if not include_doc:
-                    is_doc_related = await self._is_message_document_related(message, doc_names)
-                    if is_doc_related:
+                    mentioned = self.document_agent.find_mentioned_document(message)
+                    if (mentioned is not None
+                            or _DOC_KEYWORD_RE.search(message) is not None):
                         include_doc = True
-                        # 找出明確提到的文檔或最後上傳的文檔
-                        for doc_name in doc_names:
-                            if doc_name.lower() in message.lower():
-                                doc_to_include = doc_name
-                                break
-                        
-                        # 如果沒有明確提到文檔，使用最後一個
-                        if not doc_to_include:
-                            doc_to_include = doc_names[-1]
+                        doc_to_include = mentioned
+                    else:
+                        relevance_task = asyncio.create_task(
+                            self._is_message_document_related(message, doc_names)
+                        )
                 
                 # 如果需要包含文檔，準備增強消息
-                if include_doc and doc_to_include:
-                    doc_content = self.document_agent.get_document_content(doc_to_include)
-                    if doc_content:
-                        enhanced_message = f"[文檔: {doc_to_include}]\n{doc_content}\n\n[用戶問題]\n{message}"
-                        response = await self.document_agent.process_message(enhanced_message, "user")
-                        
-                        # 更新記憶
-                        self.memory_manager.add_memory(message, "user")
-                        self.memory_manager.add_memory(response, "assistant")
-                        
+                if include_doc:
+                    response = await self._process_with_document(
+                        message, doc_to_include, doc_names
+                    )
+                    if response is not None:
                         return response
             
             # 如果沒有包含文檔或沒有文檔，使用標準流程
             if include_history:
-                # 獲取最近的記憶並格式化
-                history_text = self.memory_manager.format_as_text(
-                    self.memory_manager.get_recent_memories(10)
-                )
+                # 獲取最近的記憶並格式化（記憶未變動時重用緩存）
+                history_text = self._recent_history_text()
                 enhanced_message = f"[對話歷史]\n{history_text}\n\n[新問題]\n{message}"
             else:
                 enhanced_message = message
             
-            # 通過協調器處理消息
-            response = await self.coordinator.process_message(enhanced_message, "user")
+            # 通過協調器處理消息；未決的相關性判斷與路由同時在跑，
+            # 總延遲取兩者較慢者而非相加
+            coordinator_task = asyncio.create_task(
+                self.coordinator.process_message(enhanced_message, "user")
+            )
+            
+            if relevance_task is not None and await relevance_task:
+                # 判定與文檔相關：棄用路由結果，改走文檔路徑
+                coordinator_task.cancel()
+                response = await self._process_with_document(message, None, doc_names)
+                if response is not None:
+                    return response
+                # 文檔內容取不到時退回協調器（路由已被取消，重新派發）
+                coordinator_task = asyncio.create_task(
+                    self.coordinator.process_message(enhanced_message, "user")
+                )
+            
+            response = await coordinator_task
             
-            # 更新記憶
-            self.memory_manager.add_memory(message, "user")
-            self.memory_manager.add_memory(response, "assistant")
+            # 更新記憶（單次批量寫入）
+            self.memory_manager.add_memories([(message, "user"), (response, "assistant")])
             
             return response
         except Exception as e:
             return f"處理您的請求時出錯: {str(e)}"
     
-    async def _is_message_document_related(self, message: str, doc_names: List[str]) -> bool:
-        """使用 AI 判斷消息是否與文檔相關"""
-        # 註冊判斷函數（如果尚未註冊）
-        if not hasattr(self, "doc_relevance_function"):
-            from semantic_kernel.prompt_template import PromptTemplateConfig
-            from semantic_kernel.prompt_template.input_variable import InputVariable
-            from semantic_kernel.connectors.ai.open_ai import AzureChatPromptExecutionSettings
-            
-            prompt = """
+    async def _process_with_document(self, message: str,
+                                     doc_to_include: Optional[str],
+                                     doc_names: List[str]) -> Optional[str]:
+        """
+        以文檔內容增強消息並交給文檔代理處理
+
+        Args:
+            message: 用戶消息
+            doc_to_include: 指定的文檔名稱，為 None 時自動挑選
+            doc_names: 目前已載入的文檔名稱列表
+
+        Returns:
+            文檔代理的回應；取不到文檔內容時為 None
+        """
+        if not doc_to_include:
+            # 找出明確提到的文檔（單趟正則掃描）或最後上傳的文檔
+            doc_to_include = (
+                self.document_agent.find_mentioned_document(message)
+                or doc_names[-1]
+            )
+        
+        # 只附上與問題相關的內容窗口：每回合的提示 token 從 O(全文)
+        # 降到 O(top_k × 塊長)，長文檔不再整篇重複計費
+        doc_content = self.document_agent.get_relevant_chunks(doc_to_include, message)
+        if not doc_content:
+            return None
+
+        enhanced_message = f"[文檔: {doc_to_include}]\n{doc_content}\n\n[用戶問題]\n{message}"
+        response = await self.document_agent.process_message(enhanced_message, "user")
+        
+        # 更新記憶（單次批量寫入）
+        self.memory_manager.add_memories([(message, "user"), (response, "assistant")])
+        
+        return response
+    
+    async def process_message_streaming(self, message: str, include_history: bool = True):
+        """
+        流式處理用戶消息，逐塊產出回應
+
+        無已載入文檔時交給協調器的流式入口：純對話消息透傳對話
+        代理的流式輸出，感知延遲降為首 token 延遲，其餘路由整段
+        產出一次；有文檔時沿用標準路徑（文檔相關性判斷等邏輯）。
+
+        Args:
+            message: 用戶消息內容
+            include_history: 是否包含對話歷史
+
+        Yields:
+            回應片段
+        """
+        # 確保系統已設置
+        if not self.is_setup:
+            await self.setup()
+
+        try:
+            if self.document_agent.get_document_names():
+                yield await self.process_message(message, include_history)
+                return
+
+            if include_history:
+                history_text = self._recent_history_text()
+                enhanced_message = f"[對話歷史]\n{history_text}\n\n[新問題]\n{message}"
+            else:
+                enhanced_message = message
+
+            parts = []
+            async for chunk in self.coordinator.process_message_stream(
+                enhanced_message, "user"
+            ):
+                parts.append(chunk)
+                yield chunk
+
+            # 更新記憶（單次批量寫入）
+            self.memory_manager.add_memories(
+                [(message, "user"), ("".join(parts), "assistant")]
+            )
+        except Exception as e:
+            yield f"處理您的請求時出錯: {str(e)}"
+
+    def _recent_history_text(self) -> str:
+        """
+        取最近記憶的格式化文本
+
+        以記憶版本號做髒位：兩次消息之間記憶未變動時直接重用
+        上次的格式化結果。
+
+        Returns:
+            格式化的最近對話歷史
+        """
+        version = self.memory_manager.version
+        if self._history_cache[0] != version:
+            self._history_cache = (
+                version,
+                self.memory_manager.format_as_text(
+                    self.memory_manager.get_recent_memories(10)
+                ),
+            )
+        return self._history_cache[1]
+
+    async def _acquire_llm_slot(self):
+        """等待到速率窗口內有空位（最近一分鐘調用數低於上限）"""
+        while True:
+            now = time.monotonic()
+            while self._llm_call_times and now - self._llm_call_times[0] >= 60.0:
+                self._llm_call_times.popleft()
+            if len(self._llm_call_times) < self._llm_rate_limit:
+                self._llm_call_times.append(now)
+                return
+            # 睡到最舊的一次調用滑出窗口再重新檢查
+            await asyncio.sleep(60.0 - (now - self._llm_call_times[0]))
+
+    async def _invoke_llm(self, function, arguments):
+        """
+        受速率限制與重試保護的 kernel.invoke
+
+        撞上 429 時以帶抖動的指數退避重試，而不是把錯誤字符串
+        直接回給用戶、浪費整個回合。
+
+        Args:
+            function: 要調用的 kernel 函數
+            arguments: KernelArguments
+
+        Returns:
+            kernel.invoke 的結果
+        """
+        for attempt in range(5):
+            await self._acquire_llm_slot()
+            try:
+                return await self.kernel.invoke(function, arguments)
+            except (RateLimitError, ServiceResponseException) as e:
+                # semantic-kernel 會把 openai 的異常（含 429）包成
+                # ServiceResponseException 再拋出，從 __cause__ 辨認
+                # 內部的 RateLimitError；其他錯誤不屬限流，不重試
+                if isinstance(e, ServiceResponseException) and not isinstance(
+                    e.__cause__, RateLimitError
+                ):
+                    raise
+                if attempt == 4:
+                    raise
+                delay = min(2 ** attempt + random.random(), 30.0)
+                logger.warning("Azure 限流 (429)，%.1f 秒後重試", delay)
+                await asyncio.sleep(delay)
+
+    def _register_doc_relevance_function(self):
+        """註冊文檔相關性判斷函數（setup 時調用，首條消息不付編譯成本）"""
+        if hasattr(self, "doc_relevance_function"):
+            return
+        from semantic_kernel.prompt_template import PromptTemplateConfig
+        from semantic_kernel.prompt_template.input_variable import InputVariable
+        from semantic_kernel.connectors.ai.open_ai import AzureChatPromptExecutionSettings
+
+        prompt = """
             請判斷用戶的消息是否與文檔相關。用戶可能直接或間接地引用文檔，例如：
             1. 直接提及文檔（「請分析這個PDF」、「查看我上傳的文件」等）
             2. 間接引用（「文件裡說了什麼」、「裡面有什麼內容」等）
@@ -206,40 +492,75 @@ class MultiAgentSystem:
             
             請僅回答 "是" 或 "否"。
             """
-            
-            config = PromptTemplateConfig(
-                template=prompt,
-                name="isDocumentRelated",
-                template_format="semantic-kernel",
-                input_variables=[
-                    InputVariable(name="document_names", description="系統中的文檔名稱", is_required=True),
-                    InputVariable(name="message", description="用戶消息", is_required=True),
-                ],
-                execution_settings=AzureChatPromptExecutionSettings(
-                    service_id="default",
-                    max_tokens=100,
-                    temperature=0.0,  # 確定性輸出
-                )
-            )
-            
-            self.doc_relevance_function = self.kernel.add_function(
-                function_name="isDocumentRelated",
-                plugin_name="systemPlugin",
-                prompt_template_config=config,
+
+        config = PromptTemplateConfig(
+            template=prompt,
+            name="isDocumentRelated",
+            template_format="semantic-kernel",
+            input_variables=[
+                InputVariable(name="document_names", description="系統中的文檔名稱", is_required=True),
+                InputVariable(name="message", description="用戶消息", is_required=True),
+            ],
+            execution_settings=AzureChatPromptExecutionSettings(
+                service_id="default",
+                max_tokens=100,
+                temperature=0.0,  # 確定性輸出
             )
-        
-        # 調用 AI 判斷
-        from semantic_kernel.functions import KernelArguments
+        )
+
+        self.doc_relevance_function = self.kernel.add_function(
+            function_name="isDocumentRelated",
+            plugin_name="systemPlugin",
+            prompt_template_config=config,
+        )
+
+    async def _is_message_document_related(self, message: str, doc_names: List[str]) -> bool:
+        """使用 AI 判斷消息是否與文檔相關"""
+        # 正常情況下函數已在 setup 註冊；這裡的守衛只為直接調用兜底
+        self._register_doc_relevance_function()
+
+        # 相同訊息與文檔組合的判斷結果直接取緩存
         doc_names_str = ", ".join(doc_names)
-        result = await self.kernel.invoke(
+        cache_key = f"{ResponseCache.normalize(message)}|{doc_names_str}"
+        cached = self.response_cache.get("isDocRelated", cache_key)
+        if cached is not None:
+            return cached
+
+        # 單飛模式：相同輸入的併發調用掛在同一個進行中的 Future 上，
+        # 而不是各自打一次 Azure
+        inflight_key = f"isDocRelated|{cache_key}"
+        future = self._inflight.get(inflight_key)
+        if future is not None:
+            return await future
+
+        future = asyncio.ensure_future(
+            self._judge_document_related(message, doc_names_str, cache_key)
+        )
+        self._inflight[inflight_key] = future
+        try:
+            return await future
+        finally:
+            self._inflight.pop(inflight_key, None)
+
+    async def _judge_document_related(
+        self, message: str, doc_names_str: str, cache_key: str
+    ) -> bool:
+        """實際的文檔相關性 LLM 判斷（調用方負責緩存查找與單飛去重）"""
+        from semantic_kernel.functions import KernelArguments
+        result = await self._invoke_llm(
             self.doc_relevance_function,
             KernelArguments(document_names=doc_names_str, message=message)
         )
-        
-        result_str = str(result).strip().lower()
-        
-        is_related = "是" in result_str or "yes" in result_str
-        print(f"Document relevance for '{message[:50]}...': {result_str} -> {is_related}")
+
+        # 前綴判斷而非全串掃描：回應被要求只答「是/否」，開頭即是
+        # 結論，也避免「否則是這樣的」之類的誤判
+        result_str = str(result).strip()
+        is_related = (
+            result_str[:1] == "是" or result_str[:3].lower().startswith("yes")
+        )
+        logger.debug("Document relevance for %r: %s -> %s",
+                     message[:50], result_str, is_related)
+        self.response_cache.put("isDocRelated", cache_key, is_related)
         return is_related
 
     async def search(self, query: str) -> str:
@@ -258,18 +579,23 @@ class MultiAgentSystem:
         
         return await self.search_agent.process_message(query)
     
-    def upload_document(self, file_path: str, document_name: Optional[str] = None) -> str:
+    async def upload_document(self, file_path: str, document_name: Optional[str] = None) -> str:
         """
         上傳文檔到文檔代理
-        
+
+        同步的文件讀取與解析（PDF/docx）放到線程執行，多 MB 文件
+        上傳期間事件循環保持響應，其他併發請求不被卡住。
+
         Args:
             file_path: 文件路徑
             document_name: 文檔名稱 (可選)
-            
+
         Returns:
             上傳結果訊息
         """
-        result = self.document_agent.load_document(file_path, document_name)
+        result = await asyncio.to_thread(
+            self.document_agent.load_document, file_path, document_name
+        )
         
         # 如果上傳成功，記錄文檔上下文
         if "已成功加載" in result:
@@ -277,10 +603,10 @@ class MultiAgentSystem:
             doc_content = self.document_agent.get_document_content(actual_name)
             if doc_content:
                 # 更新最近的文檔上下文
+                # preview 欄位無消費者，不再保存；到期時刻用單調時鐘預計算
                 self.recent_document_context = {
                     "name": actual_name,
-                    "timestamp": time.time(),
-                    "preview": doc_content[:500] + "..." if len(doc_content) > 500 else doc_content
+                    "expires_at": time.monotonic() + 600,
                 }
                 
                 # 添加到系統記憶
@@ -288,9 +614,47 @@ class MultiAgentSystem:
                     f"文檔 '{actual_name}' 已上傳並添加到對話上下文。",
                     "system"
                 )
-        print(f"Document context set: {self.recent_document_context}") #debug
+        logger.debug("Document context set: %s", self.recent_document_context)
         return result
     
+    async def upload_documents(self, file_paths: List[str],
+                               document_names: Optional[List[Optional[str]]] = None) -> List[str]:
+        """
+        批次上傳多份文檔，文本提取按格式併發執行
+
+        提取交給 DocumentProcessor.extract_texts：CPU 密集格式走
+        進程池、輕量格式走線程池，主進程只負責註冊結果。
+
+        Args:
+            file_paths: 文件路徑列表
+            document_names: 對應的文檔名稱列表（可選）
+
+        Returns:
+            與輸入同順序的載入結果訊息列表
+        """
+        if document_names is None:
+            document_names = [None] * len(file_paths)
+
+        texts = await asyncio.to_thread(
+            DocumentProcessor().extract_texts, file_paths
+        )
+
+        results = []
+        for file_path, document_name, text in zip(file_paths, document_names, texts):
+            actual_name = document_name or os.path.basename(file_path)
+            results.append(self.document_agent.add_document(actual_name, text))
+
+            # 與單檔上傳一致的上下文與記憶簿記
+            self.recent_document_context = {
+                "name": actual_name,
+                "expires_at": time.monotonic() + 600,
+            }
+            self.memory_manager.add_memory(
+                f"文檔 '{actual_name}' 已上傳並添加到對話上下文。",
+                "system"
+            )
+        return results
+
     def get_document_names(self) -> List[str]:
         """
         獲取所有已加載文檔的名稱
@@ -307,31 +671,31 @@ class MultiAgentSystem:
         Returns:
             代理字典 {名稱: 代理實例}
         """
-        return {
-            "coordinator": self.coordinator,
-            "conversation": self.conversation_agent,
-            "document": self.document_agent,
-            "code": self.code_agent,
-            "search": self.search_agent
-        }
-    
+        return self._agents_dict
+
     def get_agent_status(self) -> Dict[str, Any]:
         """
         獲取所有代理的狀態
-        
+
+        名稱與技能不會變動，只有訊息數會變；以各代理的訊息數
+        元組做緩存鍵，數字沒變時直接返回上次構建的狀態字典。
+
         Returns:
             代理狀態字典
         """
-        agents = self.get_all_agents()
-        status = {}
-        
-        for name, agent in agents.items():
-            status[name] = {
+        counts = tuple(len(agent.messages) for agent in self._agents_dict.values())
+        if self._status_cache[0] == counts:
+            return self._status_cache[1]
+
+        status = {
+            name: {
                 "name": agent.name,
                 "skills": agent.skills,
-                "messages_count": len(agent.messages)
+                "messages_count": len(agent.messages),
             }
-        
+            for name, agent in self._agents_dict.items()
+        }
+        self._status_cache = (counts, status)
         return status
     
     def reset(self):
@@ -347,8 +711,7 @@ class MultiAgentSystem:
 
     def _format_conversation_history(self) -> str:
         """格式化對話歷史為文本"""
-        history_text = ""
-        for i, message in enumerate(self.conversation_history):
-            role = "用戶" if message["role"] == "user" else "助手"
-            history_text += f"{role}: {message['content']}\n"
-        return history_text
\ No newline at end of file
+        return "".join(
+            f"{'用戶' if message['role'] == 'user' else '助手'}: {message['content']}\n"
+            for message in self.conversation_history
+        )
\ No newline at end of file
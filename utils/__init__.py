@@ -1,2 +1,5 @@
 from .document_processor import DocumentProcessor
-from .code_executor import CodeExecutor
\ No newline at end of file
+from .code_executor import CodeExecutor
+from .response_cache import ResponseCache
+from .persistent_cache import PersistentCache
+from .inference_worker import InferenceWorker
\ No newline at end of file
@@ -1,137 +1,217 @@
 # code_executor.py
 import os
+import re
 import sys
+import asyncio
+import importlib
 import traceback
+import concurrent.futures
 from io import StringIO
-import pandas as pd
-from pathlib import Path
 from typing import Dict, List, Any, Optional, Tuple
 
+# resource 僅 POSIX 可用；無法設限時子進程仍隔離於主進程
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# 危險函數列表：合併為單一交替式正則，模組載入時編譯一次，
+# 安全檢查只掃描代碼一趟而非逐模式各掃一遍
+_DANGEROUS_FUNCTIONS = (
+    "eval(", "exec(",
+    "os.system(", "subprocess", "os.popen(",
+    "__import__", "importlib",
+    "open(", "read(", "write(",
+    "globals(", "locals("
+)
+_DANGEROUS_RE = re.compile("|".join(map(re.escape, _DANGEROUS_FUNCTIONS)))
+
+# 子進程資源上限：CPU 5 秒、虛擬記憶體 512MB
+_CHILD_CPU_SECONDS = 5
+_CHILD_MEMORY_BYTES = 512 * 1024 * 1024
+
+
+# 允許載入的模組：名稱到 importlib 模組路徑的映射，首次引用才真正導入
+_LAZY_MODULES = {
+    "os": "os",
+    "sys": "sys",
+    "pandas": "pandas",
+    "pd": "pandas",
+    "pathlib": "pathlib",
+    "datetime": "datetime",
+    "json": "json",
+    "re": "re",
+    "math": "math",
+    "random": "random",
+    "time": "time",
+    "collections": "collections",
+    "csv": "csv",
+    "io": "io",
+    "numpy": "numpy",
+    "matplotlib": "matplotlib",
+}
+
+# 允許的模組屬性：名稱到 (模組, 屬性) 的映射
+_LAZY_ATTRS = {
+    "Path": ("pathlib", "Path"),
+    "StringIO": ("io", "StringIO"),
+}
+
+
+class LazyGlobals(dict):
+    """惰性導入的執行環境：名稱首次被查找時才導入對應模組
+
+    numpy、matplotlib、pandas 等重量級模組不再於構造時全量導入，
+    沒用到它們的代碼完全不付導入成本。
+    """
+
+    def __missing__(self, key):
+        spec = _LAZY_MODULES.get(key)
+        if spec is not None:
+            module = importlib.import_module(spec)
+            self[key] = module
+            return module
+        attr_spec = _LAZY_ATTRS.get(key)
+        if attr_spec is not None:
+            value = getattr(importlib.import_module(attr_spec[0]), attr_spec[1])
+            self[key] = value
+            return value
+        raise KeyError(key)
+
+
+def _run_in_child(code: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    在工作子進程中執行代碼（模組級函數以便 pickle）
+
+    先套用 CPU 與記憶體上限，再於受限的全域環境中執行；
+    失控的代碼最多拖垮一個工作進程，不會拖垮主進程。
+
+    Args:
+        code: 要執行的代碼
+
+    Returns:
+        包含執行輸出和結果變數的元組
+    """
+    if resource is not None:
+        # RLIMIT_CPU 計的是進程累計 CPU 時間：長駐工作進程的軟限制
+        # 必須以當前用量為基準逐任務上調（固定值在額度耗盡後會立即
+        # SIGXCPU），硬限制保持不設限才能在下次任務再調高
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu_soft = int(usage.ru_utime + usage.ru_stime) + _CHILD_CPU_SECONDS + 1
+        try:
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_soft, resource.RLIM_INFINITY))
+        except (ValueError, OSError):
+            # 某些環境不允許調整限制，降級為不設限
+            pass
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (_CHILD_MEMORY_BYTES, _CHILD_MEMORY_BYTES))
+        except (ValueError, OSError):
+            pass
+
+    # 創建捕獲輸出的緩衝區
+    old_stdout = sys.stdout
+    old_stderr = sys.stderr
+
+    redirected_output = StringIO()
+    redirected_error = StringIO()
+
+    sys.stdout = redirected_output
+    sys.stderr = redirected_error
+
+    # 創建執行環境（dict 子類：exec 查找名稱時按需導入）；
+    # 同一映射兼作全域與局部，頂層名稱查找才會走到 __missing__
+    exec_locals = LazyGlobals(result=None)
+
+    try:
+        # 執行代碼
+        exec(code, exec_locals)
+
+        # 收集輸出
+        stdout_output = redirected_output.getvalue()
+        stderr_output = redirected_error.getvalue()
+
+        # 準備結果
+        output = ""
+        if stdout_output:
+            output += f"標準輸出:\n{stdout_output}\n"
+
+        if stderr_output:
+            output += f"錯誤輸出:\n{stderr_output}\n"
+
+        # 結果變數以字符串形式回傳，避免不可 pickle 的對象卡住進程間通道
+        result = exec_locals.get("result")
+        return output, {"result": None if result is None else str(result)}
+    except Exception as e:
+        error_class = e.__class__.__name__
+        detail = e.args[0] if e.args else str(e)
+        cl, exc, tb = sys.exc_info()
+        line_number = traceback.extract_tb(tb)[-1][1]
+        error_msg = f"執行代碼出錯: {error_class} 在第 {line_number} 行: {detail}"
+        return error_msg, {"result": None}
+    finally:
+        # 恢復標準輸出
+        sys.stdout = old_stdout
+        sys.stderr = old_stderr
+
+
 class CodeExecutor:
-    """執行 Python 代碼並返回結果"""
-    
+    """在帶資源限制的子進程中執行 Python 代碼並返回結果"""
+
     def __init__(self):
         """初始化代碼執行器"""
-        # 允許載入的模組列表
-        self.allowed_modules = {
-            "os": os,
-            "sys": sys,
-            "pandas": pd,
-            "pd": pd,
-            "Path": Path,
-            "pathlib": __import__("pathlib"),
-            "datetime": __import__("datetime"),
-            "json": __import__("json"),
-            "re": __import__("re"),
-            "math": __import__("math"),
-            "random": __import__("random"),
-            "time": __import__("time"),
-            "collections": __import__("collections"),
-            "csv": __import__("csv"),
-            "io": __import__("io"),
-            "StringIO": StringIO,
-            "numpy": __import__("numpy"),
-            "matplotlib": __import__("matplotlib")
-        }
-    
-    def execute_code(self, code: str) -> Tuple[str, Dict[str, Any]]:
+        # 進程池常駐複用，免去逐次執行 fork 加載解釋器的開銷
+        self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=2)
+
+    async def execute_code(self, code: str) -> Tuple[str, Dict[str, Any]]:
         """
-        執行 Python 代碼
-        
+        在子進程中執行 Python 代碼
+
         Args:
             code: 要執行的代碼
-            
+
         Returns:
             包含執行輸出和結果變數的元組
         """
-        # 創建捕獲輸出的緩衝區
-        old_stdout = sys.stdout
-        old_stderr = sys.stderr
-        
-        redirected_output = StringIO()
-        redirected_error = StringIO()
-        
-        sys.stdout = redirected_output
-        sys.stderr = redirected_error
-        
-        # 創建執行環境
-        exec_globals = self.allowed_modules.copy()
-        exec_locals = {"result": None}
-        
-        # 清除可能存在的 __file__ 變數以避免意外存取
-        if "__file__" in exec_globals:
-            del exec_globals["__file__"]
-        
+        loop = asyncio.get_running_loop()
         try:
-            # 執行代碼
-            exec(code, exec_globals, exec_locals)
-            
-            # 收集輸出
-            stdout_output = redirected_output.getvalue()
-            stderr_output = redirected_error.getvalue()
-            
-            # 準備結果
-            output = ""
-            if stdout_output:
-                output += f"標準輸出:\n{stdout_output}\n"
-            
-            if stderr_output:
-                output += f"錯誤輸出:\n{stderr_output}\n"
-            
-            return output, exec_locals
-        except Exception as e:
-            error_class = e.__class__.__name__
-            detail = e.args[0]
-            cl, exc, tb = sys.exc_info()
-            line_number = traceback.extract_tb(tb)[-1][1]
-            error_msg = f"執行代碼出錯: {error_class} 在第 {line_number} 行: {detail}"
-            return error_msg, {"result": None}
-        finally:
-            # 恢復標準輸出
-            sys.stdout = old_stdout
-            sys.stderr = old_stderr
-    
-    def execute_code_block(self, code: str) -> str:
+            return await loop.run_in_executor(self._pool, _run_in_child, code)
+        except concurrent.futures.process.BrokenProcessPool:
+            # 子進程被資源限制殺掉（如 CPU 超時）會擊穿整個池，重建後續可用
+            self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=2)
+            return "執行代碼出錯: 子進程超出資源限制被終止", {"result": None}
+
+    async def execute_code_block(self, code: str) -> str:
         """
         執行代碼塊並返回格式化結果
-        
+
         Args:
             code: 要執行的代碼
-            
+
         Returns:
             格式化的執行結果
         """
-        output, locals_dict = self.execute_code(code)
-        
+        output, locals_dict = await self.execute_code(code)
+
         # 檢查結果變數
         result_output = ""
         if "result" in locals_dict and locals_dict["result"] is not None:
             result_output = f"結果變數:\n{locals_dict['result']}\n\n"
-        
+
         return result_output + output
-    
+
     def is_code_safe(self, code: str) -> Tuple[bool, str]:
         """
         檢查代碼是否安全
-        
+
         Args:
             code: 要檢查的代碼
-            
+
         Returns:
             包含安全標誌和原因的元組
         """
-        # 危險函數列表
-        dangerous_functions = [
-            "eval(", "exec(",
-            "os.system(", "subprocess", "os.popen(",
-            "__import__", "importlib",
-            "open(", "read(", "write(",
-            "globals(", "locals("
-        ]
-        
-        # 檢查危險函數
-        for func in dangerous_functions:
-            if func in code:
-                return False, f"代碼包含不安全的函數: {func}"
-        
-        return True, "代碼安全"
\ No newline at end of file
+        # 檢查危險函數：單趟掃描預編譯的交替式正則
+        match = _DANGEROUS_RE.search(code)
+        if match is not None:
+            return False, f"代碼包含不安全的函數: {match.group(0)}"
+
+        return True, "代碼安全"
@@ -1,21 +1,228 @@
+import io
 import os
+import hashlib
+import functools
+import multiprocessing
+import concurrent.futures
 from pathlib import Path
-import PyPDF2
-import docx
-import pandas as pd
-import nbformat
 from typing import Dict, List, Any, Optional
 
+# PyPDF2/docx/pandas/nbformat 都在各提取分支內按需導入：
+# 這些庫的冷啟動導入成本高（pandas 數百毫秒），多數會話
+# 只用到其中一兩種格式
+
+# 頁數達到此值才值得把逐頁解析攤到進程池（小文件派發開銷反而更大）
+_PDF_PARALLEL_MIN_PAGES = 8
+
+# 低於此大小的 PDF 整檔先讀進內存再解析：PyPDF2 會做大量小
+# 隨機讀，在網絡掛載路徑上每次讀都付一輪尋址延遲，順序讀一次
+# 把這些開銷攤平；超大文件仍走文件句柄以免佔用過多內存
+_PDF_BUFFER_MAX_BYTES = 64 * 1024 * 1024
+
+# 提取結果的磁盤緩存目錄：以內容指紋命名，重複上傳的同一份
+# 文件（即使換了路徑或文件名）直接讀回文本，跳過整輪解析
+_CACHE_DIR = os.path.join("cache", "docproc")
+
+# TXT 達到此大小才改用 mmap（小文件 mmap 建立開銷高於一次 read）
+_TXT_MMAP_MIN_BYTES = 1 << 20
+
+# 解析屬 CPU 密集的格式走進程池；其餘（TXT/CSV）讀文件為主，線程池即可
+_CPU_BOUND_EXTS = frozenset({'.pdf', '.docx', '.ipynb'})
+
+
+def _extract_one(file_path: str) -> str:
+    """進程池工作函數：提取單個文件的文本（模組級以便 pickle）"""
+    return DocumentProcessor().extract_text(file_path)
+
+
+def _content_fingerprint(file_path: str, size: int) -> str:
+    """
+    計算文件的內容指紋（前 1MB 字節 + 文件大小）
+
+    Args:
+        file_path: 文件路徑
+        size: 文件大小（字節）
+
+    Returns:
+        blake2b 十六進制摘要
+    """
+    with open(file_path, 'rb') as file:
+        head = file.read(1 << 20)
+    return hashlib.blake2b(
+        head + size.to_bytes(8, "little"), digest_size=16
+    ).hexdigest()
+
+
+def _extract_page_text(page, reader) -> str:
+    """
+    提取單頁文本，先剔除內容流中的非文本繪製指令
+
+    page.extract_text() 會連同 /XObject（圖像等）一起走訪，
+    圖像密集的 PDF 常因此停滯數分鐘；輸出只要文本，先把 Do
+    （繪製 XObject）與內聯圖像指令從內容流中濾掉再交給
+    PyPDF2 解碼，字體 cmap 處理等仍沿用其原邏輯。ContentStream
+    解析時會把整段 BI…EI 合併成單一 "INLINE IMAGE" 操作，
+    過濾須比對該合成操作符而非原始指令。
+
+    Args:
+        page: PyPDF2 頁面對象
+        reader: 所屬的 PdfReader
+
+    Returns:
+        該頁的文本
+    """
+    from PyPDF2.generic import ContentStream, NameObject
+
+    try:
+        content = ContentStream(page.get_contents(), reader)
+        content.operations = [
+            (operands, operator)
+            for operands, operator in content.operations
+            if operator not in (b"Do", b"INLINE IMAGE")
+        ]
+        page[NameObject("/Contents")] = content
+    except Exception:
+        # 內容流改寫失敗時退回原始提取，寧慢勿缺
+        pass
+    return page.extract_text()
+
+
+def _extract_pdf_page(args) -> str:
+    """
+    進程池工作函數：提取 PDF 單頁文本
+
+    每個工作進程各自打開文件解析，PyPDF2 的 CPU 密集解碼
+    得以繞過 GIL 並行執行。
+
+    Args:
+        args: (文件路徑, 頁碼) 元組
+
+    Returns:
+        該頁的文本
+    """
+    file_path, page_num = args
+    import PyPDF2
+
+    with open(file_path, 'rb') as file:
+        source = io.BytesIO(file.read())
+    pdf_reader = PyPDF2.PdfReader(source)
+    return _extract_page_text(pdf_reader.pages[page_num], pdf_reader)
+
+
 class DocumentProcessor:
     """處理各種文件格式並提取文本"""
     
     def extract_text(self, file_path: str) -> str:
         """
-        從各種文件類型提取文本
-        
+        從各種文件類型提取文本（帶內容指紋緩存）
+
+        同一進程內以 (路徑, 修改時間, 大小) 做熱緩存；跨進程、
+        跨會話則以內容指紋命中磁盤緩存，重複文件免去解析成本。
+
         Args:
             file_path: 文件路徑
-            
+
+        Returns:
+            提取的文本
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError as e:
+            return f"提取文本時出錯: {str(e)}"
+        return DocumentProcessor._extract_cached(
+            file_path, stat.st_mtime_ns, stat.st_size
+        )
+
+    @staticmethod
+    @functools.lru_cache(maxsize=32)
+    def _extract_cached(file_path: str, mtime_ns: int, size: int) -> str:
+        """進程內熱緩存層：同一文件的重複讀取直接返回"""
+        processor = DocumentProcessor()
+        try:
+            digest = _content_fingerprint(file_path, size)
+        except OSError:
+            return processor._extract_uncached(file_path)
+
+        cache_path = os.path.join(_CACHE_DIR, f"{digest}.txt")
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as file:
+                return file.read()
+        except OSError:
+            pass
+
+        text = processor._extract_uncached(file_path)
+
+        # 提取失敗的錯誤訊息不落盤，換一份好文件或修復環境後可重試
+        if "出錯:" not in text[:40] and not text.startswith("不支持"):
+            try:
+                os.makedirs(_CACHE_DIR, exist_ok=True)
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as file:
+                    file.write(text)
+                os.replace(tmp_path, cache_path)  # 原子替換，讀方不見半成品
+            except OSError:
+                pass
+        return text
+
+    def extract_texts(self, file_paths: List[str]) -> List[str]:
+        """
+        批次提取多個文件的文本
+
+        按格式分流：CPU 密集的 PDF/DOCX/Notebook 解析派發到進程池
+        繞過 GIL，輕量的 TXT/CSV 用線程池攤平文件 I/O；混合批次
+        的總耗時接近最慢單檔而非全部累加。
+
+        Args:
+            file_paths: 文件路徑列表
+
+        Returns:
+            與輸入同順序的文本列表（單檔失敗時該位置為錯誤訊息）
+        """
+        if not file_paths:
+            return []
+        if len(file_paths) == 1:
+            return [self.extract_text(file_paths[0])]
+
+        max_workers = int(os.getenv(
+            "DOCPROC_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))
+        ))
+        results: List[Optional[str]] = [None] * len(file_paths)
+        cpu_jobs = []
+        light_jobs = []
+        for idx, path in enumerate(file_paths):
+            if Path(path).suffix.lower() in _CPU_BOUND_EXTS:
+                cpu_jobs.append((idx, path))
+            else:
+                light_jobs.append((idx, path))
+
+        # 已在子進程中時不可再開進程池，重格式也退回線程池
+        if cpu_jobs and not multiprocessing.current_process().daemon:
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(max_workers, len(cpu_jobs))
+            ) as pool:
+                texts = pool.map(_extract_one, (path for _, path in cpu_jobs))
+                for (idx, _), text in zip(cpu_jobs, texts):
+                    results[idx] = text
+            cpu_jobs = []
+
+        remaining = light_jobs + cpu_jobs
+        if remaining:
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(max_workers, len(remaining))
+            ) as pool:
+                texts = pool.map(self.extract_text, (path for _, path in remaining))
+                for (idx, _), text in zip(remaining, texts):
+                    results[idx] = text
+
+        return results
+
+    def _extract_uncached(self, file_path: str) -> str:
+        """
+        按文件類型分發到對應的提取方法（不經緩存）
+
+        Args:
+            file_path: 文件路徑
+
         Returns:
             提取的文本
         """
@@ -44,16 +251,59 @@ class DocumentProcessor:
         Returns:
             提取的文本
         """
-        text = ""
+        # 優先用 pypdfium2（PDFium 的 C++ 綁定）：原生解析與取字，
+        # 比 PyPDF2 的純 Python 逐字節掃描快一個量級；未安裝或
+        # 解析失敗時退回 PyPDF2
         try:
-            with open(file_path, 'rb') as file:
+            import pypdfium2 as pdfium
+        except ImportError:
+            pdfium = None
+
+        if pdfium is not None:
+            try:
+                pdf = pdfium.PdfDocument(file_path)
+                try:
+                    parts = [
+                        page.get_textpage().get_text_range() for page in pdf
+                    ]
+                finally:
+                    pdf.close()
+                return "\n".join(parts) + "\n"
+            except Exception:
+                pass
+
+        import PyPDF2
+
+        try:
+            if os.path.getsize(file_path) < _PDF_BUFFER_MAX_BYTES:
+                with open(file_path, 'rb') as raw:
+                    source = io.BytesIO(raw.read())
+            else:
+                source = open(file_path, 'rb')
+            with source as file:
                 pdf_reader = PyPDF2.PdfReader(file)
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    text += page.extract_text() + "\n"
+                num_pages = len(pdf_reader.pages)
+
+                # 大 PDF 的逐頁解碼攤到進程池並行；已在子進程中
+                # （批次上傳的整檔提取）時不可再開池，退回串行
+                if (num_pages >= _PDF_PARALLEL_MIN_PAGES
+                        and not multiprocessing.current_process().daemon):
+                    with concurrent.futures.ProcessPoolExecutor(
+                        max_workers=min(num_pages, max(1, (os.cpu_count() or 2) - 1))
+                    ) as pool:
+                        # map 保持頁面順序，結果一次 join 而非逐頁 +=
+                        parts = list(pool.map(
+                            _extract_pdf_page,
+                            ((file_path, idx) for idx in range(num_pages)),
+                        ))
+                else:
+                    parts = [
+                        _extract_page_text(page, pdf_reader)
+                        for page in pdf_reader.pages
+                    ]
+            return "\n".join(parts) + "\n"
         except Exception as e:
-            text = f"從PDF提取文本時出錯: {str(e)}"
-        return text
+            return f"從PDF提取文本時出錯: {str(e)}"
     
     def extract_text_from_docx(self, file_path: str) -> str:
         """
@@ -65,14 +315,28 @@ class DocumentProcessor:
         Returns:
             提取的文本
         """
-        text = ""
+        # 用 lxml 流式解析 word/document.xml 取文本：docx.Document
+        # 會構建整棵 DOM 並為每段生成 Paragraph 包裝對象，長文檔的
+        # Python 對象創建成本遠高於文本本身；iterparse 逐段取字後
+        # 即時釋放節點，內存佔用也有上限
+        import zipfile
+        from lxml import etree
+
+        _W_P = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}p'
+
         try:
-            doc = docx.Document(file_path)
-            for para in doc.paragraphs:
-                text += para.text + "\n"
+            parts = []
+            with zipfile.ZipFile(file_path) as archive:
+                with archive.open('word/document.xml') as xml_file:
+                    for _, element in etree.iterparse(xml_file, tag=_W_P):
+                        parts.append(f"{''.join(element.itertext())}\n")
+                        # 釋放已處理節點與其前驅兄弟，避免樹持續增長
+                        element.clear()
+                        while element.getprevious() is not None:
+                            del element.getparent()[0]
+            return "".join(parts)
         except Exception as e:
-            text = f"從DOCX提取文本時出錯: {str(e)}"
-        return text
+            return f"從DOCX提取文本時出錯: {str(e)}"
     
     def extract_text_from_txt(self, file_path: str) -> str:
         """
@@ -84,37 +348,71 @@ class DocumentProcessor:
         Returns:
             提取的文本
         """
+        import mmap
+
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return file.read()
-        except UnicodeDecodeError:
-            # 如果 UTF-8 解碼失敗，嘗試其他編碼
+            with open(file_path, 'rb') as file:
+                # 大文件用 mmap 讓內核按頁調入，免去 read() 的中間
+                # 緩衝副本；小文件 mmap 的建立開銷反而不划算
+                if os.path.getsize(file_path) >= _TXT_MMAP_MIN_BYTES:
+                    with mmap.mmap(
+                        file.fileno(), 0, access=mmap.ACCESS_READ
+                    ) as mapped:
+                        raw = mapped[:]
+                else:
+                    raw = file.read()
             try:
-                with open(file_path, 'r', encoding='latin-1') as file:
-                    return file.read()
-            except Exception as e:
-                return f"從TXT提取文本時出錯: {str(e)}"
+                return raw.decode('utf-8')
+            except UnicodeDecodeError:
+                # UTF-8 以外的編碼用 charset-normalizer 嗅探（只看
+                # 前 64KB），單次讀取單次解碼，不再重開文件重試
+                from charset_normalizer import from_bytes
+
+                best = from_bytes(raw[:65536]).best()
+                encoding = best.encoding if best is not None else 'latin-1'
+                return raw.decode(encoding, errors='replace')
         except Exception as e:
             return f"從TXT提取文本時出錯: {str(e)}"
     
-    def extract_text_from_csv(self, file_path: str) -> str:
+    def extract_text_from_csv(self, file_path: str, structured: bool = False) -> str:
         """
-        從CSV文件提取文本為結構化字符串
-        
+        從CSV文件提取文本
+
         Args:
             file_path: CSV文件路徑
-            
+            structured: 是否經解析器往返規整格式；默認直接透傳原始文本
+
         Returns:
             提取的文本
         """
+        # 默認直通：LLM 消費端接受原始 CSV，解析成類型化列再格式
+        # 化回文本是純粹的重複勞動，只讀字節（帶編碼嗅探）即可
+        if not structured:
+            return self.extract_text_from_txt(file_path)
+
+        # 優先用 pyarrow 的多線程 CSV 解析器：to_string 會逐格走
+        # Python 層格式化，多 MB 的 CSV 既慢又吃內存；Arrow 解析
+        # 與序列化都在 C++ 層完成
+        try:
+            import pyarrow.csv as pacsv
+
+            table = pacsv.read_csv(file_path)
+            buf = io.BytesIO()
+            pacsv.write_csv(table, buf)
+            return buf.getvalue().decode('utf-8')
+        except Exception:
+            pass
+
+        import pandas as pd
+
         try:
             df = pd.read_csv(file_path)
-            return df.to_string(index=False)
+            return df.to_csv(index=False)
         except Exception as e:
             try:
                 # 嘗試不同的編碼
                 df = pd.read_csv(file_path, encoding='latin-1')
-                return df.to_string(index=False)
+                return df.to_csv(index=False)
             except Exception as e2:
                 return f"從CSV提取文本時出錯: {str(e)}, {str(e2)}"
     
@@ -128,17 +426,28 @@ class DocumentProcessor:
         Returns:
             提取的文本
         """
+        # 直接 json 解析而非 nbformat.read：nbformat 會做 schema
+        # 校驗並實例化每個 cell（含內嵌圖片等 outputs 的 base64
+        # 負載），對帶大量輸出的 notebook 是提取的主要成本；這裡
+        # 只取 source，outputs 完全不碰
+        import json
+
         try:
             with open(file_path, 'r', encoding='utf-8') as file:
-                notebook = nbformat.read(file, as_version=4)
-            
-            text = ""
-            for cell in notebook.cells:
-                if cell.cell_type == 'markdown':
-                    text += cell.source + "\n\n"
-                elif cell.cell_type == 'code':
-                    text += f"```python\n{cell.source}\n```\n\n"
-            
-            return text
+                notebook = json.load(file)
+
+            parts = []
+            for cell in notebook.get('cells', []):
+                source = cell.get('source', '')
+                # 原始 JSON 的 source 可能是按行拆分的列表
+                if isinstance(source, list):
+                    source = "".join(source)
+                cell_type = cell.get('cell_type')
+                if cell_type == 'markdown':
+                    parts.append(f"{source}\n\n")
+                elif cell_type == 'code':
+                    parts.append(f"```python\n{source}\n```\n\n")
+
+            return "".join(parts)
         except Exception as e:
             return f"從Notebook提取文本時出錯: {str(e)}"
\ No newline at end of file
@@ -1,28 +1,96 @@
 import os
 import sys
+import time
 import shutil
+import functools
 import platform
 import asyncio
 import subprocess
 from typing import Dict, List, Tuple, Optional
 from pathlib import Path
 
+@functools.lru_cache(maxsize=None)
+def _which(cmd: str) -> Optional[str]:
+    """shutil.which 的記憶化包裝：每個命令的 PATH 掃描只做一次"""
+    return shutil.which(cmd)
+
+
+async def _probe_version(cmd: str, *args: str, timeout: float = 3.0) -> Optional[str]:
+    """
+    執行版本探測命令，只讀首行輸出
+
+    communicate() 會緩衝子進程的全部輸出，行為異常的二進制把
+    整頁幫助打到 stdout 時白白複製數 MB；這裡限時讀一行就回收
+    子進程，卡住的探測（如掛起的 dotnet --version）只拖住
+    timeout 秒而非凍結整個代理循環。
+
+    Args:
+        cmd: 命令名稱
+        *args: 命令參數
+        timeout: 等待首行輸出的秒數上限
+
+    Returns:
+        輸出的首行（已去除空白）；超時或執行失敗時為 None
+    """
+    try:
+        process = await asyncio.create_subprocess_exec(
+            cmd, *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+    except OSError:
+        return None
+    try:
+        line = await asyncio.wait_for(process.stdout.readline(), timeout=timeout)
+    except asyncio.TimeoutError:
+        return None
+    finally:
+        try:
+            process.terminate()
+        except ProcessLookupError:
+            pass
+        await process.wait()
+    return line.decode().strip()
+
+
 class EnvironmentChecker:
     """檢查系統環境並提供安裝指南"""
+
+    # 語言別名映射在類層級建一次，標準化時只剩一次字典查找
+    _LANG_MAP = {
+        "py": "python",
+        "js": "javascript",
+        "node": "javascript",
+        "c#": "csharp",
+        "cs": "csharp",
+        "c++": "cpp",
+        "c": "cpp",
+        "rb": "ruby"
+    }
+
+    # 語言到檢查方法名的映射（類層級共享，實例化時不再重建）
+    _LANGUAGE_CHECKS = {
+        "python": "_check_python",
+        "javascript": "_check_javascript",
+        "java": "_check_java",
+        "csharp": "_check_csharp",
+        "cpp": "_check_cpp",
+        "php": "_check_php",
+        "ruby": "_check_ruby",
+        "r": "_check_r"
+    }
     
-    def __init__(self):
-        """初始化環境檢查器"""
+    def __init__(self, cache_ttl: float = 300.0):
+        """
+        初始化環境檢查器
+
+        Args:
+            cache_ttl: 檢查結果緩存的有效時間（秒）
+        """
         self.os_type = platform.system().lower()  # 'windows', 'darwin' (macOS), 'linux'
-        self.language_environments = {
-            "python": self._check_python,
-            "javascript": self._check_javascript,
-            "java": self._check_java,
-            "csharp": self._check_csharp,
-            "cpp": self._check_cpp,
-            "php": self._check_php,
-            "ruby": self._check_ruby,
-            "r": self._check_r
-        }
+        self.cache_ttl = cache_ttl
+        # 檢查結果緩存：環境狀態變化的時間尺度遠大於請求頻率
+        self._check_cache: Dict[str, Tuple[float, bool, str]] = {}
     
     async def check_environment(self, language: str) -> Tuple[bool, str]:
         """
@@ -35,29 +103,47 @@ class EnvironmentChecker:
             (是否支持, 資訊/指南)
         """
         language = self._normalize_language(language)
-        
-        if language in self.language_environments:
-            return await self.language_environments[language]()
+
+        # 命中未過期的緩存時直接返回，避免重複啟動探測子進程
+        cached = self._check_cache.get(language)
+        now = time.monotonic()
+        if cached is not None and now - cached[0] < self.cache_ttl:
+            return cached[1], cached[2]
+
+        check_name = self._LANGUAGE_CHECKS.get(language)
+        if check_name is not None:
+            supported, message = await getattr(self, check_name)()
         else:
-            return False, f"不支持檢查 {language} 語言環境。"
+            supported, message = False, f"不支持檢查 {language} 語言環境。"
+
+        self._check_cache[language] = (now, supported, message)
+        return supported, message
     
+    async def check_all(self, languages: Optional[List[str]] = None) -> Dict[str, Tuple[bool, str]]:
+        """
+        併發檢查多種語言的執行環境
+
+        各檢查的子進程等待相互重疊，總耗時收斂為最慢的單項
+        而非各項之和。
+
+        Args:
+            languages: 要檢查的語言列表，為 None 時檢查所有已知語言
+
+        Returns:
+            語言名稱到 (是否支持, 資訊/指南) 的字典
+        """
+        if languages is None:
+            languages = list(self._LANGUAGE_CHECKS.keys())
+
+        results = await asyncio.gather(
+            *(self.check_environment(language) for language in languages)
+        )
+        return dict(zip(languages, results))
+
     def _normalize_language(self, language: str) -> str:
         """標準化語言名稱"""
         language = language.lower().strip()
-        
-        # 映射語言別名到標準名稱
-        language_map = {
-            "py": "python",
-            "js": "javascript",
-            "node": "javascript",
-            "c#": "csharp",
-            "cs": "csharp",
-            "c++": "cpp",
-            "c": "cpp",
-            "rb": "ruby"
-        }
-        
-        return language_map.get(language, language)
+        return self._LANG_MAP.get(language, language)
     
     async def _check_python(self) -> Tuple[bool, str]:
         """檢查 Python 環境"""
@@ -67,21 +153,15 @@ class EnvironmentChecker:
     
     async def _check_javascript(self) -> Tuple[bool, str]:
         """檢查 JavaScript (Node.js) 環境"""
-        node_path = shutil.which("node")
-        npm_path = shutil.which("npm")
+        node_path = _which("node")
+        npm_path = _which("npm")
         
         if node_path and npm_path:
             # 取得 Node.js 版本
-            try:
-                process = await asyncio.create_subprocess_exec(
-                    "node", "--version",
-                    stdout=asyncio.subprocess.PIPE
-                )
-                stdout, _ = await process.communicate()
-                version = stdout.decode().strip()
+            version = await _probe_version("node", "--version")
+            if version:
                 return True, f"Node.js {version} 與 npm 已安裝並可用。"
-            except:
-                return True, "Node.js 與 npm 已安裝並可用。"
+            return True, "Node.js 與 npm 已安裝並可用。"
         else:
             # 提供安裝指南
             guide = "### 安裝 Node.js 與 npm\n\n"
@@ -108,21 +188,15 @@ class EnvironmentChecker:
     
     async def _check_java(self) -> Tuple[bool, str]:
         """檢查 Java 環境"""
-        java_path = shutil.which("java")
-        javac_path = shutil.which("javac")
+        java_path = _which("java")
+        javac_path = _which("javac")
         
         if java_path and javac_path:
             # 取得 Java 版本
-            try:
-                process = await asyncio.create_subprocess_exec(
-                    "java", "--version",
-                    stdout=asyncio.subprocess.PIPE
-                )
-                stdout, _ = await process.communicate()
-                version_info = stdout.decode().strip().split("\n")[0]
+            version_info = await _probe_version("java", "--version")
+            if version_info:
                 return True, f"Java 開發環境已安裝並可用: {version_info}"
-            except:
-                return True, "Java 開發環境已安裝並可用。"
+            return True, "Java 開發環境已安裝並可用。"
         else:
             # 提供安裝指南
             guide = "### 安裝 Java 開發環境 (JDK)\n\n"
@@ -152,19 +226,13 @@ class EnvironmentChecker:
     # 實現其他語言的環境檢查...
     async def _check_csharp(self) -> Tuple[bool, str]:
         """檢查 C# (.NET) 環境"""
-        dotnet_path = shutil.which("dotnet")
+        dotnet_path = _which("dotnet")
         
         if dotnet_path:
-            try:
-                process = await asyncio.create_subprocess_exec(
-                    "dotnet", "--version",
-                    stdout=asyncio.subprocess.PIPE
-                )
-                stdout, _ = await process.communicate()
-                version = stdout.decode().strip()
+            version = await _probe_version("dotnet", "--version")
+            if version:
                 return True, f".NET SDK {version} 已安裝並可用。"
-            except:
-                return True, ".NET SDK 已安裝並可用。"
+            return True, ".NET SDK 已安裝並可用。"
         else:
             guide = "### 安裝 .NET SDK (用於 C# 開發)\n\n"
             guide += "1. 訪問 .NET 下載頁面: https://dotnet.microsoft.com/download\n"
@@ -185,8 +253,8 @@ class EnvironmentChecker:
         """檢查 C/C++ 環境"""
         if self.os_type == "windows":
             # 在 Windows 上檢查是否安裝了 MSVC 或 MinGW
-            msvc_cl = shutil.which("cl")
-            gcc = shutil.which("g++")
+            msvc_cl = _which("cl")
+            gcc = _which("g++")
             
             if msvc_cl:
                 return True, "Microsoft Visual C++ 已安裝並可用。"
@@ -205,31 +273,19 @@ class EnvironmentChecker:
                 return False, guide
         else:
             # 在 macOS/Linux 上檢查 GCC 或 Clang
-            gcc = shutil.which("g++")
-            clang = shutil.which("clang++")
+            gcc = _which("g++")
+            clang = _which("clang++")
             
             if gcc:
-                try:
-                    process = await asyncio.create_subprocess_exec(
-                        "g++", "--version",
-                        stdout=asyncio.subprocess.PIPE
-                    )
-                    stdout, _ = await process.communicate()
-                    version_info = stdout.decode().strip().split("\n")[0]
+                version_info = await _probe_version("g++", "--version")
+                if version_info:
                     return True, f"GCC C++ 編譯器已安裝並可用: {version_info}"
-                except:
-                    return True, "GCC C++ 編譯器已安裝並可用。"
+                return True, "GCC C++ 編譯器已安裝並可用。"
             elif clang:
-                try:
-                    process = await asyncio.create_subprocess_exec(
-                        "clang++", "--version",
-                        stdout=asyncio.subprocess.PIPE
-                    )
-                    stdout, _ = await process.communicate()
-                    version_info = stdout.decode().strip().split("\n")[0]
+                version_info = await _probe_version("clang++", "--version")
+                if version_info:
                     return True, f"Clang C++ 編譯器已安裝並可用: {version_info}"
-                except:
-                    return True, "Clang C++ 編譯器已安裝並可用。"
+                return True, "Clang C++ 編譯器已安裝並可用。"
             else:
                 # 提供安裝指南
                 guide = "### 安裝 C/C++ 開發環境\n\n"
@@ -250,19 +306,13 @@ class EnvironmentChecker:
     # 其他檢查方法的實現...
     async def _check_php(self) -> Tuple[bool, str]:
         """檢查 PHP 環境"""
-        php_path = shutil.which("php")
+        php_path = _which("php")
         
         if php_path:
-            try:
-                process = await asyncio.create_subprocess_exec(
-                    "php", "--version",
-                    stdout=asyncio.subprocess.PIPE
-                )
-                stdout, _ = await process.communicate()
-                version_info = stdout.decode().strip().split("\n")[0]
+            version_info = await _probe_version("php", "--version")
+            if version_info:
                 return True, f"PHP 已安裝並可用: {version_info}"
-            except:
-                return True, "PHP 已安裝並可用。"
+            return True, "PHP 已安裝並可用。"
         else:
             guide = "### 安裝 PHP\n\n"
             
@@ -290,19 +340,13 @@ class EnvironmentChecker:
     
     async def _check_ruby(self) -> Tuple[bool, str]:
         """檢查 Ruby 環境"""
-        ruby_path = shutil.which("ruby")
+        ruby_path = _which("ruby")
         
         if ruby_path:
-            try:
-                process = await asyncio.create_subprocess_exec(
-                    "ruby", "--version",
-                    stdout=asyncio.subprocess.PIPE
-                )
-                stdout, _ = await process.communicate()
-                version = stdout.decode().strip()
+            version = await _probe_version("ruby", "--version")
+            if version:
                 return True, f"Ruby {version} 已安裝並可用。"
-            except:
-                return True, "Ruby 已安裝並可用。"
+            return True, "Ruby 已安裝並可用。"
         else:
             guide = "### 安裝 Ruby\n\n"
             
@@ -324,19 +368,13 @@ class EnvironmentChecker:
     
     async def _check_r(self) -> Tuple[bool, str]:
         """檢查 R 環境"""
-        r_path = shutil.which("R") or shutil.which("Rscript")
+        r_path = _which("R") or _which("Rscript")
         
         if r_path:
-            try:
-                process = await asyncio.create_subprocess_exec(
-                    r_path, "--version",
-                    stdout=asyncio.subprocess.PIPE
-                )
-                stdout, _ = await process.communicate()
-                version_info = stdout.decode().strip()
+            version_info = await _probe_version(r_path, "--version")
+            if version_info:
                 return True, f"R {version_info} 已安裝並可用。"
-            except:
-                return True, "R 已安裝並可用。"
+            return True, "R 已安裝並可用。"
         else:
             guide = "### 安裝 R\n\n"
             
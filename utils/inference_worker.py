@@ -0,0 +1,88 @@
+#inference_worker.py
+import asyncio
+from typing import Any, List, Optional, Tuple
+
+
+class InferenceWorker:
+    """
+    LLM 調用微批次工作器
+
+    短時間窗口內到達的多個 kernel.invoke 調用會被收集到同一批，
+    再統一併發派發。Azure OpenAI 聊天端點沒有原生的多提示批次接口，
+    因此批內調用以 asyncio.gather 併發執行，仍可共享連接並避免
+    每個調用各自排隊等待事件循環。
+    """
+
+    def __init__(self, max_batch: int = 16, flush_ms: int = 20):
+        """
+        初始化工作器
+
+        Args:
+            max_batch: 單批最多收集的調用數
+            flush_ms: 等待湊批的最長時間（毫秒）
+        """
+        self.max_batch = max_batch
+        self.flush_ms = flush_ms
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self, kernel, function, arguments) -> Any:
+        """
+        提交一個 LLM 調用並等待結果
+
+        Args:
+            kernel: Semantic Kernel 實例
+            function: 要調用的 kernel 函數
+            arguments: KernelArguments 參數
+
+        Returns:
+            kernel.invoke 的結果
+        """
+        self._ensure_loop()
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        await self._queue.put((kernel, function, arguments, future))
+        return await future
+
+    def _ensure_loop(self):
+        """確保派發循環已啟動（惰性初始化，需在事件循環內調用）"""
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self):
+        """派發循環：收集短窗口內的調用並統一派發"""
+        while True:
+            batch = [await self._queue.get()]
+
+            deadline = asyncio.get_running_loop().time() + self.flush_ms / 1000.0
+            try:
+                async with asyncio.timeout_at(deadline):
+                    while len(batch) < self.max_batch:
+                        batch.append(await self._queue.get())
+            except asyncio.TimeoutError:
+                pass
+
+            await self._dispatch(batch)
+
+    async def _dispatch(self, batch: List[Tuple[Any, Any, Any, asyncio.Future]]):
+        """
+        併發派發一批調用並回填各自的 Future
+
+        Args:
+            batch: (kernel, function, arguments, future) 的列表
+        """
+        results = await asyncio.gather(
+            *(kernel.invoke(function, arguments)
+              for kernel, function, arguments, _ in batch),
+            return_exceptions=True,
+        )
+
+        for (_, _, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
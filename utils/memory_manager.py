@@ -1,24 +1,33 @@
 #memory_manager.py
-from typing import List, Dict, Any, Optional
+from collections import deque
+from itertools import islice
+from typing import Iterable, List, Dict, Any, Optional, Tuple
 import time
 
 class MemoryManager:
     """管理對話記憶的工具類"""
-    
+
     def __init__(self, max_items: int = 50):
         """
         初始化記憶管理器
-        
+
         Args:
             max_items: 最大記憶項數量
         """
-        self.memories = []
+        # 有界 deque：超量時自動淘汰最舊項，免去列表切片複製
+        self.memories = deque(maxlen=max_items)
+        # 與 memories 同步淘汰的預小寫 UTF-8 字節內容：bytes 的
+        # 子串掃描走 memchr/Two-Way 快路徑，搜索時也不再逐項 lower()
+        self._lower_contents = deque(maxlen=max_items)
         self.max_items = max_items
-    
+        self.version = 0  # 記憶變動版本號，供調用方做髒位緩存
+        # 全量渲染結果緩存：(版本號, 文本)，版本未變時直接重用
+        self._text_cache = (-1, "")
+
     def add_memory(self, content: str, role: str, metadata: Optional[Dict[str, Any]] = None):
         """
         添加新的記憶項
-        
+
         Args:
             content: 記憶內容
             role: 角色 (user/assistant/system)
@@ -30,24 +39,41 @@ class MemoryManager:
             "timestamp": time.time(),
             "metadata": metadata or {}
         }
-        
+
         self.memories.append(memory_item)
-        
-        # 如果超出最大數量，移除最舊的記憶
-        if len(self.memories) > self.max_items:
-            self.memories = self.memories[-self.max_items:]
-    
+        self._lower_contents.append(content.lower().encode('utf-8'))
+        self.version += 1
+
+    def add_memories(self, items: Iterable[Tuple[str, str]]):
+        """
+        批次添加記憶項（一回合的用戶消息與回應一次寫入）
+
+        Args:
+            items: (內容, 角色) 元組的可迭代對象
+        """
+        now = time.time()
+        items = list(items)
+        self.memories.extend(
+            {"content": content, "role": role, "timestamp": now, "metadata": {}}
+            for content, role in items
+        )
+        self._lower_contents.extend(
+            content.lower().encode('utf-8') for content, _ in items
+        )
+        self.version += 1
+
     def get_recent_memories(self, count: int = 10) -> List[Dict[str, Any]]:
         """
         獲取最近的記憶
-        
+
         Args:
             count: 要獲取的記憶數量
-            
+
         Returns:
             最近的記憶列表
         """
-        return self.memories[-count:] if len(self.memories) >= count else self.memories
+        start = max(0, len(self.memories) - count)
+        return list(islice(self.memories, start, len(self.memories)))
     
     def search_memories(self, query: str) -> List[Dict[str, Any]]:
         """
@@ -59,8 +85,13 @@ class MemoryManager:
         Returns:
             匹配的記憶列表
         """
-        # 簡單實現：關鍵詞匹配
-        return [m for m in self.memories if query.lower() in m["content"].lower()]
+        # 簡單實現：查詢小寫並編碼一次，與預小寫字節副本比對
+        query_bytes = query.lower().encode('utf-8')
+        return [
+            memory
+            for memory, content in zip(self.memories, self._lower_contents)
+            if query_bytes in content
+        ]
     
     def format_as_text(self, memories: Optional[List[Dict[str, Any]]] = None) -> str:
         """
@@ -72,15 +103,23 @@ class MemoryManager:
         Returns:
             格式化的文本
         """
+        # 全量渲染按版本號緩存：記憶未變動的連續調用免去重新拼接
         if memories is None:
-            memories = self.memories
-        
-        text = ""
-        for m in memories:
-            text += f"{m['role'].capitalize()}: {m['content']}\n"
-        
-        return text
+            if self._text_cache[0] != self.version:
+                text = "".join(
+                    f"{m['role'].capitalize()}: {m['content']}\n"
+                    for m in self.memories
+                )
+                self._text_cache = (self.version, text)
+            return self._text_cache[1]
+
+        # 列表收集一次 join：逐次 += 會在每輪複製整串累積文本
+        return "".join(
+            f"{m['role'].capitalize()}: {m['content']}\n" for m in memories
+        )
     
     def clear(self):
         """清除所有記憶"""
-        self.memories = []
\ No newline at end of file
+        self.memories.clear()
+        self._lower_contents.clear()
+        self.version += 1
\ No newline at end of file
@@ -0,0 +1,78 @@
+#persistent_cache.py
+import json
+import os
+from typing import Any, Dict, Optional
+
+
+class PersistentCache:
+    """JSON 檔案持久化緩存，按命名空間隔離，超出容量時淘汰最舊條目"""
+
+    def __init__(self, path: str, max_items: int = 256):
+        """
+        初始化持久化緩存
+
+        Args:
+            path: 緩存 JSON 檔案路徑
+            max_items: 每個命名空間的最大條目數
+        """
+        self.path = path
+        self.max_items = max_items
+        self._data: Optional[Dict[str, Dict[str, Any]]] = None
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        """
+        查詢緩存
+
+        Args:
+            namespace: 命名空間（通常為功能名稱，避免跨功能衝突）
+            key: 緩存鍵
+
+        Returns:
+            命中時返回緩存值，否則返回 None
+        """
+        self._load()
+        bucket = self._data.get(namespace)
+        if bucket is None:
+            return None
+        return bucket.get(key)
+
+    def put(self, namespace: str, key: str, value: Any):
+        """
+        寫入緩存並落盤，超出容量時淘汰該命名空間最舊的條目
+
+        Args:
+            namespace: 命名空間
+            key: 緩存鍵
+            value: 緩存值（需可 JSON 序列化）
+        """
+        self._load()
+        bucket = self._data.setdefault(namespace, {})
+        bucket.pop(key, None)
+        bucket[key] = value
+        while len(bucket) > self.max_items:
+            bucket.pop(next(iter(bucket)))
+        self._save()
+
+    def _load(self):
+        """惰性載入緩存檔案（首次訪問時讀取一次，之後常駐內存）"""
+        if self._data is not None:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._data = data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            self._data = {}
+
+    def _save(self):
+        """原子寫回緩存檔案（先寫臨時檔再替換，避免寫一半被讀到）"""
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"持久化緩存寫入失敗: {str(e)}")
@@ -0,0 +1,74 @@
+#response_cache.py
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class ResponseCache:
+    """LLM 回應緩存工具類，按命名空間隔離，精確匹配鍵，LRU 淘汰"""
+
+    def __init__(self, max_items: int = 128):
+        """
+        初始化回應緩存
+
+        Args:
+            max_items: 每個命名空間的最大條目數
+        """
+        self.max_items = max_items
+        self._namespaces: Dict[str, "OrderedDict[str, Any]"] = {}
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """
+        正規化緩存鍵（壓縮空白並轉小寫）
+
+        Args:
+            text: 原始文本
+
+        Returns:
+            正規化後的鍵
+        """
+        return " ".join(text.split()).lower()
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        """
+        查詢緩存
+
+        Args:
+            namespace: 命名空間（通常為功能名稱，避免跨功能衝突）
+            key: 緩存鍵
+
+        Returns:
+            命中時返回緩存值，否則返回 None
+        """
+        bucket = self._namespaces.get(namespace)
+        if bucket is None or key not in bucket:
+            return None
+        bucket.move_to_end(key)
+        return bucket[key]
+
+    def put(self, namespace: str, key: str, value: Any):
+        """
+        寫入緩存，超出容量時淘汰該命名空間最舊的條目
+
+        Args:
+            namespace: 命名空間
+            key: 緩存鍵
+            value: 緩存值
+        """
+        bucket = self._namespaces.setdefault(namespace, OrderedDict())
+        bucket[key] = value
+        bucket.move_to_end(key)
+        if len(bucket) > self.max_items:
+            bucket.popitem(last=False)
+
+    def clear(self, namespace: Optional[str] = None):
+        """
+        清除緩存
+
+        Args:
+            namespace: 要清除的命名空間，為 None 時清除全部
+        """
+        if namespace is None:
+            self._namespaces.clear()
+        else:
+            self._namespaces.pop(namespace, None)